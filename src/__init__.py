@@ -1,22 +1,31 @@
 """
-Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.  
+Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
 
 SPDX-License-Identifier: CC-BY-NC-4.0
 """
 
 import sys
-import os
 from os import path as osp
 
-# initialize recursion
 current_folder = osp.dirname(osp.abspath(__file__))
-folder_list = [current_folder]
 
-# BF
-while len(folder_list) > 0:
-    folder = folder_list.pop(0)
-    sys.path.append(folder)
-    for fn in os.listdir(folder):
-        fp = osp.join(folder, fn)
-        if (fn not in (".ipynb_checkpoints", "__pycache__")) and (osp.isdir(fp)):
-            folder_list.append(fp)
+# Folders of the modules imported by name (e.g. `from pipeline import nlq2SqlTool`).
+# Listed explicitly instead of walking the source tree: keep it updated when adding a folder.
+MODULE_FOLDERS = (
+    "",
+    "engine",
+    "ui",
+    "engine/step1",
+    "engine/step2",
+    "engine/step3",
+    "engine/step4",
+    "engine/step5",
+    "engine/step6",
+    "engine/step4/model_dev",
+    "engine/step4/model_dev/utils",
+)
+
+for folder in MODULE_FOLDERS:
+    folder = osp.normpath(osp.join(current_folder, folder))
+    if folder not in sys.path:
+        sys.path.append(folder)
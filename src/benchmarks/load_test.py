@@ -0,0 +1,378 @@
+"""
+Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+
+SPDX-License-Identifier: CC-BY-NC-4.0
+"""
+
+# Closed-loop load test: N concurrent users each send a question, wait for the answer and send the next one.
+# N is swept over increasing levels and each level reports the throughput, latency percentiles, queueing
+# delay (latency not spent in the tool steps: queue wait, transport, coalesced calls), error rate, CPU
+# and RSS of this process: the saturation curve used for capacity planning.
+#
+# Targets:
+#     tool      a single nlq2SqlTool shared by the users (in-process)
+#     service   the HTTP service (engine/serving.py) started in-process on a free port
+#     --url     a running HTTP service (CPU & RSS are then the ones of the load generator only)
+# The in-process targets use the stand-in model & DB and the stand-in (or recorded) CM responses, with
+# configurable latencies. Questions come from a file or from the synthetic workload generator.
+#
+# Usage:
+#     python src/benchmarks/load_test.py --concurrency 1 2 4 8 16 32 --duration 10
+#     python src/benchmarks/load_test.py --target service --service-workers 4 --output curve.json
+#     python src/benchmarks/load_test.py --url http://localhost:8080 --questions questions.txt
+
+import os
+import sys
+import json
+import time
+import itertools
+import argparse
+import resource
+import threading
+import http.client
+from os import path as osp
+from urllib.parse import urlparse
+
+import numpy as np
+
+sys.path.append(osp.join(osp.dirname(osp.abspath(__file__)), "..", ".."))
+
+import src  # adds the tool folders to the path
+from src import config
+from workload_generator import generate_workload, get_name_pools, load_templates
+
+# Share of the maximum throughput from which a level is considered saturated.
+SATURATION_THROUGHPUT_SHARE = 0.95
+
+# Seconds between RSS samples.
+RSS_SAMPLING_SECONDS = 0.1
+
+
+def get_rss_mb():
+    """Current resident set size of the process in MB (peak RSS if /proc is not available)."""
+    try:
+        with open("/proc/self/statm", "r") as fp:
+            return int(fp.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2**20
+    except (OSError, ValueError):
+        peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return peak_rss / (2**20 if sys.platform == "darwin" else 2**10)
+
+
+def get_cpu_seconds():
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    return usage.ru_utime + usage.ru_stime
+
+
+def get_question_stream(args):
+    """Endless, thread-safe source of questions.
+
+    Args:
+        args (argparse.Namespace): Load test arguments.
+
+    Returns:
+        callable: Returns the next question.
+
+    """
+    if args.questions:
+        with open(args.questions, "r") as fp:
+            questions = [line.strip() for line in fp if line.strip()]
+        stream = itertools.cycle(questions)
+    else:
+        workload = generate_workload(
+            load_templates(args.templates),
+            get_name_pools(),
+            sys.maxsize,
+            template_skew=args.template_skew,
+            name_skew=args.name_skew,
+            seed=args.seed,
+        )
+        stream = (nlq for nlq, _ in workload)
+
+    lock = threading.Lock()
+
+    def next_question():
+        with lock:
+            return next(stream)
+
+    return next_question
+
+
+def create_stand_in_tool(args):
+    from pipeline import nlq2SqlTool
+    from stand_ins import StandInCMClient, StandInModel, StandInDatabase
+
+    if args.cm_recordings:
+        from cm_recording import ReplayCMClient
+
+        cm_client = ReplayCMClient(args.cm_recordings, args.cm_latency)
+    else:
+        cm_client = StandInCMClient(latency_seconds=args.cm_latency)
+
+    tool = nlq2SqlTool(
+        config,
+        model=StandInModel(latency_seconds=args.model_latency),
+        connect=StandInDatabase(latency_seconds=args.db_latency).connect,
+        cm_client=cm_client,
+    )
+    tool.set_db_credentials("user", "password")
+    return tool
+
+
+def get_tool_sender(tool, execute):
+    """Send a question to an in-process tool. Returns the time spent in each step."""
+
+    def send(nlq):
+        return tool.run(nlq, execute=execute)["timings"]
+
+    return send
+
+
+def get_http_sender(url, execute, timeout_seconds):
+    """Send a question to the HTTP service (one keep-alive connection per user). Returns the time spent in each step."""
+    parsed_url = urlparse(url)
+    path = "/execute" if execute else "/translate"
+    local = threading.local()
+
+    def send(nlq):
+        if getattr(local, "conn", None) is None:
+            local.conn = http.client.HTTPConnection(
+                parsed_url.hostname, parsed_url.port or 80, timeout=timeout_seconds
+            )
+        body = json.dumps({"nlq": nlq})
+        try:
+            local.conn.request("POST", path, body, {"Content-Type": "application/json"})
+            response = local.conn.getresponse()
+            payload = response.read()
+        except (OSError, http.client.HTTPException):
+            local.conn.close()
+            local.conn = None
+            raise
+        if response.status != 200:
+            raise RuntimeError(f"HTTP {response.status}")
+        return json.loads(payload)["timings"]
+
+    return send
+
+
+def start_service(args):
+    """Start the HTTP service with a stand-in tool on a free local port.
+
+    Args:
+        args (argparse.Namespace): Load test arguments.
+
+    Returns:
+        tuple: Service, HTTP server and URL.
+
+    """
+    from serving import Nl2SqlService, create_server
+
+    service = Nl2SqlService(
+        max_workers=args.service_workers,
+        max_queue_size=args.service_queue_size,
+        default_timeout_seconds=args.timeout,
+        max_result_rows=config.SERVICE_MAX_RESULT_ROWS,
+    )
+    service.load(lambda: create_stand_in_tool(args))
+    server = create_server(service, "127.0.0.1", 0)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return service, server, f"http://127.0.0.1:{server.server_address[1]}"
+
+
+def run_level(send, next_question, concurrency, warmup_seconds, duration_seconds):
+    """Run `concurrency` closed-loop users and measure the requests completed in the measurement window.
+
+    Args:
+        send (callable): Sends a question and returns the time spent in each step. Raises on errors.
+        next_question (callable): Returns the next question.
+        concurrency (int): Number of users.
+        warmup_seconds (float): Seconds before the measurement window (requests completed then are ignored).
+        duration_seconds (float): Seconds of the measurement window.
+
+    Returns:
+        dict: Metrics of the level.
+
+    """
+    stop = threading.Event()
+    window = {"start": float("inf"), "end": float("inf")}
+    lock = threading.Lock()
+    latencies, queueing_delays = [], []
+    n_errors = 0
+
+    def user():
+        nonlocal n_errors
+        while not stop.is_set():
+            nlq = next_question()
+            start = time.perf_counter()
+            try:
+                timings = send(nlq)
+            except Exception:
+                timings = None
+            end = time.perf_counter()
+
+            if not window["start"] <= end <= window["end"]:
+                continue
+            with lock:
+                if timings is None:
+                    n_errors += 1
+                else:
+                    latency = end - start
+                    latencies.append(latency)
+                    queueing_delays.append(max(latency - sum(timings.values()), 0.0))
+
+    users = [threading.Thread(target=user, daemon=True) for _ in range(concurrency)]
+    for thread in users:
+        thread.start()
+    time.sleep(warmup_seconds)
+
+    cpu_start = get_cpu_seconds()
+    window["start"] = start = time.perf_counter()
+    window["end"] = start + duration_seconds
+    max_rss = get_rss_mb()
+    while time.perf_counter() < window["end"]:
+        time.sleep(RSS_SAMPLING_SECONDS)
+        max_rss = max(max_rss, get_rss_mb())
+    cpu_seconds = get_cpu_seconds() - cpu_start
+    elapsed = time.perf_counter() - start
+
+    stop.set()
+    for thread in users:
+        thread.join()
+
+    with lock:
+        n_requests = len(latencies) + n_errors
+
+        def percentile_ms(values, q):
+            return float(np.percentile(values, q)) * 1000 if values else None
+
+        return {
+            "concurrency": concurrency,
+            "throughput": len(latencies) / elapsed,
+            "p50_ms": percentile_ms(latencies, 50),
+            "p90_ms": percentile_ms(latencies, 90),
+            "p99_ms": percentile_ms(latencies, 99),
+            "queueing_p50_ms": percentile_ms(queueing_delays, 50),
+            "queueing_p99_ms": percentile_ms(queueing_delays, 99),
+            "error_rate": n_errors / n_requests if n_requests else 0.0,
+            "cpu_percent": 100 * cpu_seconds / elapsed,
+            "max_rss_mb": max_rss,
+        }
+
+
+def get_saturation_level(curve):
+    """Lowest concurrency reaching `SATURATION_THROUGHPUT_SHARE` of the maximum throughput.
+
+    It's only reached if throughput stops growing with concurrency: when the highest tested concurrency is
+    the first level reaching it, throughput may still be rising and the service is not saturated.
+
+    Args:
+        curve (list): Metrics of each level, by increasing concurrency.
+
+    Returns:
+        int: Concurrency. None if no request completed or the service is not saturated at the tested levels.
+
+    """
+    max_throughput = max(level["throughput"] for level in curve)
+    if not max_throughput:
+        return None
+    for i, level in enumerate(curve):
+        if level["throughput"] >= SATURATION_THROUGHPUT_SHARE * max_throughput:
+            return level["concurrency"] if i < len(curve) - 1 else None
+
+
+def format_level(level):
+    def ms(value):
+        return "-" if value is None else f"{value:.1f}"
+
+    return (
+        f"{level['concurrency']:>11} {level['throughput']:>10.1f} {ms(level['p50_ms']):>8} "
+        f"{ms(level['p90_ms']):>8} {ms(level['p99_ms']):>8} {ms(level['queueing_p50_ms']):>8} "
+        f"{ms(level['queueing_p99_ms']):>8} {level['error_rate']:>7.3f} "
+        f"{level['cpu_percent']:>6.0f} {level['max_rss_mb']:>8.1f}"
+    )
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Closed-loop load test.")
+    parser.add_argument("--target", choices=["tool", "service"], default="tool")
+    parser.add_argument("--url", default=None, help="URL of a running service")
+    parser.add_argument(
+        "--concurrency", type=int, nargs="+", default=[1, 2, 4, 8, 16, 32, 64]
+    )
+    parser.add_argument("--warmup", type=float, default=2.0, help="Seconds per level")
+    parser.add_argument(
+        "--duration", type=float, default=10.0, help="Seconds per level"
+    )
+    parser.add_argument(
+        "--translate-only", action="store_true", help="Don't execute the SQL queries"
+    )
+    parser.add_argument("--timeout", type=float, default=config.SERVICE_TIMEOUT_SECONDS)
+    parser.add_argument(
+        "--questions", default=None, help="Questions file. Default to a synthetic one"
+    )
+    parser.add_argument(
+        "--templates", nargs="+", default=None, help="Training CSVs (synthetic)"
+    )
+    parser.add_argument("--template-skew", type=float, default=1.0)
+    parser.add_argument("--name-skew", type=float, default=1.0)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--cm-recordings", default=None, help="Recorded CM responses to replay"
+    )
+    parser.add_argument("--cm-latency", type=float, default=0.05, help="Seconds")
+    parser.add_argument("--model-latency", type=float, default=0.2, help="Seconds")
+    parser.add_argument("--db-latency", type=float, default=0.1, help="Seconds")
+    parser.add_argument(
+        "--service-workers", type=int, default=config.SERVICE_MAX_WORKERS
+    )
+    parser.add_argument(
+        "--service-queue-size", type=int, default=config.SERVICE_MAX_QUEUE_SIZE
+    )
+    parser.add_argument("--output", default=None, help="Saturation curve JSON")
+    args = parser.parse_args()
+
+    execute = not args.translate_only
+    service = server = None
+    if args.url:
+        send = get_http_sender(args.url, execute, args.timeout)
+    elif args.target == "service":
+        service, server, url = start_service(args)
+        send = get_http_sender(url, execute, args.timeout)
+    else:
+        send = get_tool_sender(create_stand_in_tool(args), execute)
+    next_question = get_question_stream(args)
+
+    print(
+        f"{'concurrency':>11} {'req/s':>10} {'p50 ms':>8} {'p90 ms':>8} {'p99 ms':>8} "
+        f"{'q50 ms':>8} {'q99 ms':>8} {'errors':>7} {'CPU %':>6} {'RSS MB':>8}"
+    )
+    curve = []
+    try:
+        for concurrency in sorted(args.concurrency):
+            level = run_level(
+                send, next_question, concurrency, args.warmup, args.duration
+            )
+            curve.append(level)
+            print(format_level(level), flush=True)
+    finally:
+        if server is not None:
+            server.shutdown()
+            service.close()
+
+    saturation_level = get_saturation_level(curve)
+    if saturation_level is not None:
+        print(f"Saturation at concurrency: {saturation_level}")
+    elif any(level["throughput"] for level in curve):
+        print(
+            f"Not saturated: throughput still rising at concurrency {curve[-1]['concurrency']}"
+        )
+    else:
+        print("Saturation unknown: no request completed")
+
+    if args.output:
+        with open(args.output, "w") as fp:
+            json.dump(
+                {"levels": curve, "saturation_concurrency": saturation_level},
+                fp,
+                indent=2,
+            )
@@ -0,0 +1,436 @@
+"""
+Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+
+SPDX-License-Identifier: CC-BY-NC-4.0
+"""
+
+# Per-stage benchmark: throughput, latency percentiles and peak RSS of the CPU-bound stages of the tool,
+# each case measured in a fresh interpreter (so the peak RSS is the one of the case).
+#
+# Cases:
+#     regex_ner                  gender, ethnicity & race regex NER of step 1 (per question)
+#     state_standardization      step 2 state standardization (known names & misspellings)
+#     step3_substitution         step 3 names -> placeholders (entities from stand-in or recorded CM responses)
+#     render_template_query      step 5 rendering of the template set (per template)
+#     execute_query              step 6 conversion of the fetched rows to a data frame (stand-in database)
+#     inferencer:batch=B:beams=K ML model, batches of B questions with K beams (only with --model-path)
+#
+# Usage:
+#     python src/benchmarks/stage_benchmark.py --save-baseline stage_baseline.json
+#     python src/benchmarks/stage_benchmark.py --baseline stage_baseline.json
+#     python src/benchmarks/stage_benchmark.py --templates train.csv --query-args args_by_query.json \
+#         --model-path model.ckpt --batch-sizes 1 8 32 --beams 1 2 4
+#
+# ops/sec counts questions, names, templates or queries (a batch of B questions counts B); the latency
+# percentiles are the ones of a call (a batch for the inferencer cases).
+# The exit code is 1 if a case regressed over the baseline.
+
+import re
+import sys
+import json
+import time
+import argparse
+import resource
+import subprocess
+from os import path as osp
+
+import numpy as np
+
+sys.path.append(osp.join(osp.dirname(osp.abspath(__file__)), "..", ".."))
+
+import src  # adds the tool folders to the path
+from src import config
+
+BASE_CASES = (
+    "regex_ner",
+    "state_standardization",
+    "step3_substitution",
+    "render_template_query",
+    "execute_query",
+)
+
+INFERENCER_CASE_P = re.compile("^inferencer:batch=(\\d+):beams=(\\d+)$")
+
+QUESTIONS = (
+    "How many people are taking Aspirin?",
+    "Number of women with diabetes",
+    "How many patients with asthma are taking ibuprofen?",
+    "Number of patients grouped by ethnicity",
+    "How many black or african americans have hypertension?",
+    "How many latinos take metformin?",
+    "How many white male patients not hispanic have hypertension and take aspirin?",
+    "Number of asian women older than 65 with asthma",
+)
+
+# Template set used without --templates: one template per kind of placeholder.
+TEMPLATES = (
+    "SELECT COUNT(DISTINCT person_id) FROM <SCHEMA>.drug_exposure WHERE drug_concept_id IN (<DRUG-TEMPLATE><ARG-DRUG><0>)",
+    "SELECT COUNT(DISTINCT person_id) FROM <SCHEMA>.condition_occurrence WHERE condition_concept_id IN (<CONDITION-TEMPLATE><ARG-CONDITION><0>)",
+    "SELECT COUNT(DISTINCT co1.person_id) FROM <SCHEMA>.condition_occurrence co1 JOIN <SCHEMA>.drug_exposure de1 ON co1.person_id=de1.person_id WHERE co1.condition_concept_id IN (<CONDITION-TEMPLATE><ARG-CONDITION><0>) AND de1.drug_concept_id IN (<DRUG-TEMPLATE><ARG-DRUG><0>) AND DATEDIFF(day, de1.drug_exposure_start_date, de1.drug_exposure_end_date) > <ARG-TIMEDAYS><0>",
+    "SELECT COUNT(DISTINCT pe1.person_id) FROM <SCHEMA>.person pe1 JOIN <GENDER-TEMPLATE><ARG-GENDER><0> ON pe1.gender_concept_id=concept_id;",
+    "SELECT COUNT(DISTINCT pe1.person_id) FROM (<SCHEMA>.person pe1 JOIN <RACE-TEMPLATE><ARG-RACE><0> ON pe1.race_concept_id=concept_id) JOIN <ETHNICITY-TEMPLATE><ARG-ETHNICITY><0> eth_temp1 ON pe1.ethnicity_concept_id=eth_temp1.concept_id;",
+    "SELECT COUNT(DISTINCT pe1.person_id) FROM <SCHEMA>.person pe1 JOIN <SCHEMA>.location l1 ON pe1.location_id=l1.location_id WHERE l1.state IN (<STATEID-TEMPLATE><ARG-STATE><0>);",
+    "SELECT race, ethnicity, COUNT( DISTINCT pe1.person_id) FROM ((<SCHEMA>.person pe1 JOIN <RACE-TEMPLATE> ON pe1.race_concept_id=concept_id) JOIN <ETHNICITY-TEMPLATE> eth_temp1 ON pe1.ethnicity_concept_id=eth_temp1.concept_id ) GROUP BY race, ethnicity ;",
+    "SELECT state_name, COUNT(DISTINCT pe1.person_id) FROM <SCHEMA>.person pe1 JOIN <SCHEMA>.location l1 ON pe1.location_id=l1.location_id JOIN <STATENAME-TEMPLATE> ON l1.state=state GROUP BY state_name;",
+)
+
+# Arguments used without --query-args (or for the templates missing from it).
+DEFAULT_QUERY_ARGS = {
+    "DRUG": [{"Query-arg": "1191"}],
+    "CONDITION": [{"Query-arg": "E11.9"}],
+    "TIMEDAYS": [{"Query-arg": "30"}],
+    "GENDER": [{"Query-arg": "FEMALE"}],
+    "RACE": [{"Query-arg": "White"}],
+    "ETHNICITY": [{"Query-arg": "Hispanic or Latino"}],
+    "STATE": [{"Query-arg": "CA"}],
+}
+
+# State names that are not in the pattern files (scanned & memoized).
+MISSPELLED_STATES = ("Californa", "N. Carolina", "Texs", "New Yrok", "Washington DC")
+
+
+def get_peak_rss_mb():
+    """Peak resident set size of the current process in MB."""
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return peak_rss / (2**20 if sys.platform == "darwin" else 2**10)
+
+
+def read_questions(path):
+    if path is None:
+        return list(QUESTIONS)
+    with open(path, "r") as fp:
+        return [line.strip() for line in fp if line.strip()]
+
+
+def read_templates(path):
+    if path is None:
+        return list(TEMPLATES)
+    import pandas as pd
+
+    return pd.read_csv(path)["query"].drop_duplicates().tolist()
+
+
+def setup_regex_ner(args):
+    from step1.entity_extraction import (
+        add_gender_entities,
+        add_ethnicity_entities,
+        add_race_entities,
+    )
+
+    def call(nlq):
+        entities_by_category, seen_names = {}, set()
+        for add_entities in (
+            add_gender_entities,
+            add_ethnicity_entities,
+            add_race_entities,
+        ):
+            entities_by_category, seen_names = add_entities(
+                nlq, entities_by_category, seen_names
+            )
+        return entities_by_category
+
+    return call, read_questions(args.questions), 1
+
+
+def setup_state_standardization(args):
+    from entity_records import EntityRecord
+    from step2.disambiguation_helpers import (
+        STATE2STANDARD,
+        add_state_options,
+        expand_pattern,
+    )
+
+    names = [name for p in STATE2STANDARD.values() for name in expand_pattern(p)]
+    names += [name.lower() for name in names] + list(MISSPELLED_STATES)
+    inputs = [[EntityRecord(0, len(name), name)] for name in names]
+    return add_state_options, inputs, 1
+
+
+def _get_stand_in_tool(args):
+    from pipeline import nlq2SqlTool
+    from stand_ins import StandInCMClient, StandInModel, StandInDatabase
+
+    if args.cm_recordings:
+        from cm_recording import ReplayCMClient
+
+        cm_client = ReplayCMClient(args.cm_recordings)
+    else:
+        cm_client = StandInCMClient()
+    return nlq2SqlTool(
+        config,
+        model=StandInModel(),
+        connect=StandInDatabase().connect,
+        cm_client=cm_client,
+    )
+
+
+def setup_step3_substitution(args):
+    from step3.nlq_processing import replace_name_for_placeholder
+
+    tool = _get_stand_in_tool(args)
+    inputs = []
+    for nlq in read_questions(args.questions):
+        entities = tool.process_entities(tool.detect_entities(nlq))
+        inputs.append((nlq, entities))
+
+    return (lambda item: replace_name_for_placeholder(*item)), inputs, 1
+
+
+def setup_render_template_query(args):
+    from step5.sql_processing import render_template_query
+
+    query2args = {}
+    if args.query_args:
+        with open(args.query_args, "r") as fp:
+            query2args = json.load(fp)
+    default_args = query2args.get("default", DEFAULT_QUERY_ARGS)
+
+    inputs = [
+        (template, query2args.get(template, default_args))
+        for template in read_templates(args.templates)
+    ]
+
+    def call(item):
+        return render_template_query(config, *item)
+
+    return call, inputs, 1
+
+
+def setup_execute_query(args):
+    from stand_ins import StandInDatabase
+    from step6.query_execution import execute_query
+
+    # typical result table: ids, codes, names, dates & counts
+    columns = ("person_id", "concept_code", "concept_name", "start_date", "count")
+    rows = tuple(
+        (i, f"E{i % 1000:03d}", f"concept {i % 997}", "2009-01-%02d" % (i % 28 + 1), i)
+        for i in range(args.rows)
+    )
+    conn = StandInDatabase(columns=columns, rows=rows).connect(None, None, None)
+
+    def call(sql_query):
+        return execute_query(conn.cursor(), sql_query)
+
+    return call, ["SELECT * FROM <SCHEMA>.person"], 1
+
+
+def setup_inferencer(args, batch_size, num_beams):
+    from t5_inference import Inferencer, generate_queries
+
+    inferencer = Inferencer(args.model_path)
+    questions = read_questions(args.questions)
+    # generic questions (names replaced by placeholders)
+    tool = _get_stand_in_tool(args)
+    generic_questions = [
+        tool.replace_name_for_placeholder(
+            nlq, tool.process_entities(tool.detect_entities(nlq))
+        )
+        for nlq in questions
+    ]
+    repeated = generic_questions * (batch_size // len(generic_questions) + 1)
+    batches = [
+        repeated[start : start + batch_size]
+        for start in range(0, len(generic_questions), batch_size)
+    ]
+
+    params = dict(config.DECODING_PARAMS, num_beams=num_beams)
+
+    def call(batch):
+        return generate_queries(inferencer.model, batch, decoding_params=params)
+
+    return call, batches, batch_size
+
+
+def get_case_setup(case, args):
+    """Get the benchmarked function of a case.
+
+    Args:
+        case (str): Case name.
+        args (argparse.Namespace): Benchmark arguments.
+
+    Returns:
+        tuple: Function called with each input, list of inputs and number of operations per call.
+
+    """
+    match = INFERENCER_CASE_P.match(case)
+    if match:
+        return setup_inferencer(args, int(match.group(1)), int(match.group(2)))
+    return globals()[f"setup_{case}"](args)
+
+
+def measure_case(case, args):
+    """Measure a case in the current (fresh) interpreter.
+
+    Each input is called once to warm up, then the inputs are called in turn for `args.seconds`
+    (at least `args.min_calls` calls).
+
+    Args:
+        case (str): Case name.
+        args (argparse.Namespace): Benchmark arguments.
+
+    Returns:
+        dict: Metrics of the case.
+
+    """
+    call, inputs, ops_per_call = get_case_setup(case, args)
+    for item in inputs:
+        call(item)
+
+    latencies = []
+    start = time.perf_counter()
+    end = start + args.seconds
+    while True:
+        for item in inputs:
+            call_start = time.perf_counter()
+            call(item)
+            latencies.append(time.perf_counter() - call_start)
+        if time.perf_counter() >= end and len(latencies) >= args.min_calls:
+            break
+    elapsed = time.perf_counter() - start
+
+    return {
+        "calls": len(latencies),
+        "ops_per_second": len(latencies) * ops_per_call / elapsed,
+        "p50_ms": float(np.percentile(latencies, 50)) * 1000,
+        "p99_ms": float(np.percentile(latencies, 99)) * 1000,
+        "peak_rss_mb": get_peak_rss_mb(),
+    }
+
+
+def get_cases(args):
+    cases = list(BASE_CASES)
+    if args.model_path:
+        cases += [
+            f"inferencer:batch={batch_size}:beams={num_beams}"
+            for batch_size in args.batch_sizes
+            for num_beams in args.beams
+        ]
+    if args.cases:
+        cases = [case for case in cases if case in args.cases]
+    return cases
+
+
+def run_benchmark(args):
+    """Measure each case in a new interpreter.
+
+    Args:
+        args (argparse.Namespace): Benchmark arguments.
+
+    Returns:
+        dict: Metrics (value) by case (key).
+
+    """
+    options = ["--seconds", str(args.seconds), "--min-calls", str(args.min_calls)]
+    options += ["--rows", str(args.rows)]
+    for option in ("questions", "templates", "query_args", "cm_recordings"):
+        if getattr(args, option):
+            options += ["--" + option.replace("_", "-"), getattr(args, option)]
+    if args.model_path:
+        options += ["--model-path", args.model_path]
+
+    results = {}
+    for case in get_cases(args):
+        command = [sys.executable, osp.abspath(__file__), "--child", case] + options
+        output = subprocess.run(
+            command, check=True, stdout=subprocess.PIPE, universal_newlines=True
+        ).stdout
+        results[case] = json.loads(output.strip().splitlines()[-1])
+    return results
+
+
+def compare_to_baseline(results, baseline, tolerance=0.2):
+    """Find the cases that regressed over the baseline.
+
+    Args:
+        results (dict): Benchmark results.
+        baseline (dict): Baseline results.
+        tolerance (float): Allowed relative decrease of the throughput or increase of the latency & RSS.
+
+    Returns:
+        list: Messages of the regressions.
+
+    """
+    regressions = []
+    for case, metrics in results.items():
+        if case not in baseline:
+            continue
+        base = baseline[case]
+        if metrics["ops_per_second"] < base["ops_per_second"] * (1 - tolerance):
+            regressions.append(
+                f"{case} ops/sec: {metrics['ops_per_second']:.1f} vs {base['ops_per_second']:.1f} baseline"
+            )
+        for metric in ("p50_ms", "p99_ms", "peak_rss_mb"):
+            if metrics[metric] > base[metric] * (1 + tolerance):
+                regressions.append(
+                    f"{case} {metric}: {metrics[metric]:.3f} vs {base[metric]:.3f} baseline"
+                )
+    return regressions
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Per-stage benchmark.")
+    parser.add_argument(
+        "--cases", nargs="+", default=None, help="Cases to run. Default to all"
+    )
+    parser.add_argument(
+        "--seconds", type=float, default=2.0, help="Measured time per case"
+    )
+    parser.add_argument(
+        "--min-calls", type=int, default=20, help="Minimum measured calls per case"
+    )
+    parser.add_argument(
+        "--questions", default=None, help="Questions file (one per line)"
+    )
+    parser.add_argument(
+        "--templates", default=None, help="CSV with a 'query' column (template set)"
+    )
+    parser.add_argument(
+        "--query-args", default=None, help="JSON of the arguments by template"
+    )
+    parser.add_argument(
+        "--cm-recordings", default=None, help="Recorded CM responses (step 3 entities)"
+    )
+    parser.add_argument(
+        "--rows", type=int, default=10000, help="Rows of the execute_query result"
+    )
+    parser.add_argument(
+        "--model-path", default=None, help="Model of the inferencer cases"
+    )
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 8, 32])
+    parser.add_argument("--beams", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--baseline", default=None, help="Baseline JSON to compare to")
+    parser.add_argument(
+        "--save-baseline", default=None, help="Save results as baseline"
+    )
+    parser.add_argument(
+        "--tolerance", type=float, default=0.2, help="Allowed relative regression"
+    )
+    parser.add_argument("--child", default=None, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        print(json.dumps(measure_case(args.child, args)))
+        sys.exit(0)
+
+    results = run_benchmark(args)
+    print(
+        f"{'case':>32} {'ops/sec':>12} {'p50 ms':>10} {'p99 ms':>10} {'peak RSS MB':>12}"
+    )
+    for case, metrics in results.items():
+        print(
+            f"{case:>32} {metrics['ops_per_second']:>12.1f} {metrics['p50_ms']:>10.3f} "
+            f"{metrics['p99_ms']:>10.3f} {metrics['peak_rss_mb']:>12.1f}"
+        )
+
+    if args.save_baseline:
+        with open(args.save_baseline, "w") as fp:
+            json.dump(results, fp, indent=2)
+
+    if args.baseline:
+        with open(args.baseline, "r") as fp:
+            regressions = compare_to_baseline(results, json.load(fp), args.tolerance)
+        for regression in regressions:
+            print("REGRESSION", regression)
+        sys.exit(1 if regressions else 0)
@@ -0,0 +1,186 @@
+"""
+Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+
+SPDX-License-Identifier: CC-BY-NC-4.0
+"""
+
+# Startup benchmark: import time of the tool and time to first answer, each measured in a fresh interpreter.
+# It also reports which heavy modules are loaded by the import (they should only load on first use).
+#
+# Usage:
+#     python src/benchmarks/startup_benchmark.py --stand-ins --save-baseline startup_baseline.json
+#     python src/benchmarks/startup_benchmark.py --stand-ins --baseline startup_baseline.json
+#
+# With --stand-ins, the ML model, Comprehend Medical and the database are replaced by stand-ins (see
+# engine/stand_ins.py) so only the tool's own startup is measured. Without it, the model of
+# `config.MODEL_PATH` is loaded and the first question is translated (not executed).
+# The exit code is 1 if a metric regressed over the baseline.
+
+import sys
+import json
+import time
+import argparse
+import subprocess
+from os import path as osp
+
+_START = time.perf_counter()
+
+SRC_DIR = osp.join(osp.dirname(osp.abspath(__file__)), "..")
+
+# Modules that should not be loaded by importing the tool.
+HEAVY_MODULES = (
+    "torch",
+    "transformers",
+    "pytorch_lightning",
+    "nlp",
+    "sklearn",
+    "boto3",
+    "psycopg2",
+)
+
+FIRST_QUESTION = "How many people are taking Aspirin?"
+
+METRICS = ("import_seconds", "load_seconds", "first_answer_seconds", "total_seconds")
+
+
+def measure_startup(stand_ins=False):
+    """Measure the startup of the tool in the current (fresh) interpreter.
+
+    Args:
+        stand_ins (bool): Whether to use stand-in model, CM & DB backends.
+
+    Returns:
+        dict: Seconds from the interpreter start to the end of each startup phase and heavy modules loaded by the import.
+
+    """
+    sys.path.append(osp.join(SRC_DIR, ".."))
+
+    import src
+    from src import config
+    from pipeline import nlq2SqlTool
+
+    imported = time.perf_counter()
+    heavy_modules = [name for name in HEAVY_MODULES if name in sys.modules]
+
+    if stand_ins:
+        from stand_ins import StandInCMClient, StandInModel, StandInDatabase
+
+        tool = nlq2SqlTool(
+            config,
+            model=StandInModel(),
+            connect=StandInDatabase().connect,
+            cm_client=StandInCMClient(),
+        )
+        tool.set_db_credentials("user", "password")
+    else:
+        tool = nlq2SqlTool(config)
+    loaded = time.perf_counter()
+
+    tool.run(FIRST_QUESTION, execute=stand_ins)
+    answered = time.perf_counter()
+
+    return {
+        "import_seconds": imported - _START,
+        "load_seconds": loaded - _START,
+        "first_answer_seconds": answered - _START,
+        "heavy_modules_imported": heavy_modules,
+    }
+
+
+def run_benchmark(repeat=5, stand_ins=False):
+    """Measure the startup `repeat` times, each in a new interpreter.
+
+    Args:
+        repeat (int): Number of measurements.
+        stand_ins (bool): Whether to use stand-in model, CM & DB backends.
+
+    Returns:
+        dict: Median of each metric (seconds) and heavy modules loaded by the import.
+
+    """
+    command = [sys.executable, osp.abspath(__file__), "--child"]
+    if stand_ins:
+        command.append("--stand-ins")
+
+    runs = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        output = subprocess.run(
+            command, check=True, stdout=subprocess.PIPE, universal_newlines=True
+        ).stdout
+        run = json.loads(output.strip().splitlines()[-1])
+        # including the interpreter startup
+        run["total_seconds"] = time.perf_counter() - start
+        runs.append(run)
+
+    results = {
+        metric: sorted(run[metric] for run in runs)[len(runs) // 2]
+        for metric in METRICS
+    }
+    results["heavy_modules_imported"] = runs[0]["heavy_modules_imported"]
+    return results
+
+
+def compare_to_baseline(results, baseline, tolerance=0.2):
+    """Find the metrics that regressed over the baseline.
+
+    Args:
+        results (dict): Benchmark results.
+        baseline (dict): Baseline results.
+        tolerance (float): Allowed relative increase.
+
+    Returns:
+        list: Messages of the regressions.
+
+    """
+    regressions = []
+    for metric in METRICS:
+        if metric in baseline and results[metric] > baseline[metric] * (1 + tolerance):
+            regressions.append(
+                f"{metric}: {results[metric]:.3f}s vs {baseline[metric]:.3f}s baseline"
+            )
+
+    new_heavy_modules = set(results["heavy_modules_imported"]) - set(
+        baseline.get("heavy_modules_imported", [])
+    )
+    if new_heavy_modules:
+        regressions.append(f"heavy modules imported: {sorted(new_heavy_modules)}")
+    return regressions
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Tool startup benchmark.")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument(
+        "--stand-ins", action="store_true", help="Use stand-in model, CM & DB"
+    )
+    parser.add_argument("--baseline", default=None, help="Baseline JSON to compare to")
+    parser.add_argument(
+        "--save-baseline", default=None, help="Save results as baseline"
+    )
+    parser.add_argument(
+        "--tolerance", type=float, default=0.2, help="Allowed relative increase"
+    )
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.child:
+        print(json.dumps(measure_startup(args.stand_ins)))
+        sys.exit(0)
+
+    results = run_benchmark(args.repeat, args.stand_ins)
+    for metric in METRICS:
+        print(f"{metric:>22}: {results[metric]:.3f}s")
+    print(f"{'heavy modules imported':>22}: {results['heavy_modules_imported']}")
+
+    if args.save_baseline:
+        with open(args.save_baseline, "w") as fp:
+            json.dump(results, fp, indent=2)
+
+    if args.baseline:
+        with open(args.baseline, "r") as fp:
+            regressions = compare_to_baseline(results, json.load(fp), args.tolerance)
+        for regression in regressions:
+            print("REGRESSION", regression)
+        sys.exit(1 if regressions else 0)
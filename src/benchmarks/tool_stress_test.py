@@ -0,0 +1,243 @@
+"""
+Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+
+SPDX-License-Identifier: CC-BY-NC-4.0
+"""
+
+# Stress test of a single nlq2SqlTool shared by many threads, against stand-in backends (engine/stand_ins.py).
+# Every answer is compared to the answer of a single-threaded run, while another thread keeps replacing
+# the DB credentials and invalidating the result cache. The stand-in database checks that each connection
+# gets a consistent user & password pair and echoes the executed query, so mixed-up calls are detected.
+#
+# Usage:
+#     python src/benchmarks/tool_stress_test.py --threads 32 --requests-per-thread 200
+#
+# The exit code is 1 if any answer is wrong or any call failed.
+
+import sys
+import time
+import random
+import argparse
+import threading
+from os import path as osp
+
+sys.path.append(osp.join(osp.dirname(osp.abspath(__file__)), "..", ".."))
+
+import src  # adds the tool folders to the path
+from src import config
+from pipeline import nlq2SqlTool
+from entity_records import entities_to_dicts
+from stand_ins import Column, StandInCMClient, StandInModel
+
+QUESTIONS = (
+    "How many people are taking Aspirin?",
+    "Number of women with diabetes",
+    "How many patients with asthma are taking ibuprofen?",
+    "Number of patients grouped by ethnicity",
+    "How many black or african americans have hypertension?",
+    "How many latinos take metformin?",
+)
+
+CREDENTIALS = (("analyst", "password-1"), ("scientist", "password-2"))
+
+
+class EchoDatabase(object):
+    def __init__(self, credentials, latency_seconds=0.0):
+        """Stand-in database returning the user and the query of each execution.
+
+        Args:
+            credentials (tuple): Valid (user, password) pairs.
+            latency_seconds (float): Time spent in each query execution.
+
+        Returns:
+            None
+
+        """
+        self.credentials = set(credentials)
+        self.latency_seconds = latency_seconds
+        self.invalid_connections = 0
+        self._lock = threading.Lock()
+
+    def connect(self, redshift_parameters, user, password, connect_timeout=None):
+        if (user, password) not in self.credentials:
+            with self._lock:
+                self.invalid_connections += 1
+        return EchoConnection(self, user)
+
+
+class EchoConnection(object):
+    def __init__(self, database, user):
+        self._database = database
+        self._user = user
+
+    def cursor(self):
+        return EchoCursor(self._database, self._user)
+
+    def cancel(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class EchoCursor(object):
+    def __init__(self, database, user):
+        self._database = database
+        self._user = user
+        self._query = None
+        self.description = None
+
+    def execute(self, query):
+        if query.startswith("SET "):
+            return
+        time.sleep(self._database.latency_seconds)
+        self._query = query
+        self.description = [Column("user", None), Column("query", None)]
+
+    def fetchall(self):
+        return [(self._user, self._query)]
+
+
+def get_answer(tool, nlq, execute):
+    """Run a question and keep the comparable outputs."""
+    record = tool.run(nlq, execute=execute)
+    answer = {
+        "entities": entities_to_dicts(record["entities"]),
+        "generic_nlq": record["generic_nlq"],
+        "generic_sql": record["generic_sql"],
+        "sql": record["sql"],
+    }
+    if execute:
+        answer["result"] = record["result"].values.tolist()
+    return answer
+
+
+def check_answer(answer, expected, execute):
+    """Compare an answer to the single-threaded one. Returns the list of mismatched fields."""
+    mismatches = [
+        field
+        for field in ("entities", "generic_nlq", "generic_sql", "sql")
+        if answer[field] != expected[field]
+    ]
+    if execute:
+        ((user, query),) = answer["result"]
+        if query != expected["sql"] or user not in dict(CREDENTIALS):
+            mismatches.append("result")
+    return mismatches
+
+
+def run_stress_test(
+    tool, database, threads=32, requests_per_thread=200, execute_ratio=0.5, seed=0
+):
+    """Hammer a shared tool from many threads.
+
+    Args:
+        tool (nlq2SqlTool): Tool shared by the threads.
+        database (EchoDatabase): Database of the tool.
+        threads (int): Number of threads calling the tool.
+        requests_per_thread (int): Number of calls per thread.
+        execute_ratio (float): Proportion of calls executing the SQL query.
+        seed (int): Random seed.
+
+    Returns:
+        dict: Number of calls, errors, wrong answers, invalid connections, throughput & latency percentiles.
+
+    """
+    tool.set_db_credentials(*CREDENTIALS[0])
+    expected = {nlq: get_answer(tool, nlq, execute=False) for nlq in QUESTIONS}
+
+    lock = threading.Lock()
+    latencies, errors, wrong_answers = [], [], []
+    done = threading.Event()
+
+    def call_tool(thread_id):
+        rng = random.Random(seed + thread_id)
+        for _ in range(requests_per_thread):
+            nlq = rng.choice(QUESTIONS)
+            execute = rng.random() < execute_ratio
+            start = time.perf_counter()
+            try:
+                answer = get_answer(tool, nlq, execute)
+                mismatches = check_answer(answer, expected[nlq], execute)
+            except Exception as e:
+                with lock:
+                    errors.append(f"{type(e).__name__}: {e}")
+                continue
+            latency = time.perf_counter() - start
+            with lock:
+                latencies.append(latency)
+                if mismatches:
+                    wrong_answers.append((nlq, mismatches))
+
+    def rotate_credentials():
+        rng = random.Random(seed)
+        while not done.is_set():
+            tool.set_db_credentials(*rng.choice(CREDENTIALS))
+            if rng.random() < 0.1:
+                tool.invalidate_result_cache()
+            time.sleep(0.001)
+
+    workers = [threading.Thread(target=call_tool, args=(i,)) for i in range(threads)]
+    rotator = threading.Thread(target=rotate_credentials)
+
+    start = time.perf_counter()
+    rotator.start()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    elapsed = time.perf_counter() - start
+    done.set()
+    rotator.join()
+
+    latencies.sort()
+    n_calls = threads * requests_per_thread
+    return {
+        "calls": n_calls,
+        "errors": len(errors),
+        "wrong_answers": len(wrong_answers),
+        "invalid_connections": database.invalid_connections,
+        "calls_per_second": n_calls / elapsed,
+        "p50_ms": 1000 * latencies[len(latencies) // 2] if latencies else None,
+        "p99_ms": 1000 * latencies[int(len(latencies) * 0.99)] if latencies else None,
+        "error_examples": errors[:5],
+        "wrong_answer_examples": wrong_answers[:5],
+    }
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Stress test of a shared nlq2SqlTool.")
+    parser.add_argument("--threads", type=int, default=32)
+    parser.add_argument("--requests-per-thread", type=int, default=200)
+    parser.add_argument("--execute-ratio", type=float, default=0.5)
+    parser.add_argument(
+        "--latency-ms", type=float, default=1.0, help="Latency of each stand-in call"
+    )
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    latency_seconds = args.latency_ms / 1000
+    database = EchoDatabase(CREDENTIALS, latency_seconds=latency_seconds)
+    tool = nlq2SqlTool(
+        config,
+        model=StandInModel(latency_seconds=latency_seconds),
+        connect=database.connect,
+        cm_client=StandInCMClient(latency_seconds=latency_seconds),
+    )
+
+    results = run_stress_test(
+        tool,
+        database,
+        threads=args.threads,
+        requests_per_thread=args.requests_per_thread,
+        execute_ratio=args.execute_ratio,
+        seed=args.seed,
+    )
+    for name, value in results.items():
+        print(f"{name:>22}: {value}")
+
+    failed = (
+        results["errors"] or results["wrong_answers"] or results["invalid_connections"]
+    )
+    sys.exit(1 if failed else 0)
@@ -0,0 +1,316 @@
+"""
+Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+
+SPDX-License-Identifier: CC-BY-NC-4.0
+"""
+
+# Synthetic workload generator: streams Natural Language Queries built from generic question templates
+# (the `unfolded_questions` & `query` columns of the training CSVs) for load tests.
+# The "<ARG-CATEGORY><i>" placeholders are filled with names of the gender, race & state pattern files
+# (step2/*2pattern.json), ethnicity names, drug & condition lists and numbers (days, years, ages).
+# Templates and names are drawn from Zipfian distributions (P(rank k) ~ 1 / k^skew, 0 for uniform), so
+# popular questions repeat at realistic rates (e.g. to measure cache hit rates and batching effects).
+# The stream is generated chunk by chunk in constant memory, so millions of queries can be piped.
+#
+# Usage:
+#     python src/benchmarks/workload_generator.py --templates train.csv --count 1000000 > questions.txt
+#     python src/benchmarks/workload_generator.py --count 100000 --format jsonl --output workload.jsonl --stats
+#
+# Formats: "text" (one NLQ per line, the batch runner input) or "jsonl" ({"nlq": ..., "query": ...}: the
+# body of the service's POST /translate plus the generic SQL query of the template).
+
+import re
+import sys
+import json
+import argparse
+from os import path as osp
+
+import numpy as np
+
+sys.path.append(osp.join(osp.dirname(osp.abspath(__file__)), "..", ".."))
+
+import src  # adds the tool folders to the path
+from stand_ins import STAND_IN_CM_NAMES
+from step2.disambiguation_helpers import (
+    GENDER2STANDARD,
+    RACE2STANDARD,
+    STATE2STANDARD,
+    expand_pattern,
+)
+
+PLACEHOLDER_P = re.compile("<ARG-(\\w+)><(\\d+)>")
+
+# Templates used without --templates: (generic question, generic SQL query).
+TEMPLATES = (
+    (
+        "How many people are taking <ARG-DRUG><0>?",
+        "SELECT COUNT(DISTINCT person_id) FROM <SCHEMA>.drug_exposure WHERE drug_concept_id IN (<DRUG-TEMPLATE><ARG-DRUG><0>)",
+    ),
+    (
+        "Number of patients with <ARG-CONDITION><0>",
+        "SELECT COUNT(DISTINCT person_id) FROM <SCHEMA>.condition_occurrence WHERE condition_concept_id IN (<CONDITION-TEMPLATE><ARG-CONDITION><0>)",
+    ),
+    (
+        "How many <ARG-GENDER><0> have <ARG-CONDITION><0>?",
+        "SELECT COUNT(DISTINCT pe1.person_id) FROM (<SCHEMA>.person pe1 JOIN <GENDER-TEMPLATE><ARG-GENDER><0> ON pe1.gender_concept_id=concept_id) JOIN <SCHEMA>.condition_occurrence co1 ON pe1.person_id=co1.person_id WHERE co1.condition_concept_id IN (<CONDITION-TEMPLATE><ARG-CONDITION><0>);",
+    ),
+    (
+        "How many <ARG-RACE><0> patients take <ARG-DRUG><0>?",
+        "SELECT COUNT(DISTINCT pe1.person_id) FROM (<SCHEMA>.person pe1 JOIN <RACE-TEMPLATE><ARG-RACE><0> ON pe1.race_concept_id=concept_id) JOIN <SCHEMA>.drug_exposure de1 ON pe1.person_id=de1.person_id WHERE de1.drug_concept_id IN (<DRUG-TEMPLATE><ARG-DRUG><0>);",
+    ),
+    (
+        "How many <ARG-ETHNICITY><0> patients live in <ARG-STATE><0>?",
+        "SELECT COUNT(DISTINCT pe1.person_id) FROM ((<SCHEMA>.person pe1 JOIN <ETHNICITY-TEMPLATE><ARG-ETHNICITY><0> ON pe1.ethnicity_concept_id=concept_id) JOIN <SCHEMA>.location l1 ON pe1.location_id=l1.location_id) WHERE l1.state IN (<STATEID-TEMPLATE><ARG-STATE><0>);",
+    ),
+    (
+        "How many patients took <ARG-DRUG><0> for more than <ARG-TIMEDAYS><0> days?",
+        "SELECT COUNT(DISTINCT person_id) FROM <SCHEMA>.drug_exposure WHERE drug_concept_id IN (<DRUG-TEMPLATE><ARG-DRUG><0>) AND DATEDIFF(day, drug_exposure_start_date, drug_exposure_end_date) > <ARG-TIMEDAYS><0>;",
+    ),
+    (
+        "How many patients with <ARG-CONDITION><0> started taking <ARG-DRUG><0> after <ARG-TIMEYEARS><0> years?",
+        "SELECT COUNT(DISTINCT co1.person_id) FROM <SCHEMA>.condition_occurrence co1 JOIN <SCHEMA>.drug_exposure de1 ON co1.person_id=de1.person_id WHERE co1.condition_concept_id IN (<CONDITION-TEMPLATE><ARG-CONDITION><0>) AND de1.drug_concept_id IN (<DRUG-TEMPLATE><ARG-DRUG><0>) AND DATEDIFF(year, co1.condition_start_date, de1.drug_exposure_start_date) > <ARG-TIMEYEARS><0>;",
+    ),
+    (
+        "Number of patients taking <ARG-DRUG><0> and <ARG-DRUG><1>",
+        "SELECT COUNT(DISTINCT de1.person_id) FROM <SCHEMA>.drug_exposure de1 JOIN <SCHEMA>.drug_exposure de2 ON de1.person_id=de2.person_id WHERE de1.drug_concept_id IN (<DRUG-TEMPLATE><ARG-DRUG><0>) AND de2.drug_concept_id IN (<DRUG-TEMPLATE><ARG-DRUG><1>);",
+    ),
+)
+
+# Names detected by the step 1 ethnicity regex.
+ETHNICITY_NAMES = (
+    "non-hispanic",
+    "non hispanic",
+    "non-latino",
+    "non hispanic or latino",
+    "non-hispanics",
+)
+
+# Ranges of the numeric placeholders.
+NUMBER_RANGES = {"TIMEDAYS": (1, 365), "TIMEYEARS": (1, 10), "AGE": (18, 90)}
+
+CHUNK_SIZE = 10000
+
+
+def read_names(path):
+    with open(path, "r") as fp:
+        return [line.strip() for line in fp if line.strip()]
+
+
+def get_name_pools(drugs_path=None, conditions_path=None):
+    """Names used to fill the placeholders of each category.
+
+    Args:
+        drugs_path (str): File with a drug name per line. Default to None for the stand-in CM drugs.
+        conditions_path (str): File with a condition name per line. Default to None for the stand-in CM conditions.
+
+    Returns:
+        dict: List of names (value) by placeholder category (key).
+
+    """
+    pools = {
+        category: [
+            name
+            for pattern in standard2pattern.values()
+            for name in expand_pattern(pattern)
+        ]
+        for category, standard2pattern in (
+            ("GENDER", GENDER2STANDARD),
+            ("RACE", RACE2STANDARD),
+            ("STATE", STATE2STANDARD),
+        )
+    }
+    pools["ETHNICITY"] = list(ETHNICITY_NAMES)
+    for category, (low, high) in NUMBER_RANGES.items():
+        pools[category] = [str(number) for number in range(low, high + 1)]
+
+    for category, cm_category, path in (
+        ("DRUG", "MEDICATION", drugs_path),
+        ("CONDITION", "MEDICAL_CONDITION", conditions_path),
+    ):
+        if path is None:
+            pools[category] = [
+                name
+                for name, item in STAND_IN_CM_NAMES.items()
+                if item[0] == cm_category
+            ]
+        else:
+            pools[category] = read_names(path)
+    return pools
+
+
+def load_templates(paths=None):
+    """Load the generic (question, SQL query) templates of training CSVs.
+
+    Args:
+        paths (list): CSV files with `unfolded_questions` & `query` columns. Default to None for `TEMPLATES`.
+
+    Returns:
+        list: Unique (generic question, generic SQL query) tuples.
+
+    """
+    if not paths:
+        return list(TEMPLATES)
+
+    import pandas as pd
+
+    df = pd.concat(
+        [pd.read_csv(path, usecols=["unfolded_questions", "query"]) for path in paths]
+    )
+    df = df.dropna().drop_duplicates()
+    return list(df.itertuples(index=False, name=None))
+
+
+def _split_template(question):
+    """Split a generic question in literal parts (str) and placeholders ((category, index) tuples)."""
+    parts, pos = [], 0
+    for match in re.finditer(PLACEHOLDER_P, question):
+        parts.append(question[pos : match.start()])
+        parts.append((match.group(1), match.group(2)))
+        pos = match.end()
+    parts.append(question[pos:])
+    return parts
+
+
+class ZipfSampler(object):
+    def __init__(self, n_items, skew, rng, chunk_size=CHUNK_SIZE):
+        """Draw item indices from a Zipfian distribution over a random ranking of the items.
+
+        Args:
+            n_items (int): Number of items.
+            skew (float): Exponent of the distribution: P(rank k) ~ 1 / k^skew. 0 for uniform.
+            rng (np.random.Generator): Random generator.
+            chunk_size (int): Number of indices drawn at once.
+
+        Returns:
+            None
+
+        """
+        weights = 1.0 / np.arange(1, n_items + 1) ** skew
+        self._p = weights / weights.sum()
+        # the most popular items are random, not the first ones of the files
+        self._ranking = rng.permutation(n_items)
+        self._rng = rng
+        self._chunk_size = chunk_size
+        self._buffer = []
+
+    def __call__(self):
+        if not self._buffer:
+            ranks = self._rng.choice(len(self._p), size=self._chunk_size, p=self._p)
+            self._buffer = self._ranking[ranks].tolist()
+            self._buffer.reverse()
+        return self._buffer.pop()
+
+
+def generate_workload(
+    templates, name_pools, count, template_skew=1.0, name_skew=1.0, seed=0
+):
+    """Stream Natural Language Queries built from generic templates.
+
+    Templates with a placeholder category missing from `name_pools` are skipped. Different
+    placeholders of a category in a question get different names when possible.
+
+    Args:
+        templates (list): (generic question, generic SQL query) tuples.
+        name_pools (dict): List of names (value) by placeholder category (key) (see `get_name_pools`).
+        count (int): Number of queries.
+        template_skew (float): Zipfian exponent of the template popularity. 0 for uniform.
+        name_skew (float): Zipfian exponent of the name popularity (per category). 0 for uniform.
+        seed (int): Random seed: the same arguments generate the same stream.
+
+    Yields:
+        tuple: Natural Language Query and generic SQL query of its template.
+
+    """
+    rng = np.random.default_rng(seed)
+
+    split_templates = []
+    for question, query in templates:
+        parts = _split_template(question)
+        categories = {part[0] for part in parts if isinstance(part, tuple)}
+        if all(name_pools.get(category) for category in categories):
+            split_templates.append((parts, query))
+    if not split_templates:
+        raise ValueError("No template can be filled with the given names.")
+
+    next_template = ZipfSampler(len(split_templates), template_skew, rng)
+    next_name = {
+        category: ZipfSampler(len(names), name_skew, rng)
+        for category, names in name_pools.items()
+        if names
+    }
+
+    for _ in range(count):
+        parts, query = split_templates[next_template()]
+        names = {}
+        for part in parts:
+            if isinstance(part, str) or part in names:
+                continue
+            category = part[0]
+            pool = name_pools[category]
+            used = {names[key] for key in names if key[0] == category}
+            name = pool[next_name[category]()]
+            for _ in range(10):
+                if name not in used or len(used) >= len(pool):
+                    break
+                name = pool[next_name[category]()]
+            names[part] = name
+
+        nlq = "".join(part if isinstance(part, str) else names[part] for part in parts)
+        yield nlq, query
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Synthetic NLQ workload generator.")
+    parser.add_argument(
+        "--templates", nargs="+", default=None, help="Training CSVs (template set)"
+    )
+    parser.add_argument("--drugs", default=None, help="Drug names (one per line)")
+    parser.add_argument(
+        "--conditions", default=None, help="Condition names (one per line)"
+    )
+    parser.add_argument("--count", type=int, default=1000000)
+    parser.add_argument(
+        "--template-skew", type=float, default=1.0, help="Zipfian exponent"
+    )
+    parser.add_argument("--name-skew", type=float, default=1.0, help="Zipfian exponent")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--format", choices=["text", "jsonl"], default="text")
+    parser.add_argument("--output", default="-", help="Output file. '-' for stdout")
+    parser.add_argument(
+        "--stats", action="store_true", help="Print the repeat rate to stderr"
+    )
+    args = parser.parse_args()
+
+    workload = generate_workload(
+        load_templates(args.templates),
+        get_name_pools(args.drugs, args.conditions),
+        args.count,
+        template_skew=args.template_skew,
+        name_skew=args.name_skew,
+        seed=args.seed,
+    )
+
+    output_fp = sys.stdout if args.output == "-" else open(args.output, "w")
+    distinct = set()
+    try:
+        for nlq, query in workload:
+            if args.format == "jsonl":
+                output_fp.write(json.dumps({"nlq": nlq, "query": query}) + "\n")
+            else:
+                output_fp.write(nlq + "\n")
+            if args.stats:
+                distinct.add(nlq)
+    except BrokenPipeError:
+        # e.g. piped to `head`
+        sys.exit(0)
+    finally:
+        if output_fp is not sys.stdout:
+            output_fp.close()
+
+    if args.stats:
+        print(
+            f"queries: {args.count}, distinct: {len(distinct)}, "
+            f"repeat rate: {1 - len(distinct) / max(args.count, 1):.3f}",
+            file=sys.stderr,
+        )
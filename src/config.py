@@ -15,12 +15,47 @@ from engine.step5.rendering_functions import (
 _current_file_dir = osp.dirname(osp.realpath(__file__))
 
 
+# Request deadline: time budget of a request (all steps), set once and propagated to every step. None for no deadline.
+REQUEST_TIMEOUT_SECONDS = None
+# Time budget of each step. A step is given the earliest of its budget and the request deadline,
+# turned into timeouts of its blocking calls, and fails with DeadlineExceeded when exceeded. None for no budget.
+STEP_TIMEOUT_SECONDS = {
+    "detect_entities": 15.0,
+    "process_entities": 30.0,
+    "ml_call": 60.0,
+    "execute_sql_query": 300.0,
+}
+
+
 # Step 1:
 ENTITY_DETECTION_SCORE_THR = 0.7
 DRUG_RELATIONSHIP_SCORE_THR = 0.7
 
+# Amazon Comprehend Medical client (shared by steps 1 & 2). It is created on first use.
+# Connection pool size: should be at least the number of threads calling the tool.
+CM_MAX_POOL_CONNECTIONS = 10
+# Maximum attempts per call with adaptive retries.
+CM_MAX_ATTEMPTS = 5
+# Client-side rate limit shared by all threads. Set it to your account TPS quota, either one value for all
+# the operations or a dict by operation (e.g. {"detect_entities_v2": 10, "infer_rx_norm": 5}). None for no limit.
+CM_TRANSACTIONS_PER_SECOND = None
+# Seconds to wait for a connection / a response (a call can take up to CM_MAX_ATTEMPTS times the read timeout,
+# the tool stops waiting for it at the deadline of its step).
+CM_CONNECT_TIMEOUT_SECONDS = 2
+CM_READ_TIMEOUT_SECONDS = 5
+
 
 # Step 2:
+# Directory of the local OMOP vocabulary index used to resolve drugs & conditions before calling CM.
+# Built with `python src/engine/step2/omop_vocabulary.py`. None to resolve them with CM only.
+OMOP_VOCABULARY_INDEX_DIR = None
+# Minimum trigram similarity [0,1] for misspelled names to be resolved with the local index (before calling
+# CM). None to disable. Check the settings with `python src/engine/step2/fuzzy_matching.py`.
+FUZZY_MATCH_SCORE_THR = 0.65
+# Edits allowed per character of a misspelled name (at least 1, common spelling variants are not counted) and
+# minimum length ratio [0,1] between the name and its approximate matches.
+FUZZY_MATCH_MAX_EDIT_RATIO = 0.1
+FUZZY_MATCH_MIN_LENGTH_RATIO = 0.8
 
 
 # Step 3:
@@ -33,6 +68,20 @@ MODEL_PATH = "SPECIFY YOUR MODEL PATH. E.G. /home/ec2-user/SageMaker/efs/models/
 INPUT_MAX_LENGTH = 256
 OUTPUT_MAX_LENGTH = 750
 
+# Decoding settings of the model (arguments of `generate`). A "max_length" of None uses the maximum
+# output length of the model. See src/engine/step4/model_dev/decoding_sweep.py to compare settings.
+DECODING_PARAMS = {
+    "num_beams": 2,
+    "repetition_penalty": 2.5,
+    "length_penalty": 1.0,
+    "max_length": None,
+}
+
+# Known generic SQL templates the model outputs are constrained to (CSV with a "query" column, e.g. the
+# training split, or a text file with a template per line). The decoding stops as soon as the template
+# is unique. None for unconstrained decoding.
+CONSTRAINED_DECODING_TEMPLATES = None
+
 
 # Step 5: Render ML output
 SCHEMA = "cmsdesynpuf23m"
@@ -63,3 +112,36 @@ REDSHIFT_PARM = {
     "url": "SPECIFY THE DATA BASE URL",
     "region": "SPECIFY THE AWS REGION. E.G. us-east-1",
 }
+
+# Cache of executed query results, keyed by the ready-to-execute SQL query & the data version.
+RESULT_CACHE_ENABLED = True
+# Version tag of the OMOP CDM data (e.g. snapshot date). Change it when the data is refreshed to invalidate the cache.
+RESULT_CACHE_DATA_VERSION = "initial"
+# Time to live of the cached results in seconds. None for no expiration.
+RESULT_CACHE_TTL_SECONDS = 7 * 24 * 3600
+# Maximum size of the results kept in memory.
+RESULT_CACHE_MAX_MEMORY_BYTES = 256 * 2 ** 20
+# Directory of the on-disk (Parquet) cache. None to cache in memory only.
+RESULT_CACHE_DIR = None
+# Whether results are shared by all DB users. If False, results are only returned to the user who ran the query.
+RESULT_CACHE_SHARED_ACROSS_USERS = False
+
+
+# Async tool (engine/async_pipeline.py): number of threads running each kind of blocking work.
+# Comprehend Medical calls. Should not exceed CM_MAX_POOL_CONNECTIONS.
+ASYNC_NETWORK_WORKERS = 10
+# ML model inferences. The model already uses several CPU threads per inference.
+ASYNC_INFERENCE_WORKERS = 1
+# SQL query executions (one DB connection each).
+ASYNC_DB_WORKERS = 8
+
+
+# HTTP service (engine/serving.py).
+# Number of requests processed concurrently by the shared tool.
+SERVICE_MAX_WORKERS = 4
+# Maximum number of requests waiting for a worker. Further requests are rejected with 429.
+SERVICE_MAX_QUEUE_SIZE = 16
+# Deadline of the requests not specifying one ("timeout_seconds").
+SERVICE_TIMEOUT_SECONDS = 30.0
+# Maximum number of rows of the returned result tables.
+SERVICE_MAX_RESULT_ROWS = 1000
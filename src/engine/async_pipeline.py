@@ -0,0 +1,208 @@
+"""
+Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+
+SPDX-License-Identifier: CC-BY-NC-4.0
+"""
+
+# This module contains the asyncio variant of the nlq2SQL tool.
+# Each kind of blocking work runs in its own thread pool so the stages of many requests overlap:
+# Comprehend Medical calls (network), ML model inference (CPU) and SQL query executions (database).
+# Cheap steps (3 & 5) run directly in the event loop.
+
+import asyncio
+import functools
+from concurrent.futures import ThreadPoolExecutor
+
+from deadline import Deadline
+from pipeline import nlq2SqlTool
+
+
+class AsyncNlq2SqlTool(object):
+    def __init__(self, config, tool=None):
+        """Initialize the async nlq2SQL tool.
+
+        Args:
+            config (module): Configuration module (`./config.py`)
+            tool (nlq2SqlTool): Synchronous tool doing the work. Default to None to create one from `config`.
+
+        Returns:
+            None
+        """
+        self.tool = tool if tool is not None else nlq2SqlTool(config)
+        # same read-only snapshot as the tool
+        self.config = self.tool.config
+
+        self._network_executor = ThreadPoolExecutor(
+            max_workers=config.ASYNC_NETWORK_WORKERS,
+            thread_name_prefix="nl2sql-network",
+        )
+        self._inference_executor = ThreadPoolExecutor(
+            max_workers=config.ASYNC_INFERENCE_WORKERS,
+            thread_name_prefix="nl2sql-inference",
+        )
+        self._db_executor = ThreadPoolExecutor(
+            max_workers=config.ASYNC_DB_WORKERS, thread_name_prefix="nl2sql-db"
+        )
+
+    async def _run_in_executor(self, executor, fn, *args, **kwargs):
+        """Run the blocking `fn(*args, **kwargs)` in `executor` without blocking the event loop."""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(
+            executor, functools.partial(fn, *args, **kwargs)
+        )
+
+    def set_db_credentials(self, user, password):
+        """Registes DB credentials and test connection (see `nlq2SqlTool.set_db_credentials`)."""
+        self.tool.set_db_credentials(user, password)
+
+    def clear_credentials(self):
+        """Deletes the data base credentials from the tool."""
+        self.tool.clear_credentials()
+
+    async def detect_entities(self, nlq, deadline=None):
+        """Detect entities in a Natural Language Query
+
+        Args:
+            nlq (str): Natural Language Query.
+            deadline (Deadline): Request deadline. Default to None for the step time budget only.
+
+        Returns:
+            dict: Dictionary of detected entities.
+
+        """
+        return await self._run_in_executor(
+            self._network_executor, self.tool.detect_entities, nlq, deadline=deadline
+        )
+
+    async def process_entities(self, entities, deadline=None):
+        """Process entiteis by adding disambiguation options to match OMOP CDM terminology & assign placeholder
+
+        Args:
+            entities (dict): Dictionary of detected entities.
+            deadline (Deadline): Request deadline. Default to None for the step time budget only.
+
+        Returns:
+            dict: Processed entities (disambiguation options and default disambiguation).
+
+        """
+        return await self._run_in_executor(
+            self._network_executor,
+            self.tool.process_entities,
+            entities,
+            deadline=deadline,
+        )
+
+    async def ml_call(self, nlq, deadline=None):
+        """Maps a NLQ to a SQL query by calling the NL2SQL ML model.
+
+        Args:
+            nlq (str): Generic Natural Language Query
+            deadline (Deadline): Request deadline. Default to None for the step time budget only.
+
+        Returns:
+            str: Generic SQL query.
+
+        """
+        return await self._run_in_executor(
+            self._inference_executor, self.tool.ml_call, nlq, deadline=deadline
+        )
+
+    async def execute_sql_query(self, sql_query, deadline=None):
+        """Executes the ready-to-execute `sql_query` against Amazon Redshift
+
+        Args:
+            sql_query (str): Ready-to-execute `sql_query`
+            deadline (Deadline): Request deadline. Default to None for the step time budget only.
+
+        Returns:
+            pd.DataFrame: Table dataframe resulting from the `sql_query` execution.
+
+        """
+        return await self._run_in_executor(
+            self._db_executor, self.tool.execute_sql_query, sql_query, deadline=deadline
+        )
+
+    def _get_deadline(self, deadline):
+        if deadline is None:
+            deadline = Deadline(self.config.REQUEST_TIMEOUT_SECONDS)
+        return deadline
+
+    async def translate(self, nlq, deadline=None):
+        """Run steps 1 to 5: map a Natural Language Query to a ready-to-execute SQL query.
+
+        Args:
+            nlq (str): Natural Language Query
+            deadline (Deadline): Request deadline. Default to None for `config.REQUEST_TIMEOUT_SECONDS` from now.
+
+        Returns:
+            str: Ready-to-execute SQL query.
+
+        """
+        deadline = self._get_deadline(deadline)
+        entities = await self.detect_entities(nlq, deadline=deadline)
+        entities = await self.process_entities(entities, deadline=deadline)
+        nlq2 = self.tool.replace_name_for_placeholder(nlq, entities)
+        template_sql = await self.ml_call(nlq2, deadline=deadline)
+        return self.tool.render_template_query(template_sql, entities)
+
+    async def __call__(self, nlq, deadline=None):
+        """Run pipeline end to end.
+
+        Args:
+            nlq (str): Natural Language Query
+            deadline (Deadline): Request deadline. Default to None for `config.REQUEST_TIMEOUT_SECONDS` from now.
+
+        Returns:
+            pd.DataFrame: Results of executing the SQL query against Amazon Redshift.
+
+        """
+        deadline = self._get_deadline(deadline)
+        final_sql = await self.translate(nlq, deadline=deadline)
+        return await self.execute_sql_query(final_sql, deadline=deadline)
+
+    def close(self):
+        """Shut down the thread pools once the pending work is done.
+
+        Args:
+            None
+
+        Returns:
+            None
+
+        """
+        for executor in (
+            self._network_executor,
+            self._inference_executor,
+            self._db_executor,
+        ):
+            executor.shutdown(wait=True)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        # waiting for the pending work blocks, so it is done off the event loop
+        await asyncio.get_running_loop().run_in_executor(None, self.close)
+
+
+if __name__ == "__main__":
+    import getpass
+    import config
+
+    queries = [
+        "Number of patients grouped by ethnicity",
+        "How many people are taking Aspirin?",
+    ]
+
+    async def main():
+        async with AsyncNlq2SqlTool(config) as tool:
+            user = input("Enter Redshift Database Username: ")
+            password = getpass.getpass(prompt="Enter Redshift Datbase Password: ")
+            tool.set_db_credentials(user, password)
+
+            results = await asyncio.gather(*[tool(query) for query in queries])
+            for query, df in zip(queries, results):
+                print("Input :", query)
+                print("Output :", df)
+
+    asyncio.run(main())
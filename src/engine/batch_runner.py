@@ -0,0 +1,253 @@
+"""
+Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+
+SPDX-License-Identifier: CC-BY-NC-4.0
+"""
+
+# Command-line batch runner: streams Natural Language Queries (one per line) from a file or stdin
+# through the tool and writes one JSON line per query as soon as it completes (completion order).
+# Each record has the query "id" (line number in the input), the intermediate outputs, the row count,
+# order-insensitive fingerprint (see step6/result_fingerprint.py) and path of the result, the time spent
+# in each step and the error, if any.
+# A partially written output file can be resumed: queries already in it are skipped.
+#
+# Usage:
+#     python src/engine/batch_runner.py --input questions.txt --output results.jsonl --db-user <user>
+#
+# The DB password is read from the NL2SQL_DB_PASSWORD environment variable or prompted.
+
+import os
+import sys
+import json
+import getpass
+import argparse
+from os import path as osp
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+sys.path.append(osp.join(osp.dirname(osp.abspath(__file__)), "..", ".."))
+
+import src  # adds the tool folders to the path
+from src import config
+from pipeline import nlq2SqlTool
+from entity_records import entities_to_dicts
+from step6.result_fingerprint import get_result_fingerprint
+
+
+def read_done_ids(output_path):
+    """Read the ids of the queries already in a (possibly partially written) output file.
+
+    A truncated last line (e.g. from an interrupted run) is removed from the file.
+
+    Args:
+        output_path (str): Path of the JSONL output file.
+
+    Returns:
+        set: Ids of the completed queries.
+
+    """
+    done_ids = set()
+    if not osp.exists(output_path):
+        return done_ids
+
+    valid_size = 0
+    with open(output_path, "rb") as fp:
+        for line in fp:
+            if not line.endswith(b"\n"):
+                break
+            try:
+                done_ids.add(json.loads(line)["id"])
+            except (ValueError, KeyError):
+                break
+            valid_size += len(line)
+
+    if valid_size < osp.getsize(output_path):
+        with open(output_path, "r+b") as fp:
+            fp.truncate(valid_size)
+
+    return done_ids
+
+
+def iter_queries(fp, done_ids):
+    """Stream the queries of an input file, skipping empty lines and completed queries.
+
+    Args:
+        fp (file): Input file with a Natural Language Query per line.
+        done_ids (set): Ids of the queries to skip.
+
+    Yields:
+        tuple: Query id (line number) and Natural Language Query.
+
+    """
+    for i, line in enumerate(fp):
+        nlq = line.strip()
+        if nlq and i not in done_ids:
+            yield i, nlq
+
+
+def process_query(tool, query_id, nlq, execute=True, results_dir=None):
+    """Run a query through the tool and build its output record.
+
+    Args:
+        tool (nlq2SqlTool): Tool used to run the query.
+        query_id (int): Query id.
+        nlq (str): Natural Language Query.
+        execute (bool): Whether to execute the SQL query. Default to True.
+        results_dir (str): Directory where the result tables are written as CSV. Default to None for not writing them.
+
+    Returns:
+        dict: JSON-serializable output record.
+
+    """
+    record = {"id": query_id, "nlq": nlq}
+    try:
+        tool.run(nlq, execute=execute, record=record)
+        record["error"] = None
+    except Exception as e:
+        record["error"] = f"{type(e).__name__}: {e}"
+    else:
+        # SQL errors are not raised: the execution returns no result
+        if execute and record.get("result") is None:
+            record["error"] = "ExecutionError: the SQL query execution failed"
+
+    if "entities" in record:
+        record["entities"] = entities_to_dicts(record["entities"])
+
+    result = record.pop("result", None)
+    record["row_count"] = None if result is None else int(result.shape[0])
+    record["result_fingerprint"] = get_result_fingerprint(result)
+    record["result_path"] = None
+    if result is not None and results_dir:
+        record["result_path"] = osp.join(results_dir, f"{query_id}.csv")
+        result.to_csv(record["result_path"], index=False)
+
+    return record
+
+
+def run_batch(
+    tool,
+    input_fp,
+    output_path,
+    max_workers=4,
+    max_in_flight=None,
+    execute=True,
+    results_dir=None,
+    resume=False,
+):
+    """Stream queries through the tool with bounded concurrency and write their records as they complete.
+
+    Queries are read from `input_fp` only when there is room in the in-flight window (backpressure),
+    so memory stays flat regardless of the number of queries.
+
+    Args:
+        tool (nlq2SqlTool): Tool used to run the queries.
+        input_fp (file): Input file with a Natural Language Query per line.
+        output_path (str): Path of the JSONL output file.
+        max_workers (int): Number of queries run concurrently.
+        max_in_flight (int): Maximum number of queries submitted and not written yet. Default to None for `2 * max_workers`.
+        execute (bool): Whether to execute the SQL queries. Default to True.
+        results_dir (str): Directory where the result tables are written as CSV. Default to None for not writing them.
+        resume (bool): Whether to skip the queries already in `output_path` and append to it. Default to False.
+
+    Returns:
+        tuple: Number of queries processed and number of them that failed.
+
+    """
+    max_in_flight = max_in_flight or 2 * max_workers
+    done_ids = read_done_ids(output_path) if resume else set()
+    if results_dir:
+        os.makedirs(results_dir, exist_ok=True)
+
+    n_processed, n_failed = 0, 0
+    in_flight = set()
+
+    with open(output_path, "a" if resume else "w") as out_fp, ThreadPoolExecutor(
+        max_workers=max_workers
+    ) as executor:
+
+        def write_completed(futures):
+            nonlocal n_processed, n_failed
+            for future in futures:
+                record = future.result()
+                out_fp.write(json.dumps(record) + "\n")
+                n_processed += 1
+                n_failed += record["error"] is not None
+            out_fp.flush()
+
+        for query_id, nlq in iter_queries(input_fp, done_ids):
+            if len(in_flight) >= max_in_flight:
+                completed, in_flight = wait(in_flight, return_when=FIRST_COMPLETED)
+                write_completed(completed)
+
+            in_flight.add(
+                executor.submit(
+                    process_query, tool, query_id, nlq, execute, results_dir
+                )
+            )
+
+        completed, _ = wait(in_flight)
+        write_completed(completed)
+
+    return n_processed, n_failed
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(
+        description="Run Natural Language Queries (one per line) through the NL2SQL tool and write JSONL results."
+    )
+    parser.add_argument("--input", default="-", help="Input file. '-' for stdin")
+    parser.add_argument("--output", required=True, help="Output JSONL file")
+    parser.add_argument("--max-workers", type=int, default=4)
+    parser.add_argument("--max-in-flight", type=int, default=None)
+    parser.add_argument(
+        "--results-dir", default=None, help="Directory to write the result tables"
+    )
+    parser.add_argument(
+        "--no-execute", action="store_true", help="Only translate the queries to SQL"
+    )
+    parser.add_argument(
+        "--resume", action="store_true", help="Skip queries already in the output"
+    )
+    parser.add_argument("--db-user", default=None)
+    parser.add_argument(
+        "--local-db",
+        default=None,
+        help="Execute against a local SQLite OMOP database (synthetic one created if missing)",
+    )
+    args = parser.parse_args()
+
+    if args.local_db:
+        from step6.local_database import LocalDatabase
+
+        local_db = LocalDatabase(args.local_db, schema=config.SCHEMA)
+        tool = nlq2SqlTool(config, connect=local_db.connect)
+        if tool.result_cache is not None:
+            tool.result_cache.set_data_version(local_db.data_version)
+        tool.set_db_credentials("local", "")
+    else:
+        tool = nlq2SqlTool(config)
+
+    if not args.no_execute and not args.local_db:
+        user = args.db_user or input("Enter Redshift Database Username: ")
+        password = os.environ.get("NL2SQL_DB_PASSWORD") or getpass.getpass(
+            prompt="Enter Redshift Datbase Password: "
+        )
+        tool.set_db_credentials(user, password)
+
+    input_fp = sys.stdin if args.input == "-" else open(args.input, "r")
+    try:
+        n_processed, n_failed = run_batch(
+            tool,
+            input_fp,
+            args.output,
+            max_workers=args.max_workers,
+            max_in_flight=args.max_in_flight,
+            execute=not args.no_execute,
+            results_dir=args.results_dir,
+            resume=args.resume,
+        )
+    finally:
+        if input_fp is not sys.stdin:
+            input_fp.close()
+
+    print(f"Done! Processed: {n_processed}, failed: {n_failed}", file=sys.stderr)
@@ -0,0 +1,281 @@
+"""
+Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+
+SPDX-License-Identifier: CC-BY-NC-4.0
+"""
+
+# This module contains the Amazon Comprehend Medical (CM) client shared by steps 1 & 2.
+# The client is created on first use (not at import time) with a connection pool sized for the
+# number of threads using it, adaptive retries and a client-side rate limiter shared by all
+# threads, so requests are throttled locally instead of failing with ThrottlingException.
+# The timeouts & retries of the client are client-wide: `call_cm` bounds each call by the deadline of
+# its step instead (a call can otherwise take up to `max_attempts` times the read timeout).
+
+import time
+import threading
+from collections.abc import Mapping
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+
+from deadline import DeadlineExceeded
+
+# CM operations subject to the account TPS quotas.
+RATE_LIMITED_OPERATIONS = ("detect_entities_v2", "infer_icd10_cm", "infer_rx_norm")
+
+_DEFAULT_SETTINGS = {
+    "max_pool_connections": 10,
+    "max_attempts": 5,
+    "transactions_per_second": None,
+    "region_name": None,
+    "connect_timeout": 60,
+    "read_timeout": 60,
+}
+
+_settings = dict(_DEFAULT_SETTINGS)
+_client = None
+_client_lock = threading.Lock()
+# Threads running the CM calls bounded by a deadline (see `call_cm`).
+_call_executor = None
+
+
+class TokenBucket(object):
+    def __init__(self, rate, capacity=None):
+        """Thread-safe token bucket rate limiter.
+
+        Args:
+            rate (float): Tokens added per second (e.g. the TPS quota).
+            capacity (float): Maximum number of tokens (burst size). Default to None for `rate`.
+
+        Returns:
+            None
+
+        """
+        self.rate = float(rate)
+        self.capacity = float(capacity if capacity is not None else max(rate, 1))
+        self._tokens = self.capacity
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, tokens=1):
+        """Take `tokens` from the bucket, waiting for them to be available if needed.
+
+        Tokens are reserved before waiting, so concurrent callers are served in order
+        and spaced by `1 / rate` seconds instead of retrying in bursts.
+
+        Args:
+            tokens (float): Number of tokens to take.
+
+        Returns:
+            float: Seconds waited.
+
+        """
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(
+                self.capacity, self._tokens + (now - self._last) * self.rate
+            )
+            self._last = now
+            self._tokens -= tokens
+            wait = -self._tokens / self.rate if self._tokens < 0 else 0.0
+
+        if wait > 0:
+            time.sleep(wait)
+        return wait
+
+
+class RateLimitedClient(object):
+    def __init__(self, client, buckets):
+        """Wrap a boto3 client so the rate-limited operations take a token before each call.
+
+        Args:
+            client (botocore.client.BaseClient): CM client.
+            buckets (dict): TokenBucket (value) by operation name (key).
+
+        Returns:
+            None
+
+        """
+        self._client = client
+        self._buckets = buckets
+
+    def __getattr__(self, name):
+        attribute = getattr(self._client, name)
+        bucket = self._buckets.get(name)
+        if bucket is None:
+            return attribute
+
+        def rate_limited_call(*args, **kwargs):
+            bucket.acquire()
+            return attribute(*args, **kwargs)
+
+        return rate_limited_call
+
+
+def _get_buckets(transactions_per_second):
+    """Create the rate limiter buckets.
+
+    Args:
+        transactions_per_second (float or dict): TPS quota shared by all the rate-limited operations, or TPS quota (value) by operation name (key).
+
+    Returns:
+        dict: TokenBucket (value) by operation name (key).
+
+    """
+    if isinstance(transactions_per_second, Mapping):
+        return {
+            operation: TokenBucket(tps)
+            for operation, tps in transactions_per_second.items()
+            if tps
+        }
+
+    bucket = TokenBucket(transactions_per_second)
+    return {operation: bucket for operation in RATE_LIMITED_OPERATIONS}
+
+
+def create_cm_client(
+    max_pool_connections=10,
+    max_attempts=5,
+    transactions_per_second=None,
+    region_name=None,
+    connect_timeout=60,
+    read_timeout=60,
+):
+    """Create a CM client.
+
+    Args:
+        max_pool_connections (int): Maximum number of HTTP connections kept in the pool. Should be at least the number of threads using the client.
+        max_attempts (int): Maximum number of attempts of a call (adaptive retry mode).
+        transactions_per_second (float or dict): Client-side TPS limit shared by all threads (see `_get_buckets`). None for no limit.
+        region_name (str): AWS region. Default to None for the default AWS configuration.
+        connect_timeout (float): Seconds to wait for a connection to be established.
+        read_timeout (float): Seconds to wait for a response. A call can take up to `max_attempts` times this value.
+
+    Returns:
+        botocore.client.BaseClient: CM client (wrapped in RateLimitedClient if limited).
+
+    """
+    import boto3
+    from botocore.config import Config
+
+    client_config = Config(
+        max_pool_connections=max_pool_connections,
+        connect_timeout=connect_timeout,
+        read_timeout=read_timeout,
+        retries={"max_attempts": max_attempts, "mode": "adaptive"},
+    )
+    client = boto3.client(
+        "comprehendmedical", region_name=region_name, config=client_config
+    )
+
+    if transactions_per_second:
+        client = RateLimitedClient(client, _get_buckets(transactions_per_second))
+
+    return client
+
+
+def configure_cm_client(**settings):
+    """Update the settings of the shared CM client (see `create_cm_client` arguments).
+
+    The client is (re)created with the new settings on its next use.
+
+    Args:
+        **settings: Settings to update.
+
+    Returns:
+        None
+
+    """
+    global _client
+
+    unknown = set(settings) - set(_DEFAULT_SETTINGS)
+    if unknown:
+        raise ValueError(f"Unknown CM client settings: {sorted(unknown)}")
+
+    with _client_lock:
+        _settings.update(settings)
+        _client = None
+
+
+def set_cm_client(client):
+    """Replace the shared CM client (e.g. by a stand-in for local testing).
+
+    The client is kept until the next `configure_cm_client` call.
+
+    Args:
+        client (object): Object with the CM operations used by the tool (`detect_entities_v2`, `infer_icd10_cm` & `infer_rx_norm`).
+
+    Returns:
+        None
+
+    """
+    global _client
+
+    with _client_lock:
+        _client = client
+
+
+def get_cm_client():
+    """Get the shared CM client, creating it on first use.
+
+    Args:
+        None
+
+    Returns:
+        botocore.client.BaseClient: CM client. Safe to be shared by threads.
+
+    """
+    global _client
+
+    client = _client
+    if client is None:
+        with _client_lock:
+            if _client is None:
+                _client = create_cm_client(**_settings)
+            client = _client
+    return client
+
+
+def _get_call_executor():
+    """Get the threads running the CM calls bounded by a deadline, creating them on first use."""
+    global _call_executor
+
+    executor = _call_executor
+    if executor is None:
+        with _client_lock:
+            if _call_executor is None:
+                _call_executor = ThreadPoolExecutor(
+                    max_workers=_settings["max_pool_connections"],
+                    thread_name_prefix="cm-call",
+                )
+            executor = _call_executor
+    return executor
+
+
+def call_cm(client, operation, deadline=None, **kwargs):
+    """Call a CM operation, waiting for it at most until the deadline.
+
+    A call still running at the deadline is abandoned: it completes (or times out) in the background.
+
+    Args:
+        client (object): CM client.
+        operation (str): Name of the CM operation (e.g. "detect_entities_v2").
+        deadline (Deadline): Deadline of the step. Default to None for no deadline (client timeouts only).
+        **kwargs: Arguments of the operation (e.g. `Text`).
+
+    Returns:
+        dict: Response of the operation.
+
+    Raises:
+        DeadlineExceeded: The deadline expired before or during the call.
+
+    """
+    remaining = None if deadline is None else deadline.remaining()
+    if remaining is None:
+        return getattr(client, operation)(**kwargs)
+
+    deadline.check(operation)
+    future = _get_call_executor().submit(getattr(client, operation), **kwargs)
+    try:
+        return future.result(timeout=max(deadline.remaining(), 0))
+    except FutureTimeoutError:
+        future.cancel()
+        raise DeadlineExceeded(f"Deadline exceeded in {operation}.")
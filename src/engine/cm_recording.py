@@ -0,0 +1,240 @@
+"""
+Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+
+SPDX-License-Identifier: CC-BY-NC-4.0
+"""
+
+# Record/replay of Amazon Comprehend Medical (CM) responses, for reproducible benchmarks without network
+# noise or API cost. `RecordingCMClient` wraps a real client and appends each new response (and its latency)
+# to a gzipped JSONL store; `ReplayCMClient` answers from the store after an injected latency.
+# Both are given to the tool (`nlq2SqlTool(config, cm_client=...)`) or to the step 1 & 2 functions
+# (`cm_client=` argument): the shared client of `cm_client.py` is left untouched.
+#
+# Usage (records the CM responses of steps 1 & 2 for each question, no model or DB needed):
+#     python src/engine/cm_recording.py --input questions.txt --output cm_recordings.jsonl.gz
+
+import sys
+import copy
+import gzip
+import json
+import time
+import argparse
+import threading
+from os import path as osp
+
+# Operations recorded & replayed.
+CM_OPERATIONS = ("detect_entities_v2", "infer_icd10_cm", "infer_rx_norm")
+
+# Response fields kept in the store (e.g. "ResponseMetadata" is dropped).
+RESPONSE_KEYS = ("Entities", "UnmappedAttributes", "ModelVersion")
+
+
+class RecordingNotFound(LookupError):
+    """No recorded response for a CM call."""
+
+
+def read_recordings(store_path):
+    """Read a store of recorded responses. A truncated end (interrupted recording) is ignored.
+
+    Args:
+        store_path (str): Path to the gzipped JSONL store.
+
+    Returns:
+        dict: (response, latency in seconds) by (operation, text).
+
+    """
+    recordings = {}
+    if not osp.exists(store_path):
+        return recordings
+
+    with gzip.open(store_path, "rt", encoding="utf-8") as fp:
+        try:
+            for line in fp:
+                if not line.endswith("\n"):
+                    break
+                record = json.loads(line)
+                recordings[(record["operation"], record["text"])] = (
+                    record["response"],
+                    record["latency"],
+                )
+        except (EOFError, ValueError):
+            pass
+    return recordings
+
+
+class RecordingCMClient(object):
+    def __init__(self, client, store_path):
+        """CM client recording the responses of `client`. Texts already in the store are not recorded again.
+
+        Args:
+            client (object): CM client (e.g. `cm_client.get_cm_client()`).
+            store_path (str): Path to the gzipped JSONL store, appended to.
+
+        Returns:
+            None
+
+        """
+        self._client = client
+        self._recorded = set(read_recordings(store_path))
+        self._lock = threading.Lock()
+        self._store = gzip.open(store_path, "at", encoding="utf-8")
+
+    def _call(self, operation, text):
+        start = time.perf_counter()
+        response = getattr(self._client, operation)(Text=text)
+        latency = time.perf_counter() - start
+
+        compact_response = {
+            key: response[key] for key in RESPONSE_KEYS if key in response
+        }
+        record = {
+            "operation": operation,
+            "text": text,
+            "response": compact_response,
+            "latency": round(latency, 4),
+        }
+        with self._lock:
+            if (operation, text) not in self._recorded:
+                self._recorded.add((operation, text))
+                self._store.write(json.dumps(record, default=str) + "\n")
+                # readable up to here if the recording is interrupted
+                self._store.flush()
+        return response
+
+    def detect_entities_v2(self, Text):
+        return self._call("detect_entities_v2", Text)
+
+    def infer_icd10_cm(self, Text):
+        return self._call("infer_icd10_cm", Text)
+
+    def infer_rx_norm(self, Text):
+        return self._call("infer_rx_norm", Text)
+
+    def close(self):
+        """Close the store."""
+        with self._lock:
+            self._store.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+class ReplayCMClient(object):
+    def __init__(self, store_path, latency_seconds=0.0, fallback_client=None):
+        """CM client answering with recorded responses.
+
+        Args:
+            store_path (str): Path to the gzipped JSONL store.
+            latency_seconds (float, dict or str): Injected latency of each call: seconds, seconds (value) by operation (key), or "recorded" for the recorded latencies.
+            fallback_client (object): CM client called for the texts not recorded. Default to None to raise `RecordingNotFound`.
+
+        Returns:
+            None
+
+        """
+        self.recordings = read_recordings(store_path)
+        self.latency_seconds = latency_seconds
+        self.fallback_client = fallback_client
+
+    def _get_latency(self, operation, recorded_latency):
+        if self.latency_seconds == "recorded":
+            return recorded_latency
+        if isinstance(self.latency_seconds, dict):
+            return self.latency_seconds.get(operation, 0.0)
+        return self.latency_seconds
+
+    def _call(self, operation, text):
+        recording = self.recordings.get((operation, text))
+        if recording is None:
+            if self.fallback_client is None:
+                raise RecordingNotFound(
+                    f"No recorded {operation} response for {text!r}."
+                )
+            return getattr(self.fallback_client, operation)(Text=text)
+
+        response, recorded_latency = recording
+        latency = self._get_latency(operation, recorded_latency)
+        if latency:
+            time.sleep(latency)
+        # the steps modify the entities of the response
+        return copy.deepcopy(response)
+
+    def detect_entities_v2(self, Text):
+        return self._call("detect_entities_v2", Text)
+
+    def infer_icd10_cm(self, Text):
+        return self._call("infer_icd10_cm", Text)
+
+    def infer_rx_norm(self, Text):
+        return self._call("infer_rx_norm", Text)
+
+    def __len__(self):
+        """Number of recorded responses."""
+        return len(self.recordings)
+
+
+def record_questions(questions, client, store_path, config):
+    """Record the CM responses of steps 1 & 2 for each question.
+
+    The local vocabulary index is not used, so the responses of every drug & condition are recorded.
+
+    Args:
+        questions (iterable): Natural Language Queries.
+        client (object): CM client.
+        store_path (str): Path to the gzipped JSONL store, appended to.
+        config (module): Configuration module (`./config.py`).
+
+    Returns:
+        int: Number of recorded responses in the store.
+
+    """
+    from step1.entity_extraction import detect_entities
+    from step2.entity_processing import add_omop_disambiguation_options
+
+    with RecordingCMClient(client, store_path) as recorder:
+        for nlq in questions:
+            entities = detect_entities(
+                nlq,
+                config.ENTITY_DETECTION_SCORE_THR,
+                config.DRUG_RELATIONSHIP_SCORE_THR,
+                cm_client=recorder,
+            )
+            add_omop_disambiguation_options(dict(entities), cm_client=recorder)
+
+    return len(read_recordings(store_path))
+
+
+if __name__ == "__main__":
+
+    sys.path.append(osp.join(osp.dirname(osp.abspath(__file__)), "..", ".."))
+    import src  # adds the tool folders to the path
+    from src import config
+    from cm_client import configure_cm_client, get_cm_client
+
+    parser = argparse.ArgumentParser(
+        description="Record the Comprehend Medical responses of questions (one per line)."
+    )
+    parser.add_argument("--input", default="-", help="Input file. '-' for stdin")
+    parser.add_argument("--output", required=True, help="Store (gzipped JSONL)")
+    args = parser.parse_args()
+
+    configure_cm_client(
+        max_pool_connections=config.CM_MAX_POOL_CONNECTIONS,
+        max_attempts=config.CM_MAX_ATTEMPTS,
+        transactions_per_second=config.CM_TRANSACTIONS_PER_SECOND,
+        connect_timeout=config.CM_CONNECT_TIMEOUT_SECONDS,
+        read_timeout=config.CM_READ_TIMEOUT_SECONDS,
+    )
+
+    input_fp = sys.stdin if args.input == "-" else open(args.input, "r")
+    try:
+        questions = (line.strip() for line in input_fp if line.strip())
+        n_recorded = record_questions(questions, get_cm_client(), args.output, config)
+    finally:
+        if input_fp is not sys.stdin:
+            input_fp.close()
+
+    print(f"Done! Recorded responses: {n_recorded}", file=sys.stderr)
@@ -0,0 +1,75 @@
+"""
+Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+
+SPDX-License-Identifier: CC-BY-NC-4.0
+"""
+
+# This module contains the request deadline propagated to the tool steps.
+# A deadline is set once per request and each step derives from it its own time budget
+# (the earliest of the request deadline and the step budget), which is turned into timeouts
+# of the blocking calls (CM calls, ML model generation & SQL query execution).
+
+import time
+
+
+class DeadlineExceeded(Exception):
+    """The request (or one of its steps) could not complete before its deadline."""
+
+
+class Deadline(object):
+    def __init__(self, timeout_seconds=None, expires_at=None):
+        """Initialize a deadline.
+
+        Args:
+            timeout_seconds (float): Time budget from now. Default to None for no deadline.
+            expires_at (float): Expiration time (`time.monotonic()` clock). Overrides `timeout_seconds`.
+
+        Returns:
+            None
+
+        """
+        if expires_at is None and timeout_seconds is not None:
+            expires_at = time.monotonic() + timeout_seconds
+        self.expires_at = expires_at
+
+    def remaining(self):
+        """Seconds left before the deadline (negative if expired). None if there is no deadline."""
+        if self.expires_at is None:
+            return None
+        return self.expires_at - time.monotonic()
+
+    def expired(self):
+        return self.expires_at is not None and time.monotonic() >= self.expires_at
+
+    def check(self, stage):
+        """Fail fast if the deadline expired.
+
+        Args:
+            stage (str): Name of the step about to run (for the error message).
+
+        Returns:
+            None
+
+        Raises:
+            DeadlineExceeded: The deadline expired.
+
+        """
+        if self.expired():
+            raise DeadlineExceeded(f"Deadline exceeded before {stage}.")
+
+    def for_stage(self, budget_seconds=None):
+        """Deadline of a step: the earliest of this deadline and the step time budget.
+
+        Args:
+            budget_seconds (float): Time budget of the step from now. None for no step budget.
+
+        Returns:
+            Deadline: Deadline of the step.
+
+        """
+        if budget_seconds is None:
+            return self
+        stage_expires_at = time.monotonic() + budget_seconds
+        if self.expires_at is not None:
+            stage_expires_at = min(stage_expires_at, self.expires_at)
+        return Deadline(expires_at=stage_expires_at)
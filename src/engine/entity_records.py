@@ -0,0 +1,264 @@
+"""
+Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+
+SPDX-License-Identifier: CC-BY-NC-4.0
+"""
+
+# This module contains the records used to represent the entities flowing through the tool steps.
+# Records are immutable: updating a field returns a new record sharing the rest of the fields
+# (e.g. the tuple of options), so entities never need to be deep-copied.
+# Records are read with the same keys as the original entity dictionaries (e.g. entity["Query-arg"])
+# and converted from/to dictionaries with `from_dict`/`to_dict` (e.g. to be dumped as JSON).
+
+
+class _Record(object):
+    __slots__ = ()
+
+    # mapping between the dictionary keys and the record fields.
+    KEY2FIELD = {}
+
+    def __setattr__(self, name, value):
+        raise AttributeError(f"{type(self).__name__} is immutable. Use `replace`.")
+
+    def _init_fields(self, **fields):
+        """Set the record fields. Only meant to be used when the record is created."""
+        for field, value in fields.items():
+            object.__setattr__(self, field, value)
+
+    def __getitem__(self, key):
+        """Dictionary-like access (e.g. entity["Text"]). Unset fields raise KeyError."""
+        try:
+            value = getattr(self, self.KEY2FIELD[key])
+        except KeyError:
+            raise KeyError(key)
+        if value is None:
+            raise KeyError(key)
+        return value
+
+    def get(self, key, default=None):
+        """Dictionary-like access with default value."""
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def __contains__(self, key):
+        return self.get(key) is not None
+
+    def keys(self):
+        """Dictionary keys of the set fields."""
+        return [key for key in self.KEY2FIELD if key in self]
+
+    def items(self):
+        """Dictionary items of the set fields."""
+        return [(key, self[key]) for key in self.keys()]
+
+    def _values(self):
+        return tuple(getattr(self, field) for field in self.__slots__)
+
+    def __eq__(self, other):
+        return type(self) is type(other) and self._values() == other._values()
+
+    def __hash__(self):
+        return hash(self._values())
+
+    def __repr__(self):
+        fields = ", ".join(
+            f"{field}={getattr(self, field)!r}" for field in self.__slots__
+        )
+        return f"{type(self).__name__}({fields})"
+
+    def __getstate__(self):
+        return self._values()
+
+    def __setstate__(self, state):
+        self._init_fields(**dict(zip(self.__slots__, state)))
+
+
+class EntityOption(_Record):
+    """Disambiguation option of an entity (e.g. an RxNorm or ICD10CM concept)."""
+
+    __slots__ = ("code", "description", "score")
+
+    KEY2FIELD = {"Code": "code", "Description": "description", "Score": "score"}
+
+    def __init__(self, code, description=None, score=None):
+        """Create an option.
+
+        Args:
+            code (str): Code (or standard name) the entity is disambiguated to.
+            description (str): Description of the code. Default to None.
+            score (float): Confidence of the option. Default to None.
+
+        Returns:
+            None
+
+        """
+        self._init_fields(code=code, description=description, score=score)
+
+    @classmethod
+    def from_dict(cls, option):
+        """Create an option from a dictionary with "Code", "Description" and "Score" keys.
+
+        Args:
+            option (dict): Option dictionary (e.g. a CM concept). Options are returned as is.
+
+        Returns:
+            EntityOption: Option record.
+
+        """
+        if isinstance(option, cls):
+            return option
+        return cls(option["Code"], option.get("Description"), option.get("Score"))
+
+    def to_dict(self):
+        """Convert the option to a dictionary with the set fields."""
+        return dict(self.items())
+
+
+class EntityRecord(_Record):
+    """Entity detected in a NLQ and, after step 2, its disambiguation and placeholder."""
+
+    __slots__ = (
+        "begin_offset",
+        "end_offset",
+        "text",
+        "options",
+        "query_arg",
+        "placeholder",
+    )
+
+    KEY2FIELD = {
+        "BeginOffset": "begin_offset",
+        "EndOffset": "end_offset",
+        "Text": "text",
+        "Options": "options",
+        "Query-arg": "query_arg",
+        "Placeholder": "placeholder",
+    }
+
+    def __init__(
+        self,
+        begin_offset,
+        end_offset,
+        text,
+        options=None,
+        query_arg=None,
+        placeholder=None,
+    ):
+        """Create an entity record.
+
+        Args:
+            begin_offset (int): Start position of the entity in the NLQ.
+            end_offset (int): End position of the entity in the NLQ.
+            text (str): Name of the entity as it appears in the NLQ.
+            options (iterable): Disambiguation options (records or dictionaries). Default to None.
+            query_arg (str): Default disambiguation used to render the query. Default to None.
+            placeholder (str): Placeholder of the entity in the generic NLQ. Default to None.
+
+        Returns:
+            None
+
+        """
+        if options is not None:
+            options = tuple(EntityOption.from_dict(option) for option in options)
+        self._init_fields(
+            begin_offset=begin_offset,
+            end_offset=end_offset,
+            text=text,
+            options=options,
+            query_arg=query_arg,
+            placeholder=placeholder,
+        )
+
+    def replace(self, **changes):
+        """Create a copy of the record with updated fields.
+
+        Args:
+            **changes: New values of the fields (e.g. `query_arg="1191"`).
+
+        Returns:
+            EntityRecord: New record. Fields that are not updated are shared with this record.
+
+        """
+        fields = {field: getattr(self, field) for field in self.__slots__}
+        fields.update(changes)
+        return EntityRecord(**fields)
+
+    @classmethod
+    def from_dict(cls, entity):
+        """Create a record from an entity dictionary.
+
+        Args:
+            entity (dict): Entity dictionary ("BeginOffset", "EndOffset", "Text" and optionally "Options", "Query-arg", "Placeholder"). Records are returned as is.
+
+        Returns:
+            EntityRecord: Entity record.
+
+        """
+        if isinstance(entity, cls):
+            return entity
+        return cls(
+            **{
+                field: entity.get(key)
+                for key, field in cls.KEY2FIELD.items()
+                if key in entity
+            }
+        )
+
+    def to_dict(self):
+        """Convert the record to an entity dictionary with the set fields."""
+        out = dict(self.items())
+        if "Options" in out:
+            out["Options"] = [option.to_dict() for option in out["Options"]]
+        return out
+
+
+def entities_from_dicts(entities):
+    """Convert entity dictionaries grouped by category to records.
+
+    Args:
+        entities (dict): Dictionary of entities list (value) by category (key).
+
+    Returns:
+        dict: Dictionary of records list (value) by category (key).
+
+    """
+    return {
+        category: [EntityRecord.from_dict(entity) for entity in category_entities]
+        for category, category_entities in entities.items()
+    }
+
+
+def entities_to_dicts(entities):
+    """Convert records grouped by category to entity dictionaries (e.g. to be dumped as JSON).
+
+    Args:
+        entities (dict): Dictionary of records list (value) by category (key).
+
+    Returns:
+        dict: Dictionary of entity dictionaries list (value) by category (key).
+
+    """
+    return {
+        category: [
+            EntityRecord.from_dict(entity).to_dict() for entity in category_entities
+        ]
+        for category, category_entities in entities.items()
+    }
+
+
+def copy_entities(entities):
+    """Copy the category lists of `entities`. Records are immutable so they are shared.
+
+    Args:
+        entities (dict): Dictionary of records list (value) by category (key).
+
+    Returns:
+        dict: New dictionary with new lists of the same records.
+
+    """
+    return {
+        category: list(category_entities)
+        for category, category_entities in entities.items()
+    }
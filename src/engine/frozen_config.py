@@ -0,0 +1,64 @@
+"""
+Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+
+SPDX-License-Identifier: CC-BY-NC-4.0
+"""
+
+# This module contains the read-only snapshot of the configuration used by the tool.
+# The snapshot is taken when the tool is created, so later changes to the configuration module
+# (e.g. from a notebook) can't change the settings seen by requests running in other threads.
+
+from types import MappingProxyType, ModuleType
+
+
+def _freeze(value):
+    """Read-only version of a configuration value (dictionaries & lists are frozen recursively)."""
+    if isinstance(value, dict):
+        return MappingProxyType({key: _freeze(item) for key, item in value.items()})
+    if isinstance(value, (list, tuple)):
+        return tuple(_freeze(item) for item in value)
+    if isinstance(value, set):
+        return frozenset(value)
+    return value
+
+
+class FrozenConfig(object):
+    def __init__(self, config):
+        """Read-only snapshot of a configuration module (or object).
+
+        Settings are read as attributes, like the module (e.g. `config.SCHEMA`). Dictionaries are
+        snapshotted as read-only mappings and lists as tuples. Imported modules are left out.
+
+        Args:
+            config (module): Configuration module (`./config.py`)
+
+        Returns:
+            None
+
+        """
+        if isinstance(config, FrozenConfig):
+            settings = config._settings
+        else:
+            settings = {
+                name: _freeze(value)
+                for name, value in vars(config).items()
+                if not name.startswith("_") and not isinstance(value, ModuleType)
+            }
+        object.__setattr__(self, "_settings", settings)
+
+    def __getattr__(self, name):
+        if name == "_settings":
+            raise AttributeError(name)
+        try:
+            return self._settings[name]
+        except KeyError:
+            raise AttributeError(f"Config has no setting {name!r}.")
+
+    def __setattr__(self, name, value):
+        raise AttributeError("Config snapshot is read-only.")
+
+    def __dir__(self):
+        return list(self._settings)
+
+    def __repr__(self):
+        return f"FrozenConfig({sorted(self._settings)})"
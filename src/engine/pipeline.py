@@ -6,32 +6,111 @@ SPDX-License-Identifier: CC-BY-NC-4.0
 
 from os import path as osp
 import sys
+import time
 import getpass
+import threading
+from collections import namedtuple
 
 sys.path.append("../")
 
+from cm_client import configure_cm_client
+from deadline import Deadline, DeadlineExceeded
+from entity_records import copy_entities
+from frozen_config import FrozenConfig
+from single_flight import SingleFlight
 from step1.entity_extraction import detect_entities
 from step2.entity_processing import add_omop_disambiguation_options, add_placeholders
+from step2.omop_vocabulary import load_vocabulary_index
 from step3.nlq_processing import replace_name_for_placeholder
-from step4.model_dev.t5_inference import Inferencer
 from step5.sql_processing import render_template_query
 from step6.query_execution import connect_to_db, execute_query
-from copy import deepcopy
+from step6.result_cache import ResultCache
+
+
+class DBCredentials(namedtuple("DBCredentials", ["user", "password"])):
+    """Immutable DB credentials. Replaced as a whole, so a call never mixes the user and password of different sets."""
+
+    __slots__ = ()
+
+    def __repr__(self):
+        return f"DBCredentials(user={self.user!r}, password='***')"
 
 
 class nlq2SqlTool(object):
-    def __init__(self, config):
+    """NLQ to SQL tool. A single instance can be shared by many threads.
+
+    Shared by all the calls (read-only or internally synchronized):
+        - the configuration: a read-only snapshot taken at initialization (`FrozenConfig`),
+        - the ML model, called concurrently for inference only,
+        - the CM client (given or the shared `cm_client` one) and the local vocabulary index (read-only),
+        - the result cache and the coalescing of identical in-flight calls (`SingleFlight`),
+        - the DB credentials: an immutable `DBCredentials`, read once per call. Setting new ones
+          only affects the calls started afterwards.
+
+    Per call: entities (immutable records, copied category lists), DB connection & cursor.
+    """
+
+    def __init__(self, config, model=None, connect=None, cm_client=None):
         """Initialize the nlq2SQL tool.
 
         Args:
-            config (module): Configuration module (`./config.py`)
+            config (module): Configuration module (`./config.py`). A read-only snapshot of it is used.
+            model (callable): Maps a generic NLQ to a generic SQL query: `model(nlq, max_time=None)`, `max_time` being the seconds left to generate. Default to None to load the `Inferencer` of `config.MODEL_PATH`.
+            connect (callable): Opens a DB connection: `connect(redshift_parameters, user, password, connect_timeout=None)`. The connection must support `cursor()`, `cancel()` & `close()`. Default to None for `connect_to_db`.
+            cm_client (object): CM client used by steps 1 & 2 (e.g. a stand-in or recorded-response client). Default to None for the shared client configured from `config`.
 
         Returns:
             None
         """
 
+        config = FrozenConfig(config)
         self.config = config
-        self.model = Inferencer(config.MODEL_PATH)
+        self._credentials = None
+        self.cm_client = cm_client
+        if cm_client is None:
+            configure_cm_client(
+                max_pool_connections=config.CM_MAX_POOL_CONNECTIONS,
+                max_attempts=config.CM_MAX_ATTEMPTS,
+                transactions_per_second=config.CM_TRANSACTIONS_PER_SECOND,
+                connect_timeout=config.CM_CONNECT_TIMEOUT_SECONDS,
+                read_timeout=config.CM_READ_TIMEOUT_SECONDS,
+            )
+        if model is None:
+            # imported here: loading torch & transformers takes seconds
+            from step4.model_dev.t5_inference import Inferencer
+            from step4.model_dev.constrained_decoding import read_templates
+
+            templates = None
+            if config.CONSTRAINED_DECODING_TEMPLATES is not None:
+                templates = read_templates(config.CONSTRAINED_DECODING_TEMPLATES)
+            model = Inferencer(
+                config.MODEL_PATH,
+                decoding_params=config.DECODING_PARAMS,
+                templates=templates,
+            )
+        self.model = model
+        self._connect = connect if connect is not None else connect_to_db
+        # concurrent identical requests of a step are run once and share their outcome
+        self._detection_calls = SingleFlight()
+        self._ml_calls = SingleFlight()
+        self._execution_calls = SingleFlight()
+
+        self.vocabulary_index = load_vocabulary_index(
+            config.OMOP_VOCABULARY_INDEX_DIR,
+            fuzzy_score_thr=config.FUZZY_MATCH_SCORE_THR,
+            fuzzy_max_edit_ratio=config.FUZZY_MATCH_MAX_EDIT_RATIO,
+            fuzzy_min_length_ratio=config.FUZZY_MATCH_MIN_LENGTH_RATIO,
+        )
+        self.result_cache = (
+            ResultCache(
+                data_version=config.RESULT_CACHE_DATA_VERSION,
+                ttl_seconds=config.RESULT_CACHE_TTL_SECONDS,
+                max_memory_bytes=config.RESULT_CACHE_MAX_MEMORY_BYTES,
+                cache_dir=config.RESULT_CACHE_DIR,
+            )
+            if config.RESULT_CACHE_ENABLED
+            else None
+        )
 
     def set_db_credentials(self, user, password):
         """Registes DB credentials and test connection.
@@ -43,13 +122,15 @@ class nlq2SqlTool(object):
         Returns:
             None
         """
-        self._user = user
-        self._password = password
+        credentials = DBCredentials(user, password)
 
         # test connection
-        test_conn = connect_to_db(self.config.REDSHIFT_PARM, self._user, self._password)
+        test_conn = self._connect(self.config.REDSHIFT_PARM, *credentials)
         test_conn.close()
 
+        # replaced only once tested: concurrent calls use either the old or the new credentials
+        self._credentials = credentials
+
     def clear_credentials(self):
         """Deletes the user and password data base credentials from the tool
 
@@ -59,9 +140,7 @@ class nlq2SqlTool(object):
         Returns:
             None
         """
-        if self.credentials_exist():
-            del self._user
-            del self._password
+        self._credentials = None
 
     def credentials_exist(
         self,
@@ -74,69 +153,78 @@ class nlq2SqlTool(object):
         Returns:
             bool: True if user and password are, False otherwise.
         """
-        return hasattr(self, "_user") and hasattr(self, "_password")
-
-    def _open_redshift_connection(
-        self,
-    ):
-        """Open connect to the redshift database.
+        return self._credentials is not None
 
-        Args:
-            None
+    def _get_credentials(self):
+        """Credentials of a call: read once, so the whole call uses the same set."""
+        credentials = self._credentials
+        if credentials is None:
+            raise ValueError("DB credentials not set. Call `set_db_credentials` first.")
+        return credentials
 
-        Returns:
-            None
-
-
-        """
-        self.conn = connect_to_db(self.config.REDSHIFT_PARM, self._user, self._password)
-
-    def _close_redshift_connection(
-        self,
-    ):
-        """Close connect to the redshift database.
+    def _get_step_deadline(self, step, deadline=None):
+        """Deadline of a step: the earliest of the request deadline and the step time budget.
 
         Args:
-            None
+            step (str): Step name (key of `config.STEP_TIMEOUT_SECONDS`).
+            deadline (Deadline): Request deadline. Default to None for no request deadline.
 
         Returns:
-            None
+            Deadline: Deadline of the step.
 
-        """
-        if not hasattr(self, "conn"):
-            raise AttributeError("Connection has to be opened before closing it")
+        Raises:
+            DeadlineExceeded: The request deadline already expired.
 
-        self.conn.close()
+        """
+        deadline = Deadline() if deadline is None else deadline
+        deadline.check(step)
+        return deadline.for_stage(self.config.STEP_TIMEOUT_SECONDS.get(step))
 
-    def detect_entities(self, nlq):
+    def detect_entities(self, nlq, deadline=None):
         """Detect entities in a Natural Language Query
 
         Args:
             nlq (str): Natural Language Query.
+            deadline (Deadline): Request deadline. Default to None for the step time budget only.
 
         Returns:
             dict: Dictionary of detected entities.
 
         """
-        return detect_entities(
+        deadline = self._get_step_deadline("detect_entities", deadline)
+        entities, _ = self._detection_calls.do(
+            nlq,
+            detect_entities,
             nlq,
             self.config.ENTITY_DETECTION_SCORE_THR,
             self.config.DRUG_RELATIONSHIP_SCORE_THR,
+            deadline,
+            self.cm_client,
+            deadline=deadline,
         )
+        # entity records are immutable, only the category lists need to be copied
+        return copy_entities(entities)
 
-    def process_entities(self, entities, **kwargs):
+    def process_entities(self, entities, deadline=None, **kwargs):
         """Process entiteis by adding disambiguation options to match OMOP CDM terminology & assign placeholder
 
         Args:
             entities (dict): Dictionary of detected entities.
+            deadline (Deadline): Request deadline. Default to None for the step time budget only.
 
         Returns:
-            dict: Processed entities (disambiguation options and default disambiguation).
+            dict: Processed entities (disambiguation options and default disambiguation). The input `entities` are not modified.
 
         """
-        entities = deepcopy(entities)
-        #         TODO: Implement add_omop_disambiguation_options and add_placeholders
-        entities = add_omop_disambiguation_options(entities)
+        # step 2 replaces the category lists with new immutable records: no need to deep-copy
+        deadline = self._get_step_deadline("process_entities", deadline)
+        entities = dict(entities)
+        entities = add_omop_disambiguation_options(
+            entities,
+            vocabulary_index=self.vocabulary_index,
+            deadline=deadline,
+            cm_client=self.cm_client,
+        )
 
         entities = add_placeholders(entities, **kwargs)
 
@@ -156,17 +244,45 @@ class nlq2SqlTool(object):
         nlq2 = replace_name_for_placeholder(nlq, entities)
         return nlq2
 
-    def ml_call(self, nlq):
+    def ml_call(self, nlq, deadline=None):
         """Maps a NLQ to a SQL query by calling the NL2SQL ML model.
 
         Args:
             nlq (str): Generic Natural Language Query
+            deadline (Deadline): Request deadline. Default to None for the step time budget only.
+
+        Returns:
+            str: Generic SQL query.
+
+        """
+        deadline = self._get_step_deadline("ml_call", deadline)
+        sql_query, _ = self._ml_calls.do(
+            nlq, self._generate, nlq, deadline, deadline=deadline
+        )
+        return sql_query
+
+    def _generate(self, nlq, deadline):
+        """Calls the ML model, stopping the generation at the deadline.
+
+        Args:
+            nlq (str): Generic Natural Language Query
+            deadline (Deadline): Deadline of the step.
 
         Returns:
             str: Generic SQL query.
 
+        Raises:
+            DeadlineExceeded: The generation was stopped before completion.
+
         """
-        sql_query = self.model(nlq)
+        remaining = deadline.remaining()
+        if remaining is None:
+            return self.model(nlq)
+
+        sql_query = self.model(nlq, max_time=remaining)
+        if deadline.expired():
+            # the generation was cut short: the SQL query is incomplete
+            raise DeadlineExceeded("Deadline exceeded in ml_call.")
         return sql_query
 
     def render_template_query(self, generic_sql, entities):
@@ -182,52 +298,203 @@ class nlq2SqlTool(object):
         """
         return render_template_query(self.config, generic_sql, entities)
 
-    def execute_sql_query(self, sql_query):
-        """Executes the ready-to-execute `sql_query` against Amazon Redshift
+    def _get_result_cache_scope(self, credentials):
+        """Scope of the cached results: the DB user unless results are shared across users."""
+        if self.config.RESULT_CACHE_SHARED_ACROSS_USERS:
+            return None
+        return credentials.user
+
+    def invalidate_result_cache(self, sql_query=None):
+        """Removes the cached result of `sql_query`, or all the cached results.
+
+        Args:
+            sql_query (str): Ready-to-execute `sql_query`. Default to None for all the results.
+
+        Returns:
+            None
+
+        """
+        if self.result_cache is not None:
+            scope = (
+                None
+                if sql_query is None
+                else self._get_result_cache_scope(self._get_credentials())
+            )
+            self.result_cache.invalidate(sql_query, scope=scope)
+
+    def execute_sql_query(self, sql_query, deadline=None, step_budget=True):
+        """Executes the ready-to-execute `sql_query` against Amazon Redshift, unless its result is cached.
 
         Args:
             sql_query (str): Ready-to-execute `sql_query`
+            deadline (Deadline): Request deadline. Default to None for the step time budget only.
+            step_budget (bool): Whether the step time budget applies. False for executions that must complete (e.g. evaluation ground truths). Default to True.
 
         Returns:
             pd.DataFrame: Table dataframe resulting from the `sql_query` execution.
 
         """
-        self._open_redshift_connection()
-        cursor = self.conn.cursor()
-        out_df = execute_query(cursor, sql_query)
-        self._close_redshift_connection()
+        credentials = self._get_credentials()
+        scope = self._get_result_cache_scope(credentials)
+        if self.result_cache is not None:
+            out_df = self.result_cache.get(sql_query, scope=scope)
+            if out_df is not None:
+                return out_df
+
+        if step_budget:
+            deadline = self._get_step_deadline("execute_sql_query", deadline)
+        elif deadline is None:
+            deadline = Deadline()
+        # coalesce per user: identical queries from different users are run separately
+        out_df, shared = self._execution_calls.do(
+            (credentials.user, sql_query),
+            self._execute_sql_query,
+            sql_query,
+            credentials,
+            scope,
+            deadline,
+            deadline=deadline,
+        )
+        if shared and out_df is not None:
+            out_df = out_df.copy()
         return out_df
 
-    def __call__(self, nlq):
-        """Run pipeline end to end.
+    def _execute_sql_query(
+        self, sql_query, credentials, cache_scope=None, deadline=None
+    ):
+        """Executes the ready-to-execute `sql_query` against Amazon Redshift and caches its result.
+
+        The query gets a server-side statement timeout and is cancelled from the client at the deadline.
 
         Args:
-            nlq (str): Natural Language Query
+            sql_query (str): Ready-to-execute `sql_query`
+            credentials (DBCredentials): DB credentials of the call.
+            cache_scope (str): Scope of the cached result. Default to None.
+            deadline (Deadline): Deadline of the step. Default to None for no deadline.
 
         Returns:
-            pd.DataFrame: Results of executing the SQL query against Amazon Redshift.
+            pd.DataFrame: Table dataframe resulting from the `sql_query` execution.
+
+        Raises:
+            DeadlineExceeded: The query was cancelled at the deadline.
+
+        """
+        deadline = Deadline() if deadline is None else deadline
+
+        # connection per call: concurrent executions don't share it
+        conn = self._connect(
+            self.config.REDSHIFT_PARM,
+            credentials.user,
+            credentials.password,
+            connect_timeout=deadline.remaining(),
+        )
+        cancel_timer = None
+        try:
+            if conn is not None and deadline.remaining() is not None:
+                cancel_timer = threading.Timer(deadline.remaining(), conn.cancel)
+                cancel_timer.daemon = True
+                cancel_timer.start()
+
+            cursor = conn.cursor()
+            out_df = execute_query(
+                cursor, sql_query, timeout_seconds=deadline.remaining()
+            )
+        except Exception as e:
+            if deadline.expired():
+                raise DeadlineExceeded(
+                    "Deadline exceeded in execute_sql_query: query cancelled."
+                ) from e
+            raise
+        finally:
+            if cancel_timer is not None:
+                cancel_timer.cancel()
+            if conn is not None:
+                conn.close()
+
+        if self.result_cache is not None:
+            self.result_cache.put(sql_query, out_df, scope=cache_scope)
+        return out_df
+
+    def run(self, nlq, execute=True, record=None, deadline=None):
+        """Run pipeline end to end recording the output of each step and the time spent in it.
+
+        Args:
+            nlq (str): Natural Language Query
+            execute (bool): Whether to execute the SQL query. Default to True.
+            record (dict): Dictionary filled as the steps complete, so it keeps the outputs of the completed steps if a step fails. Default to None for a new dictionary.
+            deadline (Deadline): Request deadline, propagated to every step. Default to None for `config.REQUEST_TIMEOUT_SECONDS` from now.
 
+        Returns:
+            dict: Record with the "entities", "generic_nlq", "generic_sql", "sql", "result" and "timings" (seconds by step) fields.
 
         """
+        record = {} if record is None else record
+        timings = record.setdefault("timings", {})
+        if deadline is None:
+            deadline = Deadline(self.config.REQUEST_TIMEOUT_SECONDS)
+
+        def timed(step, fn, *args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                timings[step] = time.perf_counter() - start
+
         # step1: detect_entities
-        entities = self.detect_entities(nlq)
+        entities = timed(
+            "detect_entities", self.detect_entities, nlq, deadline=deadline
+        )
 
         # step2: disambiguate to OMOP CDM ontology & assign placeholder
-        entities = self.process_entities(entities)
+        entities = timed(
+            "process_entities", self.process_entities, entities, deadline=deadline
+        )
+        record["entities"] = entities
 
         # step3: replace placeholder in nlq -> nlq2
-        nlq2 = self.replace_name_for_placeholder(nlq, entities)
+        record["generic_nlq"] = timed(
+            "replace_name_for_placeholder",
+            self.replace_name_for_placeholder,
+            nlq,
+            entities,
+        )
 
         # step4: execute ML to get sql
-        template_sql = self.ml_call(nlq2)
+        record["generic_sql"] = timed(
+            "ml_call", self.ml_call, record["generic_nlq"], deadline=deadline
+        )
 
         # step5: render sql query
-        final_sql = self.render_template_query(template_sql, entities)
+        record["sql"] = timed(
+            "render_template_query",
+            self.render_template_query,
+            record["generic_sql"],
+            entities,
+        )
 
         # execute sql query
-        result = self.execute_sql_query(final_sql)
+        if execute:
+            record["result"] = timed(
+                "execute_sql_query",
+                self.execute_sql_query,
+                record["sql"],
+                deadline=deadline,
+            )
+
+        return record
 
-        return result
+    def __call__(self, nlq):
+        """Run pipeline end to end.
+
+        Args:
+            nlq (str): Natural Language Query
+
+        Returns:
+            pd.DataFrame: Results of executing the SQL query against Amazon Redshift.
+
+
+        """
+        return self.run(nlq)["result"]
 
 
 if __name__ == "__main__":
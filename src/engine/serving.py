@@ -0,0 +1,455 @@
+"""
+Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+
+SPDX-License-Identifier: CC-BY-NC-4.0
+"""
+
+# Headless HTTP service around the nlq2SQL tool, to call it from other services.
+# The tool (and its ML model) is loaded once and shared by a pool of worker threads. Requests wait in a
+# bounded queue: when it is full, new requests are rejected right away (429) instead of piling up,
+# and requests that can't complete before their deadline fail with 504.
+#
+# Endpoints:
+#     POST /translate  {"nlq": str, "timeout_seconds": float (optional)} -> entities, generic & rendered SQL, timings
+#     POST /execute    same input -> same output + result table ("columns", "rows", "row_count", "truncated")
+#     GET  /health     200 while the process is up
+#     GET  /ready      200 once the model is loaded (503 before)
+#     GET  /metrics    request counters, latency histograms & queue gauges (Prometheus text format)
+#
+# Usage:
+#     python src/engine/serving.py --port 8080 --db-user <user>      (DB password from NL2SQL_DB_PASSWORD)
+#     python src/engine/serving.py --port 8080 --stand-ins           (local testing without CM, model or Redshift)
+
+import os
+import sys
+import json
+import time
+import logging
+import argparse
+import threading
+from os import path as osp
+from socketserver import ThreadingMixIn
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import TimeoutError as FutureTimeoutError
+
+sys.path.append(osp.join(osp.dirname(osp.abspath(__file__)), "..", ".."))
+
+import src  # adds the tool folders to the path
+from src import config
+from deadline import Deadline, DeadlineExceeded
+from entity_records import entities_to_dicts
+
+logger = logging.getLogger(__name__)
+
+# Upper bounds (seconds) of the request latency histogram buckets.
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+# Paths reported in the metrics. Other paths are reported as "other".
+ENDPOINTS = ("/translate", "/execute", "/health", "/ready", "/metrics")
+
+
+class ServiceOverloaded(Exception):
+    """The request queue is full."""
+
+
+class ServiceNotReady(Exception):
+    """The tool is not loaded yet, or the DB credentials are missing."""
+
+
+class ServiceMetrics(object):
+    def __init__(self):
+        """Thread-safe request counters and latency histograms by endpoint."""
+        self._lock = threading.Lock()
+        self._requests = {}
+        self._latency_counts = {}
+        self._latency_sums = {}
+
+    def observe(self, endpoint, status, latency_seconds):
+        """Record a completed request.
+
+        Args:
+            endpoint (str): Request path.
+            status (int): HTTP status of the response.
+            latency_seconds (float): Time spent serving the request.
+
+        Returns:
+            None
+
+        """
+        with self._lock:
+            key = (endpoint, status)
+            self._requests[key] = self._requests.get(key, 0) + 1
+
+            counts = self._latency_counts.setdefault(
+                endpoint, [0] * (len(LATENCY_BUCKETS) + 1)
+            )
+            for i, upper_bound in enumerate(LATENCY_BUCKETS):
+                if latency_seconds <= upper_bound:
+                    counts[i] += 1
+            counts[-1] += 1
+            self._latency_sums[endpoint] = (
+                self._latency_sums.get(endpoint, 0.0) + latency_seconds
+            )
+
+    def render(self, gauges):
+        """Render the metrics in Prometheus text format.
+
+        Args:
+            gauges (dict): Current value (value) of additional gauges by name (key).
+
+        Returns:
+            str: Metrics text.
+
+        """
+        lines = ["# TYPE nl2sql_requests_total counter"]
+        with self._lock:
+            for (endpoint, status), count in sorted(self._requests.items()):
+                lines.append(
+                    f'nl2sql_requests_total{{endpoint="{endpoint}",status="{status}"}} {count}'
+                )
+
+            lines.append("# TYPE nl2sql_request_latency_seconds histogram")
+            for endpoint, counts in sorted(self._latency_counts.items()):
+                for upper_bound, count in zip(LATENCY_BUCKETS + ("+Inf",), counts):
+                    lines.append(
+                        f'nl2sql_request_latency_seconds_bucket{{endpoint="{endpoint}",le="{upper_bound}"}} {count}'
+                    )
+                lines.append(
+                    f'nl2sql_request_latency_seconds_sum{{endpoint="{endpoint}"}} {self._latency_sums[endpoint]}'
+                )
+                lines.append(
+                    f'nl2sql_request_latency_seconds_count{{endpoint="{endpoint}"}} {counts[-1]}'
+                )
+
+        for name, value in sorted(gauges.items()):
+            lines.append(f"# TYPE nl2sql_{name} gauge")
+            lines.append(f"nl2sql_{name} {value}")
+
+        return "\n".join(lines) + "\n"
+
+
+class Nl2SqlService(object):
+    def __init__(
+        self,
+        max_workers=4,
+        max_queue_size=16,
+        default_timeout_seconds=30.0,
+        max_result_rows=1000,
+    ):
+        """Initialize the service. The tool is loaded with `load`.
+
+        Args:
+            max_workers (int): Number of requests processed concurrently by the shared tool.
+            max_queue_size (int): Maximum number of requests waiting for a worker. Further requests are rejected.
+            default_timeout_seconds (float): Deadline of the requests not specifying one.
+            max_result_rows (int): Maximum number of rows of the returned result tables.
+
+        Returns:
+            None
+
+        """
+        self.tool = None
+        self.default_timeout_seconds = default_timeout_seconds
+        self.max_result_rows = max_result_rows
+        self.metrics = ServiceMetrics()
+
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="nl2sql-service"
+        )
+        # one slot per running or queued request
+        self._slots = threading.BoundedSemaphore(max_workers + max_queue_size)
+        self._lock = threading.Lock()
+        self._pending = 0
+        self._running = 0
+
+    def load(self, tool_factory):
+        """Load the tool shared by the workers. The service is ready afterwards.
+
+        Args:
+            tool_factory (callable): Returns the nlq2SqlTool (e.g. `lambda: nlq2SqlTool(config)`).
+
+        Returns:
+            None
+
+        """
+        self.tool = tool_factory()
+
+    def is_ready(self):
+        return self.tool is not None
+
+    def get_gauges(self):
+        with self._lock:
+            return {
+                "requests_queued": self._pending - self._running,
+                "requests_running": self._running,
+                "ready": int(self.is_ready()),
+            }
+
+    def _run(self, fn, deadline, *args):
+        """Worker side of `submit`: skip requests whose deadline passed while queued."""
+        with self._lock:
+            self._running += 1
+        try:
+            if deadline.expired():
+                raise DeadlineExceeded("Deadline exceeded while queued.")
+            return fn(*args, deadline=deadline)
+        finally:
+            with self._lock:
+                self._running -= 1
+
+    def _release(self, future):
+        with self._lock:
+            self._pending -= 1
+        self._slots.release()
+
+    def submit(self, fn, timeout_seconds, *args):
+        """Run `fn(*args, deadline=deadline)` in the worker pool and wait for its result until the deadline.
+
+        Args:
+            fn (callable): Work of the request. It gets the request deadline to propagate it to its steps.
+            timeout_seconds (float): Time budget of the request. None for the default one.
+            *args: Arguments of `fn`.
+
+        Returns:
+            object: Result of `fn`.
+
+        Raises:
+            ServiceOverloaded: The queue is full.
+            DeadlineExceeded: The result was not ready before the deadline.
+
+        """
+        if timeout_seconds is None:
+            timeout_seconds = self.default_timeout_seconds
+        deadline = Deadline(timeout_seconds)
+
+        if not self._slots.acquire(blocking=False):
+            raise ServiceOverloaded("Too many pending requests.")
+        with self._lock:
+            self._pending += 1
+        future = self._executor.submit(self._run, fn, deadline, *args)
+        future.add_done_callback(self._release)
+
+        try:
+            return future.result(timeout=max(deadline.remaining(), 0))
+        except FutureTimeoutError:
+            future.cancel()
+            raise DeadlineExceeded(
+                f"Request did not complete within {timeout_seconds}s."
+            )
+
+    def _translate(self, nlq, execute, deadline=None):
+        record = self.tool.run(nlq, execute=execute, deadline=deadline)
+        record["entities"] = entities_to_dicts(record["entities"])
+
+        result = record.pop("result", None)
+        if execute:
+            record["row_count"] = None if result is None else int(result.shape[0])
+            record["truncated"] = False
+            record["columns"], record["rows"] = None, None
+            if result is not None:
+                record["truncated"] = result.shape[0] > self.max_result_rows
+                table = json.loads(
+                    result.head(self.max_result_rows).to_json(
+                        orient="split", index=False, date_format="iso"
+                    )
+                )
+                record["columns"], record["rows"] = table["columns"], table["data"]
+        return record
+
+    def translate(self, nlq, execute=False, timeout_seconds=None):
+        """Run the tool on a Natural Language Query.
+
+        Args:
+            nlq (str): Natural Language Query.
+            execute (bool): Whether to execute the SQL query. Default to False.
+            timeout_seconds (float): Time budget of the request. Default to None for the default one.
+
+        Returns:
+            dict: JSON-serializable response.
+
+        """
+        if not self.is_ready():
+            raise ServiceNotReady("Model not loaded yet.")
+        if execute and not self.tool.credentials_exist():
+            raise ServiceNotReady("DB credentials not set.")
+        return self.submit(self._translate, timeout_seconds, nlq, execute)
+
+    def close(self):
+        self._executor.shutdown(wait=True)
+
+
+class _ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+def make_handler(service):
+    """Create the HTTP request handler class of a service.
+
+    Args:
+        service (Nl2SqlService): Service handling the requests.
+
+    Returns:
+        type: BaseHTTPRequestHandler subclass.
+
+    """
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def _send(self, status, body, content_type="application/json", headers=None):
+            if content_type == "application/json":
+                body = json.dumps(body)
+            body = body.encode("utf-8")
+            self.send_response(status)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(body)))
+            for name, value in (headers or {}).items():
+                self.send_header(name, value)
+            self.end_headers()
+            self.wfile.write(body)
+            return status
+
+        def _handle_get(self):
+            if self.path == "/health":
+                return self._send(200, {"status": "ok"})
+            if self.path == "/ready":
+                if service.is_ready():
+                    return self._send(200, {"status": "ready"})
+                return self._send(503, {"status": "loading"})
+            if self.path == "/metrics":
+                return self._send(
+                    200,
+                    service.metrics.render(service.get_gauges()),
+                    content_type="text/plain; version=0.0.4",
+                )
+            return self._send(404, {"error": "Not found."})
+
+        def _handle_post(self):
+            length = int(self.headers.get("Content-Length") or 0)
+            body = self.rfile.read(length)
+            if self.path not in ("/translate", "/execute"):
+                return self._send(404, {"error": "Not found."})
+
+            try:
+                request = json.loads(body or b"{}")
+                nlq = request["nlq"]
+                timeout_seconds = request.get("timeout_seconds")
+                if not isinstance(nlq, str) or not nlq.strip():
+                    raise ValueError("'nlq' must be a non-empty string.")
+                if timeout_seconds is not None:
+                    timeout_seconds = float(timeout_seconds)
+            except (ValueError, KeyError, TypeError, AttributeError) as e:
+                return self._send(400, {"error": f"Invalid request: {e}"})
+
+            try:
+                response = service.translate(
+                    nlq,
+                    execute=self.path == "/execute",
+                    timeout_seconds=timeout_seconds,
+                )
+            except ServiceOverloaded as e:
+                return self._send(429, {"error": str(e)}, headers={"Retry-After": "1"})
+            except ServiceNotReady as e:
+                return self._send(503, {"error": str(e)})
+            except DeadlineExceeded as e:
+                return self._send(504, {"error": str(e)})
+            except Exception as e:
+                logger.exception("Failed to process request.")
+                return self._send(500, {"error": f"{type(e).__name__}: {e}"})
+
+            return self._send(200, response)
+
+        def _handle(self, handle_fn):
+            start = time.perf_counter()
+            status = handle_fn()
+            endpoint = self.path if self.path in ENDPOINTS else "other"
+            service.metrics.observe(endpoint, status, time.perf_counter() - start)
+
+        def do_GET(self):
+            self._handle(self._handle_get)
+
+        def do_POST(self):
+            self._handle(self._handle_post)
+
+        def log_message(self, format, *args):
+            logger.debug("%s - %s", self.address_string(), format % args)
+
+    return Handler
+
+
+def create_server(service, host="0.0.0.0", port=8080):
+    """Create the HTTP server of a service. Each connection is handled in its own thread.
+
+    Args:
+        service (Nl2SqlService): Service handling the requests.
+        host (str): Host to bind.
+        port (int): Port to bind. 0 for any free port.
+
+    Returns:
+        HTTPServer: Server. Start it with `serve_forever()`.
+
+    """
+    return _ThreadingHTTPServer((host, port), make_handler(service))
+
+
+if __name__ == "__main__":
+    from pipeline import nlq2SqlTool
+
+    parser = argparse.ArgumentParser(description="NL2SQL HTTP service.")
+    parser.add_argument("--host", default="0.0.0.0")
+    parser.add_argument("--port", type=int, default=8080)
+    parser.add_argument("--max-workers", type=int, default=config.SERVICE_MAX_WORKERS)
+    parser.add_argument(
+        "--max-queue-size", type=int, default=config.SERVICE_MAX_QUEUE_SIZE
+    )
+    parser.add_argument(
+        "--timeout-seconds", type=float, default=config.SERVICE_TIMEOUT_SECONDS
+    )
+    parser.add_argument("--db-user", default=None)
+    parser.add_argument(
+        "--stand-ins",
+        action="store_true",
+        help="Use stand-in CM, model & DB backends (local testing)",
+    )
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+
+    service = Nl2SqlService(
+        max_workers=args.max_workers,
+        max_queue_size=args.max_queue_size,
+        default_timeout_seconds=args.timeout_seconds,
+        max_result_rows=config.SERVICE_MAX_RESULT_ROWS,
+    )
+    server = create_server(service, args.host, args.port)
+    # health is served while the model loads
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    logger.info(f"Serving on {args.host}:{server.server_address[1]}")
+
+    def create_tool():
+        if not args.stand_ins:
+            return nlq2SqlTool(config)
+
+        from stand_ins import StandInCMClient, StandInModel, StandInDatabase
+
+        return nlq2SqlTool(
+            config,
+            model=StandInModel(),
+            connect=StandInDatabase().connect,
+            cm_client=StandInCMClient(),
+        )
+
+    def load_tool():
+        tool = create_tool()
+        if args.db_user or args.stand_ins:
+            tool.set_db_credentials(args.db_user, os.environ.get("NL2SQL_DB_PASSWORD"))
+        return tool
+
+    service.load(load_tool)
+    logger.info("Model loaded: ready.")
+
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+        service.close()
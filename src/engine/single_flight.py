@@ -0,0 +1,97 @@
+"""
+Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+
+SPDX-License-Identifier: CC-BY-NC-4.0
+"""
+
+# This module contains the request coalescing ("single flight") used by the tool steps.
+# When identical work (same key) is requested concurrently, it runs once and every caller
+# gets the shared result or the shared error.
+# The work runs under the deadline of the caller running it (the leader). The other callers wait for it
+# until their own deadline, and run the work again if it only failed on the leader's deadline.
+
+import threading
+
+from deadline import DeadlineExceeded
+
+
+class _Call(object):
+    __slots__ = ("done", "result", "error")
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight(object):
+    def __init__(self):
+        """Initialize an empty group of in-flight calls.
+
+        Args:
+            None
+
+        Returns:
+            None
+
+        """
+        self._lock = threading.Lock()
+        self._calls = {}
+
+    def do(self, key, fn, *args, deadline=None, **kwargs):
+        """Run `fn(*args, **kwargs)` unless a call with the same `key` is in flight, in which case wait for its outcome.
+
+        A shared `DeadlineExceeded` comes from the deadline of the caller that ran the work, not from this
+        caller's one: the work is then run again (or waited for again) within this caller's deadline.
+
+        Args:
+            key (hashable): Key identifying the work.
+            fn (function): Function doing the work.
+            *args: Positional arguments of `fn`.
+            deadline (Deadline): Deadline of this caller, bounding the wait for a call in flight. Default to None for no limit.
+            **kwargs: Keyword arguments of `fn`.
+
+        Returns:
+            tuple: First is the result of the call. Second element is True if the result is shared with another caller (i.e. this caller waited for it), False otherwise.
+
+        Raises:
+            DeadlineExceeded: `deadline` expired while waiting for a call in flight.
+
+        """
+        while True:
+            with self._lock:
+                call = self._calls.get(key)
+                shared = call is not None
+                if not shared:
+                    call = _Call()
+                    self._calls[key] = call
+
+            if not shared:
+                try:
+                    call.result = fn(*args, **kwargs)
+                except BaseException as e:
+                    call.error = e
+                finally:
+                    with self._lock:
+                        del self._calls[key]
+                    call.done.set()
+                break
+
+            remaining = None if deadline is None else deadline.remaining()
+            if not call.done.wait(timeout=remaining and max(remaining, 0)):
+                raise DeadlineExceeded(
+                    "Deadline exceeded while waiting for an identical call."
+                )
+            if not isinstance(call.error, DeadlineExceeded):
+                break
+            if deadline is not None:
+                deadline.check("retrying an identical call")
+
+        if call.error is not None:
+            raise call.error
+        return call.result, shared
+
+    def in_flight(self):
+        """Number of calls currently in flight."""
+        with self._lock:
+            return len(self._calls)
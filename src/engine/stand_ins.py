@@ -0,0 +1,162 @@
+"""
+Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+
+SPDX-License-Identifier: CC-BY-NC-4.0
+"""
+
+# This module contains stand-in backends to run the tool locally (e.g. the HTTP service or stress tests)
+# without Amazon Comprehend Medical (CM), the trained ML model or Amazon Redshift.
+# They mimic the interfaces used by the tool and return canned answers after an optional latency.
+
+import re
+import time
+from collections import namedtuple
+
+# Known names detected by the stand-in CM client: (CM category, CM type, code, description) by name.
+STAND_IN_CM_NAMES = {
+    "aspirin": ("MEDICATION", "GENERIC_NAME", "1191", "aspirin"),
+    "ibuprofen": ("MEDICATION", "GENERIC_NAME", "5640", "ibuprofen"),
+    "metformin": ("MEDICATION", "GENERIC_NAME", "6809", "metformin"),
+    "diabetes": ("MEDICAL_CONDITION", "DX_NAME", "E11.9", "Type 2 diabetes mellitus"),
+    "hypertension": ("MEDICAL_CONDITION", "DX_NAME", "I10", "Essential hypertension"),
+    "asthma": ("MEDICAL_CONDITION", "DX_NAME", "J45.909", "Unspecified asthma"),
+}
+
+# Generic SQL query returned by the stand-in model (by the first placeholder found in the generic NLQ).
+STAND_IN_GENERIC_SQL = {
+    "<ARG-DRUG><0>": "SELECT COUNT(DISTINCT person_id) FROM <SCHEMA>.drug_exposure WHERE drug_concept_id IN (<DRUG-TEMPLATE><ARG-DRUG><0>)",
+    "<ARG-CONDITION><0>": "SELECT COUNT(DISTINCT person_id) FROM <SCHEMA>.condition_occurrence WHERE condition_concept_id IN (<CONDITION-TEMPLATE><ARG-CONDITION><0>)",
+    None: "SELECT COUNT(DISTINCT person_id) FROM <SCHEMA>.person",
+}
+
+# Cursor description column (psycopg2 columns are accessed by name and by index).
+Column = namedtuple("Column", ["name", "type_code"])
+
+
+def _sleep(latency_seconds):
+    if latency_seconds:
+        time.sleep(latency_seconds)
+
+
+class StandInCMClient(object):
+    def __init__(self, names=None, latency_seconds=0.0):
+        """Stand-in CM client detecting and inferring a fixed set of names.
+
+        Args:
+            names (dict): Known names (see `STAND_IN_CM_NAMES`). Default to None for `STAND_IN_CM_NAMES`.
+            latency_seconds (float): Time spent in each call.
+
+        Returns:
+            None
+
+        """
+        self.names = STAND_IN_CM_NAMES if names is None else names
+        self.latency_seconds = latency_seconds
+        self._names_p = re.compile(
+            "(?i)\\b(%s)\\b" % "|".join(re.escape(name) for name in self.names)
+        )
+
+    def detect_entities_v2(self, Text):
+        _sleep(self.latency_seconds)
+        entities = []
+        for match in re.finditer(self._names_p, Text):
+            category, type_, _, _ = self.names[match.group(0).lower()]
+            entities.append(
+                {
+                    "BeginOffset": match.start(),
+                    "EndOffset": match.end(),
+                    "Text": match.group(0),
+                    "Category": category,
+                    "Type": type_,
+                    "Score": 0.99,
+                }
+            )
+        return {"Entities": entities}
+
+    def _infer(self, text, category, concepts_key):
+        _sleep(self.latency_seconds)
+        item = self.names.get(text.lower())
+        if item is None or item[0] != category:
+            return {"Entities": []}
+        concept = {"Code": item[2], "Description": item[3], "Score": 0.99}
+        return {"Entities": [{"Text": text, concepts_key: [concept]}]}
+
+    def infer_rx_norm(self, Text):
+        return self._infer(Text, "MEDICATION", "RxNormConcepts")
+
+    def infer_icd10_cm(self, Text):
+        return self._infer(Text, "MEDICAL_CONDITION", "ICD10CMConcepts")
+
+
+class StandInModel(object):
+    def __init__(self, generic_sql=None, latency_seconds=0.0):
+        """Stand-in ML model mapping generic NLQs to fixed generic SQL queries.
+
+        Args:
+            generic_sql (dict): Generic SQL query (value) by placeholder (key). The None key is used when no placeholder is found. Default to None for `STAND_IN_GENERIC_SQL`.
+            latency_seconds (float): Time spent in each inference.
+
+        Returns:
+            None
+
+        """
+        self.generic_sql = STAND_IN_GENERIC_SQL if generic_sql is None else generic_sql
+        self.latency_seconds = latency_seconds
+
+    def __call__(self, input_text, max_time=None):
+        _sleep(self.latency_seconds)
+        for placeholder, sql in self.generic_sql.items():
+            if placeholder is not None and placeholder in input_text:
+                return sql
+        return self.generic_sql[None]
+
+
+class StandInCursor(object):
+    def __init__(self, database):
+        self._database = database
+        self.description = None
+
+    def execute(self, query):
+        if query.startswith("SET "):
+            return
+        _sleep(self._database.latency_seconds)
+        self.description = [Column(name, None) for name in self._database.columns]
+
+    def fetchall(self):
+        return list(self._database.rows)
+
+
+class StandInConnection(object):
+    def __init__(self, database):
+        self._database = database
+
+    def cursor(self):
+        return StandInCursor(self._database)
+
+    def cancel(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class StandInDatabase(object):
+    def __init__(self, columns=("count",), rows=((42,),), latency_seconds=0.0):
+        """Stand-in database returning the same table for every query.
+
+        Args:
+            columns (tuple): Column names of the returned table.
+            rows (tuple): Rows of the returned table.
+            latency_seconds (float): Time spent in each query execution.
+
+        Returns:
+            None
+
+        """
+        self.columns = columns
+        self.rows = rows
+        self.latency_seconds = latency_seconds
+
+    def connect(self, redshift_parameters, user, password, connect_timeout=None):
+        """Open a connection (same signature as `step6.query_execution.connect_to_db`)."""
+        return StandInConnection(self)
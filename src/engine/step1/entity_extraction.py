@@ -4,9 +4,10 @@ Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
 SPDX-License-Identifier: CC-BY-NC-4.0
 """
 
-import boto3
 import re
 from _extraction_helpers import _add_cm_entity, _detect_entities_with_regex
+from entity_records import entities_from_dicts
+from cm_client import call_cm, get_cm_client
 
 GENDER_P = re.compile("(?i)\\b((fe)?males?|(wo)?m(a|e)n)\\b")
 ETHNICITY_P = re.compile(
@@ -16,7 +17,6 @@ RACE_P = re.compile(
     "(?i)\\b(black or african americans?|african americans?|blacks?|whites?)\\b"
 )
 
-CM_CLIENT = boto3.client("comprehendmedical")
 COMPLEMENT_CATEGS = set(("DOSAGE", "STRENGTH", "ACUITY"))
 
 
@@ -26,6 +26,8 @@ def add_cm_entities(
     seen_names,
     entity_detection_score_thr,
     drug_relationship_score_thr,
+    deadline=None,
+    cm_client=None,
 ):
     """Detects entities in the NLQ using CM and adds them to the dicionary of seen entities by category.
 
@@ -35,11 +37,15 @@ def add_cm_entities(
         seen_names (set): Set of previously seen names in the NLQ
         entity_detection_score_thr (float): Value between [0,1]. Only entites detected with a confidence over this value will be kept.
         drug_relationship_score_thr (float): Value between [0,1]. Only drug attributes linked to a drug with a confidence over this value will be kept.
+        deadline (Deadline): Request deadline, bounding the CM call. Default to None for no deadline.
+        cm_client (object): CM client (e.g. a recorded-response client). Default to None for the shared client (`get_cm_client`).
 
     Returns:
         tuple: First is the updated dictionary with entities by category. Second element is the set of seen names.
     """
-    result = CM_CLIENT.detect_entities_v2(Text=nlq)
+    if cm_client is None:
+        cm_client = get_cm_client()
+    result = call_cm(cm_client, "detect_entities_v2", deadline, Text=nlq)
 
     # initialize categories
     entities_by_category["TIMEDAYS"] = []
@@ -138,7 +144,13 @@ def add_race_entities(nlq, entities_by_category, seen_names):
 
 
 # main function
-def detect_entities(nlq, entity_detection_score_thr, drug_relationship_score_thr):
+def detect_entities(
+    nlq,
+    entity_detection_score_thr,
+    drug_relationship_score_thr,
+    deadline=None,
+    cm_client=None,
+):
     """Main function: Detect and categorize entities with CM and regex.
 
 
@@ -146,9 +158,11 @@ def detect_entities(nlq, entity_detection_score_thr, drug_relationship_score_thr
         nlq (str):
         entity_detection_score_thr (float):
         drug_relationship_score_thr (float):
+        deadline (Deadline): Request deadline. Default to None for no deadline.
+        cm_client (object): CM client. Default to None for the shared client (`get_cm_client`).
 
     Returns:
-        dict: Dictionary of detected entities by category
+        dict: Dictionary of detected entities (EntityRecord) by category
 
     """
     entities_by_category = {}
@@ -161,6 +175,8 @@ def detect_entities(nlq, entity_detection_score_thr, drug_relationship_score_thr
         seen_names,
         entity_detection_score_thr,
         drug_relationship_score_thr,
+        deadline,
+        cm_client,
     )
 
     # regex NER
@@ -174,7 +190,7 @@ def detect_entities(nlq, entity_detection_score_thr, drug_relationship_score_thr
         nlq, entities_by_category, seen_names
     )
 
-    return entities_by_category
+    return entities_from_dicts(entities_by_category)
 
 
 if __name__ == "__main__":
@@ -4,17 +4,29 @@ Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
 SPDX-License-Identifier: CC-BY-NC-4.0
 """
 
-import boto3
 import re
 import json
 from os import path as osp
+from entity_records import EntityOption, EntityRecord
+from cm_client import call_cm, get_cm_client
+from single_flight import SingleFlight
 
 # test
 from pprint import pprint
 
 
-CM_CLIENT = boto3.client("comprehendmedical")
 ETHNICITY_P = re.compile("(?i)\\b(not)\\b")
+INLINE_FLAGS_P = re.compile("^\\(\\?[a-zA-Z]+\\)")
+
+# Maximum number of names a pattern can expand to in the precomputed lookup tables.
+MAX_EXPANDED_NAMES = 256
+
+# Memoized regex scan results for names missing in the lookup tables.
+PATTERN_SCAN_CACHE_SIZE = 4096
+_PATTERN_SCAN_CACHE = {}
+
+# In-flight CM calls, shared by the threads resolving the same name at the same time.
+_CM_CALLS = SingleFlight()
 
 
 def load_dict2pattern(filepath):
@@ -27,35 +39,183 @@ def load_dict2pattern(filepath):
     return out
 
 
+def _expand_alternatives(pattern, pos=0, depth=0):
+    """Expand the alternatives of a literal regex (sub-)pattern starting at `pos`.
+
+    Only the regex subset used in the `*2pattern.json` files is supported: literal characters,
+    escaped characters, word boundaries (ignored), groups with `|` alternatives and the `?`
+    quantifier. Anything else (e.g. character classes, `*`, `+`) raises a ValueError.
+
+    Args:
+        pattern (str): Regex pattern (without inline flags).
+        pos (int): Position where the (sub-)pattern starts.
+        depth (int): Group nesting level. 0 for the top level pattern.
+
+    Returns:
+        tuple: First is the list of strings matched by the (sub-)pattern. Second element is the position where it ends.
+
+    """
+    alternatives = []
+    current = [""]
+    while pos < len(pattern):
+        char = pattern[pos]
+
+        if char == ")":
+            if depth == 0:
+                raise ValueError(f"Unbalanced parenthesis in pattern {pattern}")
+            break
+
+        if char == "|":
+            alternatives.extend(current)
+            current = [""]
+            pos += 1
+            continue
+
+        if char == "(":
+            if pattern.startswith("(?", pos):
+                raise ValueError(f"Unsupported group in pattern {pattern}")
+            options, pos = _expand_alternatives(pattern, pos + 1, depth + 1)
+            pos += 1  # closing parenthesis
+        elif char == "\\":
+            escaped = pattern[pos + 1 : pos + 2]
+            pos += 2
+            if escaped == "b":
+                continue
+            if escaped.isalnum():
+                raise ValueError(f"Unsupported escape sequence in pattern {pattern}")
+            options = [escaped]
+        elif char in ".*+[]{}^$":
+            raise ValueError(f"Unsupported regex syntax in pattern {pattern}")
+        else:
+            options = [char]
+            pos += 1
+
+        if pattern[pos : pos + 1] == "?":
+            options = [""] + options
+            pos += 1
+
+        current = [prefix + option for prefix in current for option in options]
+        if len(current) > MAX_EXPANDED_NAMES:
+            raise ValueError(f"Too many names matched by pattern {pattern}")
+
+    alternatives.extend(current)
+    return alternatives, pos
+
+
+def expand_pattern(pattern):
+    """Lists all the names fully matched by a case-insensitive literal pattern.
+
+    Args:
+        pattern (_sre.SRE_Pattern): Compiled pattern from a `*2pattern.json` file.
+
+    Returns:
+        list: Names matched by the pattern. Empty if the pattern can't be expanded.
+
+    """
+    if not pattern.flags & re.IGNORECASE:
+        return []
+
+    try:
+        names, _ = _expand_alternatives(INLINE_FLAGS_P.sub("", pattern.pattern))
+    except ValueError:
+        return []
+    return names
+
+
+def _normalize_name(name):
+    """Normalize a name to be used as lookup key.
+
+    Args:
+        name (str): Name to be normalized.
+
+    Returns:
+        str: Case-folded name.
+
+    """
+    return name.casefold()
+
+
+def _scan_pattern_dict(name, standard2pattern):
+    """Standarize a name by matching it against every pattern until one hits.
+
+    Args:
+        name (str): Name to be standarized.
+        standard2pattern (dict): Dictionary where key are the standarized names and values are the matching patterns.
+
+    Returns:
+        str: Returns standarized name if found. Else '[NOT FOUND]-name'
+
+    """
+    for standard, pattern in standard2pattern.items():
+        if re.match(pattern, name):
+            return standard
+    return f"[NOT FOUND]-{name}"
+
+
+def build_name2standard(standard2pattern):
+    """Precompute the normalized name -> standard lookup table of a pattern dictionary.
+
+    The table is filled with every name fully matched by the patterns (e.g. case-folded
+    state names and acronyms). Each value is computed with the regex scan so that the
+    lookup returns exactly what the scan would.
+
+    Args:
+        standard2pattern (dict): Dictionary where key are the standarized names and values are the matching patterns.
+
+    Returns:
+        dict: Dictionary mapping normalized names to their standarized name.
+
+    """
+    name2standard = {}
+    for pattern in standard2pattern.values():
+        for name in expand_pattern(pattern):
+            key = _normalize_name(name)
+            if key not in name2standard:
+                name2standard[key] = _scan_pattern_dict(name, standard2pattern)
+    return name2standard
+
+
 current_folder = osp.dirname(osp.abspath(__file__))
 GENDER2STANDARD = load_dict2pattern(osp.join(current_folder, "gender2pattern.json"))
 RACE2STANDARD = load_dict2pattern(osp.join(current_folder, "race2pattern.json"))
 STATE2STANDARD = load_dict2pattern(osp.join(current_folder, "state2pattern.json"))
 
+GENDER_NAME2STANDARD = build_name2standard(GENDER2STANDARD)
+RACE_NAME2STANDARD = build_name2standard(RACE2STANDARD)
+STATE_NAME2STANDARD = build_name2standard(STATE2STANDARD)
+
 IDENTITY = lambda x: x
+NOT_FOUND_OPTIONS = (EntityOption("-1", "N/A", -1.0),)
 
 
-def _use_pattern_dict(name, standard2pattern):
+def _use_pattern_dict(name, standard2pattern, name2standard):
     """Standarize a name based on pre-defined mappings and regex matching.
 
+    The name is first looked up in the precomputed `name2standard` table. On a miss, the
+    patterns are scanned and the result (including '[NOT FOUND]') is memoized in a
+    bounded cache.
+
     Args:
         name (str): Name to be standarized.
         standard2pattern (dict): Dictionary where key are the standarized names and values are the matching patterns.
+        name2standard (dict): Precomputed lookup table of `standard2pattern` (see `build_name2standard`).
 
     Returns:
         str: Returns standarized name if found. Else '[NOT FOUND]-name'
 
     """
-    for standard, pattern in standard2pattern.items():
-        if re.match(pattern, name):
-            return standard
-    return f"[NOT FOUND]-{name}"
+    standard = name2standard.get(_normalize_name(name))
+    if standard is not None:
+        return standard
 
-    # Error handeling
-    standards = "".join([i[0] for i in standard2pattern])
-    raise ValueError(
-        f"Name {name} don't match any pattern in dict with standards: {standards}"
-    )
+    cache = _PATTERN_SCAN_CACHE.setdefault(id(standard2pattern), {})
+    standard = cache.get(name)
+    if standard is None:
+        standard = _scan_pattern_dict(name, standard2pattern)
+        if len(cache) >= PATTERN_SCAN_CACHE_SIZE:
+            cache.clear()
+        cache[name] = standard
+    return standard
 
 
 def _gender_name2standard(gender_name):
@@ -68,7 +228,7 @@ def _gender_name2standard(gender_name):
         str: standard gender name
 
     """
-    return _use_pattern_dict(gender_name, GENDER2STANDARD)
+    return _use_pattern_dict(gender_name, GENDER2STANDARD, GENDER_NAME2STANDARD)
 
 
 def _race_name2standard(race_name):
@@ -81,7 +241,7 @@ def _race_name2standard(race_name):
         str: standard race name
 
     """
-    return _use_pattern_dict(race_name, RACE2STANDARD)
+    return _use_pattern_dict(race_name, RACE2STANDARD, RACE_NAME2STANDARD)
 
 
 def _ethnicity_name2standard(ethnicity_name):
@@ -110,7 +270,22 @@ def _state_name2standard(state_name):
         str: standard gender name
 
     """
-    return _use_pattern_dict(state_name, STATE2STANDARD)
+    return _use_pattern_dict(state_name, STATE2STANDARD, STATE_NAME2STANDARD)
+
+
+def _with_options(entity, options, default):
+    """Creates the entity record with disambiguation options and default disambiguation.
+
+    Args:
+        entity (EntityRecord): Entity record (or dictionary).
+        options (iterable): Disambiguation options (records or dictionaries).
+        default (str): Default disambiguation.
+
+    Returns:
+        EntityRecord: New entity record. The input entity is not modified.
+
+    """
+    return EntityRecord.from_dict(entity).replace(options=options, query_arg=default)
 
 
 def _use_function_for_options(entities, fun=IDENTITY):
@@ -121,14 +296,15 @@ def _use_function_for_options(entities, fun=IDENTITY):
         fun (function): Function providing the disambiguation options for names in entities. Default to identity.
 
     Returns:
-        dict: Input entities updated with disambiguation options and default disambiguation.
+        list: New entity records with disambiguation options and default disambiguation.
 
     """
+    out = []
     for entity in entities:
-        entity["Options"] = [{"Code": fun(entity["Text"])}]
-        entity["Query-arg"] = entity["Options"][0]["Code"]
+        code = fun(entity["Text"])
+        out.append(_with_options(entity, (EntityOption(code),), code))
 
-    return entities
+    return out
 
 
 def add_gender_options(entities):
@@ -138,7 +314,7 @@ def add_gender_options(entities):
         entities: List of entity records of category "gender"
 
     Returns:
-        dict: List of entity records of category "gender" updated with options and default disambiguation.
+        list: New entity records of category "gender" with options and default disambiguation.
 
     """
     return _use_function_for_options(entities, _gender_name2standard)
@@ -151,7 +327,7 @@ def add_race_options(entities):
         entities: List of entity records of category "race"
 
     Returns:
-        dict: List of entity records of category "race" updated with options and default disambiguation.
+        list: New entity records of category "race" with options and default disambiguation.
 
 
     """
@@ -165,7 +341,7 @@ def add_state_options(entities):
         entities: List of entity records of category "state"
 
     Returns:
-        dict: List of entity records of category "state" updated with options and default disambiguation.
+        list: New entity records of category "state" with options and default disambiguation.
 
     """
     return _use_function_for_options(entities, _state_name2standard)
@@ -178,7 +354,7 @@ def add_ethnicity_options(entities):
         entities: List of entity records of category "ethnicity"
 
     Returns:
-        dict: List of entity records of category "ethnicity" updated with options and default disambiguation.
+        list: New entity records of category "ethnicity" with options and default disambiguation.
 
     """
     return _use_function_for_options(entities, _ethnicity_name2standard)
@@ -204,7 +380,7 @@ def add_time_options(entities):
         entities: List of entity records of category "TIMEDAYS" or "TIMEYEARS"
 
     Returns:
-        dict: List of entity records of category "TIMEDAYS" & "TIMEYEARS" updated with options and default disambiguation.
+        list: New entity records of category "TIMEDAYS" & "TIMEYEARS" with options and default disambiguation.
 
     """
     return _use_function_for_options(entities)
@@ -223,52 +399,139 @@ def add_time_options(entities):
 #     return _use_function_for_options(entities)
 
 
-def add_condition_options(entities):
+def _get_local_options(name, vocabulary_index, vocabulary):
+    """Resolve a name with the local OMOP vocabulary index: exact match, or close approximate match (misspelling).
+
+    Args:
+        name (str): Drug or condition name.
+        vocabulary_index (OMOPVocabularyIndex): Local vocabulary index. None if not available.
+        vocabulary (str): Vocabulary of the codes (e.g. "RxNorm" or "ICD10CM").
+
+    Returns:
+        list: Ranked options. Empty if there is no index or the name is not found.
+
+    """
+    if vocabulary_index is None:
+        return []
+    options = vocabulary_index.lookup(name, vocabulary)
+    if not options:
+        options = vocabulary_index.fuzzy_lookup(name, vocabulary)
+    return options
+
+
+def _call_cm(operation, text, cm_client=None, deadline=None):
+    """Call a CM inference operation.
+
+    Args:
+        operation (str): Name of the CM operation (e.g. "infer_rx_norm").
+        text (str): Text to be inferred.
+        cm_client (object): CM client. Default to None for the shared client (`get_cm_client`).
+        deadline (Deadline): Deadline bounding the call. Default to None for no deadline.
+
+    Returns:
+        list: Inferred entities.
+
+    """
+    if cm_client is None:
+        cm_client = get_cm_client()
+    return call_cm(cm_client, operation, deadline, Text=text)["Entities"]
+
+
+def _infer_with_cm(operation, text, cm_client=None, deadline=None):
+    """Call a CM inference operation, coalescing concurrent identical calls (to the same client).
+
+    Args:
+        operation (str): Name of the CM operation (e.g. "infer_rx_norm").
+        text (str): Text to be inferred.
+        cm_client (object): CM client. Default to None for the shared client (`get_cm_client`).
+        deadline (Deadline): Request deadline bounding the call. Default to None for no deadline.
+
+    Returns:
+        list: Inferred entities. Shared between the coalesced callers: must not be modified.
+
+    """
+    response, _ = _CM_CALLS.do(
+        (id(cm_client), operation, text),
+        _call_cm,
+        operation,
+        text,
+        cm_client,
+        deadline,
+        deadline=deadline,
+    )
+    return response
+
+
+def add_condition_options(
+    entities, vocabulary_index=None, deadline=None, cm_client=None
+):
     """Add option on entities in the category "Condition"
 
+    Names are resolved with the local vocabulary index first (exact or close approximate matches) and CM is only called on a miss.
+
     Args:
         entities: List of entity records of category "Condition"
+        vocabulary_index (OMOPVocabularyIndex): Local vocabulary index. Default to None for CM only.
+        deadline (Deadline): Request deadline, bounding each CM call. Default to None for no deadline.
+        cm_client (object): CM client. Default to None for the shared client (`get_cm_client`).
 
     Returns:
-        dict: List of entity records of category "Condition" updated with options and default disambiguation.
+        list: New entity records of category "Condition" with options and default disambiguation.
 
     """
-
+    out = []
     for entity in entities:
-        response = CM_CLIENT.infer_icd10_cm(Text=entity["Text"])["Entities"]
-        if response:
-            options = response[0]["ICD10CMConcepts"]
+        options = _get_local_options(entity["Text"], vocabulary_index, "ICD10CM")
+        if options:
             default = options[0]["Code"]
         else:
-            options = [{"Score": -1.0, "Code": "-1", "Description": "N/A"}]
-            default = "N/A"
-
-        entity["Options"] = options
-        entity["Query-arg"] = default
+            response = _infer_with_cm(
+                "infer_icd10_cm", entity["Text"], cm_client, deadline
+            )
+            if response:
+                options = response[0]["ICD10CMConcepts"]
+                default = options[0]["Code"]
+            else:
+                options = NOT_FOUND_OPTIONS
+                default = "N/A"
+
+        out.append(_with_options(entity, options, default))
 
-    return entities
+    return out
 
 
-def add_drug_options(entities):
+def add_drug_options(entities, vocabulary_index=None, deadline=None, cm_client=None):
     """Add option on entities in the category "Drug"
 
+    Names are resolved with the local vocabulary index first (exact or close approximate matches) and CM is only called on a miss.
+
     Args:
         entities: List of entity records of category "Drug"
+        vocabulary_index (OMOPVocabularyIndex): Local vocabulary index. Default to None for CM only.
+        deadline (Deadline): Request deadline, bounding each CM call. Default to None for no deadline.
+        cm_client (object): CM client. Default to None for the shared client (`get_cm_client`).
 
     Returns:
-        dict: List of entity records of category "Drug" updated with options and default disambiguation.
+        list: New entity records of category "Drug" with options and default disambiguation.
 
     """
+    out = []
     for entity in entities:
-        response = CM_CLIENT.infer_rx_norm(Text=entity["Text"])["Entities"]
-        if response:
-            result = response[0]
-            options = result["RxNormConcepts"]
+        options = _get_local_options(entity["Text"], vocabulary_index, "RxNorm")
+        if options:
             default = options[0]["Code"]
         else:
-            options = [{"Score": -1.0, "Code": "-1", "Description": "N/A"}]
-            default = "N/A"
-        entity["Options"] = options
-        entity["Query-arg"] = default
+            response = _infer_with_cm(
+                "infer_rx_norm", entity["Text"], cm_client, deadline
+            )
+            if response:
+                result = response[0]
+                options = result["RxNormConcepts"]
+                default = options[0]["Code"]
+            else:
+                options = NOT_FOUND_OPTIONS
+                default = "N/A"
+
+        out.append(_with_options(entity, options, default))
 
-    return entities
+    return out
@@ -4,6 +4,7 @@ Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
 SPDX-License-Identifier: CC-BY-NC-4.0
 """
 
+from entity_records import EntityRecord
 from disambiguation_helpers import (
     add_condition_options,
     add_drug_options,
@@ -25,21 +26,37 @@ CATEGORY2PROC_FUN = {
     "STATE": add_state_options,
 }
 
+# Categories resolved against OMOP vocabularies (local index and/or CM).
+VOCABULARY_CATEGORIES = ("CONDITION", "DRUG")
 
-def add_omop_disambiguation_options(entities):
+
+def add_omop_disambiguation_options(
+    entities, vocabulary_index=None, deadline=None, cm_client=None
+):
     """
     Provide options for each name depending on it's category using the CATEGORY2PROC_FUN mapping.
 
     Args:
         entities (dict): Detected entities in a NLQ.
+        vocabulary_index (OMOPVocabularyIndex): Local vocabulary index used for drugs & conditions. Default to None for CM only.
+        deadline (Deadline): Request deadline, bounding each CM call. Default to None for no deadline.
+        cm_client (object): CM client used for drugs & conditions. Default to None for the shared client (`get_cm_client`).
 
     Returns:
-        dict: Input entities with added "Options" and "Query-arg" fields.
+        dict: Input entities with the category lists replaced by new records with "Options" and "Query-arg" fields.
 
     """
     for category, f in CATEGORY2PROC_FUN.items():
         if category in entities:
-            entities[category] = f(entities[category])
+            if category in VOCABULARY_CATEGORIES:
+                entities[category] = f(
+                    entities[category],
+                    vocabulary_index=vocabulary_index,
+                    deadline=deadline,
+                    cm_client=cm_client,
+                )
+            else:
+                entities[category] = f(entities[category])
 
     return entities
 
@@ -52,14 +69,18 @@ def add_placeholders(all_entities, start_indices={}, **kwargs):
         all_entities (dict): Dictionary with keys being entity category (e.g. CONDITION, DRUG, etc.) and the value a list of dictionaries representing the entities in each category.
 
     Returns:
-        dict: `all_entities` with an added "Placeholder" field.
+        dict: `all_entities` with the category lists replaced by new records with a "Placeholder" field.
 
     """
     for category, entities in all_entities.items():
         start_idx = start_indices.get(category, 0)
+        proc_entities = []
         for i, entity in enumerate(entities, start_idx):
             idx = str(i)
             placeholder = f"<ARG-{category}><{idx}>"
-            entity["Placeholder"] = placeholder
+            proc_entities.append(
+                EntityRecord.from_dict(entity).replace(placeholder=placeholder)
+            )
+        all_entities[category] = proc_entities
 
     return all_entities
@@ -0,0 +1,292 @@
+"""
+Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+
+SPDX-License-Identifier: CC-BY-NC-4.0
+"""
+
+# This module contains the trigram index used to approximately match misspelled names (e.g. "ibuprophen")
+# against the names of the local OMOP vocabulary index (see omop_vocabulary).
+# Similarity between two names is the Dice coefficient of their trigram sets. Trigram similarity alone
+# doesn't tell a misspelling from a different concept (e.g. "hypertension" & "hypotension" score 0.72), so
+# matches must also be close in length and in edit distance (`is_close_match`). Edits are counted after
+# folding common spelling variants ("ph" & "f", "y" & "i", doubled letters), and longer names allow more of them.
+#
+# Usage (checks `CLOSE_MATCH_EXAMPLES` against the thresholds of config.py):
+#     python src/engine/step2/fuzzy_matching.py
+
+import re
+import sys
+import zlib
+from os import path as osp
+
+import numpy as np
+
+TRIGRAM_ARRAYS = (
+    "trigram_hashes",
+    "trigram_offsets",
+    "trigram_postings",
+    "name_trigram_counts",
+)
+
+# Posting lists longer than this are not used to generate candidates, only to score them.
+MAX_CANDIDATE_POSTINGS = 20000
+
+# Spelling variants folded before counting edits.
+SPELLING_VARIANTS = (("ph", "f"), ("ck", "k"), ("y", "i"))
+REPEATED_LETTER_P = re.compile(r"(\w)\1+")
+
+# (misspelled name, indexed name, whether it's a match) checked by `check_close_match_examples`.
+CLOSE_MATCH_EXAMPLES = (
+    ("larengitis", "laryngitis", True),
+    ("ibuprophen", "ibuprofen", True),
+    ("acetaminophin", "acetaminophen", True),
+    ("hypertenson", "hypertension", True),
+    ("hypertension", "hypotension", False),
+    ("diabetes", "diabetes insipidus", False),
+)
+
+
+def get_trigrams(name):
+    """Get the set of trigrams of a (normalized) name.
+
+    Args:
+        name (str): Normalized name.
+
+    Returns:
+        set: Trigrams of the name padded with two leading white spaces and a trailing one.
+
+    """
+    padded = f"  {name} "
+    return set(padded[i : i + 3] for i in range(len(padded) - 2))
+
+
+def get_trigram_hashes(name):
+    """Get the sorted unique trigram hashes of a (normalized) name.
+
+    Args:
+        name (str): Normalized name.
+
+    Returns:
+        np.ndarray: np.uint32 sorted array of trigram hashes.
+
+    """
+    hashes = {zlib.crc32(trigram.encode("utf-8")) for trigram in get_trigrams(name)}
+    return np.array(sorted(hashes), dtype=np.uint32)
+
+
+def get_edit_distance(a, b, max_distance):
+    """Get the edit distance (insertions, deletions, substitutions & transpositions) between two names.
+
+    Args:
+        a (str): Normalized name.
+        b (str): Normalized name.
+        max_distance (int): Distances over this value are not computed exactly.
+
+    Returns:
+        int: Edit distance. `max_distance + 1` if it is over `max_distance`.
+
+    """
+    if abs(len(a) - len(b)) > max_distance:
+        return max_distance + 1
+
+    before_previous = None
+    previous = list(range(len(b) + 1))
+    for i in range(1, len(a) + 1):
+        current = [i] + [0] * len(b)
+        for j in range(1, len(b) + 1):
+            cost = 0 if a[i - 1] == b[j - 1] else 1
+            current[j] = min(
+                previous[j] + 1, current[j - 1] + 1, previous[j - 1] + cost
+            )
+            if i > 1 and j > 1 and a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1]:
+                current[j] = min(current[j], before_previous[j - 2] + 1)
+        if min(current) > max_distance:
+            return max_distance + 1
+        before_previous, previous = previous, current
+
+    return min(previous[-1], max_distance + 1)
+
+
+def fold_spelling(name):
+    """Fold the common spelling variants of a (normalized) name, e.g. "ibuprophen" to "ibuprofen".
+
+    Args:
+        name (str): Normalized name.
+
+    Returns:
+        str: Name with the variants of `SPELLING_VARIANTS` replaced and repeated letters collapsed.
+
+    """
+    for variant, folded in SPELLING_VARIANTS:
+        name = name.replace(variant, folded)
+    return REPEATED_LETTER_P.sub(r"\1", name)
+
+
+def is_close_match(name, candidate, max_edit_ratio, min_length_ratio):
+    """Check whether a candidate name is close enough to be a misspelling of a name.
+
+    Args:
+        name (str): Normalized name.
+        candidate (str): Normalized candidate name.
+        max_edit_ratio (float): Edits allowed per character of the name (at least 1 edit), counted after folding the spelling variants.
+        min_length_ratio (float): Value between [0,1]. Minimum ratio between the shorter and the longer name length.
+
+    Returns:
+        bool: True if the candidate is close enough.
+
+    """
+    lengths = sorted((len(name), len(candidate)))
+    if lengths[1] == 0 or lengths[0] / lengths[1] < min_length_ratio:
+        return False
+    name, candidate = fold_spelling(name), fold_spelling(candidate)
+    max_edit_distance = max(1, int(len(name) * max_edit_ratio))
+    return get_edit_distance(name, candidate, max_edit_distance) <= max_edit_distance
+
+
+def get_dice_score(name, candidate):
+    """Trigram similarity (Dice coefficient) of two normalized names, as scored by `TrigramIndex.query`."""
+    name_hashes = get_trigram_hashes(name)
+    candidate_hashes = get_trigram_hashes(candidate)
+    shared = len(np.intersect1d(name_hashes, candidate_hashes))
+    return 2.0 * shared / (len(name_hashes) + len(candidate_hashes))
+
+
+def check_close_match_examples(min_score, max_edit_ratio, min_length_ratio):
+    """Check the matching thresholds against `CLOSE_MATCH_EXAMPLES`.
+
+    Args:
+        min_score (float): Minimum trigram similarity.
+        max_edit_ratio (float): Edits allowed per character of the name.
+        min_length_ratio (float): Minimum length ratio.
+
+    Returns:
+        list: Examples matched differently than expected, with their trigram similarity.
+
+    """
+    failures = []
+    for name, candidate, expected in CLOSE_MATCH_EXAMPLES:
+        score = get_dice_score(name, candidate)
+        matched = score >= min_score and is_close_match(
+            name, candidate, max_edit_ratio, min_length_ratio
+        )
+        if matched != expected:
+            failures.append((name, candidate, expected, score))
+    return failures
+
+
+def build_trigram_arrays(names):
+    """Build the trigram postings of a list of names.
+
+    Args:
+        names (list): Normalized names. The position in the list is the name id used in the postings.
+
+    Returns:
+        dict: Arrays of the trigram index (see `TRIGRAM_ARRAYS`).
+
+    """
+    name_hashes = [get_trigram_hashes(name) for name in names]
+    counts = np.array([len(hashes) for hashes in name_hashes], dtype=np.uint16)
+
+    all_hashes = np.concatenate(name_hashes) if names else np.array([], dtype=np.uint32)
+    all_names = np.repeat(np.arange(len(names), dtype=np.int32), counts)
+
+    # stable sort keeps the name ids of each posting list sorted
+    order = np.argsort(all_hashes, kind="stable")
+    all_hashes, all_names = all_hashes[order], all_names[order]
+
+    trigram_hashes, starts = np.unique(all_hashes, return_index=True)
+    trigram_offsets = np.append(starts, len(all_hashes)).astype(np.int64)
+
+    return {
+        "trigram_hashes": trigram_hashes.astype(np.uint32),
+        "trigram_offsets": trigram_offsets,
+        "trigram_postings": all_names,
+        "name_trigram_counts": counts,
+    }
+
+
+class TrigramIndex(object):
+    def __init__(self, arrays, max_candidate_postings=MAX_CANDIDATE_POSTINGS):
+        """Initialize the index from its (possibly memory-mapped) arrays.
+
+        Args:
+            arrays (dict): Arrays built with `build_trigram_arrays`.
+            max_candidate_postings (int): Longest posting list used to generate candidates.
+
+        Returns:
+            None
+
+        """
+        self._hashes = arrays["trigram_hashes"]
+        self._offsets = arrays["trigram_offsets"]
+        self._postings = arrays["trigram_postings"]
+        self._counts = arrays["name_trigram_counts"]
+        self.max_candidate_postings = max_candidate_postings
+
+    def query(self, name, min_score):
+        """Find the names similar to `name`.
+
+        Candidates are generated from the rarest trigrams of `name` and scored against
+        all of them, so frequent trigrams (e.g. " ca") never expand to huge candidate lists.
+
+        Args:
+            name (str): Normalized name.
+            min_score (float): Value between [0,1]. Minimum Dice similarity of the returned names.
+
+        Returns:
+            tuple: First is the np.ndarray of name ids. Second element is the np.ndarray of their scores. Sorted by decreasing score.
+
+        """
+        hashes = get_trigram_hashes(name)
+        if len(hashes) == 0 or len(self._hashes) == 0:
+            return np.array([], dtype=np.int32), np.array([], dtype=np.float64)
+
+        positions = np.searchsorted(self._hashes, hashes)
+        positions = positions[positions < len(self._hashes)]
+        positions = positions[np.isin(self._hashes[positions], hashes)]
+        if len(positions) == 0:
+            return np.array([], dtype=np.int32), np.array([], dtype=np.float64)
+
+        starts = self._offsets[positions]
+        ends = self._offsets[positions + 1]
+        limit = max(self.max_candidate_postings, (ends - starts).min())
+        rare = (ends - starts) <= limit
+
+        candidates = np.concatenate(
+            [self._postings[s:e] for s, e in zip(starts[rare], ends[rare])]
+        )
+        ids, shared = np.unique(candidates, return_counts=True)
+
+        # count matches of the frequent trigrams with a binary search in their postings
+        for s, e in zip(starts[~rare], ends[~rare]):
+            postings = self._postings[s:e]
+            idx = np.minimum(np.searchsorted(postings, ids), len(postings) - 1)
+            shared += postings[idx] == ids
+
+        scores = 2.0 * shared / (len(hashes) + self._counts[ids])
+        keep = scores >= min_score
+        ids, scores = ids[keep], scores[keep]
+
+        order = np.argsort(-scores, kind="stable")
+        return ids[order], scores[order]
+
+
+if __name__ == "__main__":
+
+    sys.path.append(osp.join(osp.dirname(osp.abspath(__file__)), "..", "..", ".."))
+    import src  # adds the tool folders to the path
+    from src import config
+
+    failures = check_close_match_examples(
+        config.FUZZY_MATCH_SCORE_THR,
+        config.FUZZY_MATCH_MAX_EDIT_RATIO,
+        config.FUZZY_MATCH_MIN_LENGTH_RATIO,
+    )
+    for name, candidate, expected, score in failures:
+        print(
+            f"FAILED: {name!r} -> {candidate!r} expected match: {expected} (trigram similarity {score:.3f})"
+        )
+    print(
+        f"{len(CLOSE_MATCH_EXAMPLES) - len(failures)}/{len(CLOSE_MATCH_EXAMPLES)} examples matched as expected"
+    )
+    sys.exit(1 if failures else 0)
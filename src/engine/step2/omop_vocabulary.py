@@ -0,0 +1,451 @@
+"""
+Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+
+SPDX-License-Identifier: CC-BY-NC-4.0
+"""
+
+# This module contains a local resolver of drug and condition names to vocabulary codes.
+# The index is built once from the OMOP CDM `concept` & `concept_synonym` exports (e.g. Athena downloads)
+# and memory-mapped at load time, so lookups don't require any Comprehend Medical call.
+# Misspelled names are approximately matched with the trigram index in fuzzy_matching: only matches close in
+# length & edit distance are returned, so they can be used before calling CM (see disambiguation_helpers).
+
+import os
+import csv
+import json
+import argparse
+from os import path as osp
+
+import numpy as np
+import pandas as pd
+from fuzzy_matching import (
+    TRIGRAM_ARRAYS,
+    TrigramIndex,
+    build_trigram_arrays,
+    is_close_match,
+)
+
+META_FILE = "meta.json"
+INDEX_ARRAYS = (
+    "names",
+    "name_offsets",
+    "name_concepts",
+    "name_is_synonym",
+    "concept_vocabularies",
+    "codes",
+    "code_offsets",
+    "descriptions",
+    "description_offsets",
+)
+
+# Option scores depending on whether the name matched the concept name or one of its synonyms.
+NAME_MATCH_SCORE = 1.0
+SYNONYM_MATCH_SCORE = 0.95
+
+DEFAULT_VOCABULARIES = ("RxNorm", "ICD10CM")
+
+# Minimum trigram similarity of the approximate matches. None to disable approximate matching.
+DEFAULT_FUZZY_SCORE_THR = 0.65
+# Edits allowed per character of a name (at least 1) and minimum length ratio between a name and its approximate matches.
+DEFAULT_FUZZY_MAX_EDIT_RATIO = 0.1
+DEFAULT_FUZZY_MIN_LENGTH_RATIO = 0.8
+
+
+def normalize_concept_name(name):
+    """Normalize a concept name to be used as index key.
+
+    Args:
+        name (str): Concept name or synonym.
+
+    Returns:
+        str: Case-folded name with collapsed white spaces.
+
+    """
+    return " ".join(name.casefold().split())
+
+
+def _pack_strings(strings):
+    """Pack a list of strings into a single utf-8 buffer and its offsets.
+
+    Args:
+        strings (list): List of strings (or utf-8 encoded bytes).
+
+    Returns:
+        tuple: First is the np.uint8 buffer. Second element is the np.int64 array of offsets (length `len(strings) + 1`).
+
+    """
+    encoded = [s if isinstance(s, bytes) else s.encode("utf-8") for s in strings]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    np.cumsum([len(s) for s in encoded], out=offsets[1:])
+    buffer = np.frombuffer(b"".join(encoded), dtype=np.uint8)
+    return buffer, offsets
+
+
+def _read_vocabulary_csv(filepath, columns, sep):
+    """Read an OMOP CDM vocabulary export keeping all the values as strings.
+
+    Args:
+        filepath (str): Path to the export (e.g. CONCEPT.csv).
+        columns (list): Columns to read.
+        sep (str): Field separator. Athena exports are tab separated.
+
+    Returns:
+        pd.DataFrame: Table with the requested columns.
+
+    """
+    return pd.read_csv(
+        filepath,
+        sep=sep,
+        usecols=columns,
+        dtype=str,
+        keep_default_na=False,
+        quoting=csv.QUOTE_NONE,
+    )
+
+
+def build_vocabulary_index(
+    concept_path,
+    output_dir,
+    concept_synonym_path=None,
+    vocabularies=DEFAULT_VOCABULARIES,
+    sep="\t",
+    fuzzy=True,
+):
+    """Build the local vocabulary index from OMOP CDM `concept` & `concept_synonym` exports.
+
+    Args:
+        concept_path (str): Path to the `concept` table export.
+        output_dir (str): Directory where the index is written.
+        concept_synonym_path (str): Path to the `concept_synonym` table export. Default to None for no synonyms.
+        vocabularies (tuple): Vocabularies to index. Default to RxNorm (drugs) & ICD10CM (conditions).
+        sep (str): Field separator of the exports. Default to tab.
+        fuzzy (bool): Whether to build the trigram index used for approximate matching. Default to True.
+
+    Returns:
+        int: Number of indexed names.
+
+    """
+    concepts = _read_vocabulary_csv(
+        concept_path,
+        [
+            "concept_id",
+            "concept_name",
+            "vocabulary_id",
+            "concept_code",
+            "invalid_reason",
+        ],
+        sep,
+    )
+    concepts = concepts[
+        concepts["vocabulary_id"].isin(vocabularies)
+        & (concepts["invalid_reason"] == "")
+    ].reset_index(drop=True)
+
+    # name records: concept names & synonyms pointing to a concept row
+    names = pd.DataFrame(
+        {
+            "name": concepts["concept_name"],
+            "concept": np.arange(concepts.shape[0]),
+            "is_synonym": 0,
+        }
+    )
+    if concept_synonym_path:
+        synonyms = _read_vocabulary_csv(
+            concept_synonym_path, ["concept_id", "concept_synonym_name"], sep
+        )
+        concept_rows = pd.Series(
+            np.arange(concepts.shape[0]), index=concepts["concept_id"]
+        )
+        synonyms = synonyms[synonyms["concept_id"].isin(concept_rows.index)]
+        synonym_names = pd.DataFrame(
+            {
+                "name": synonyms["concept_synonym_name"].values,
+                "concept": concept_rows.loc[synonyms["concept_id"]].values,
+                "is_synonym": 1,
+            }
+        )
+        names = pd.concat([names, synonym_names], ignore_index=True)
+
+    names["key"] = [
+        normalize_concept_name(name).encode("utf-8") for name in names["name"]
+    ]
+    names = names[names["key"] != b""]
+    names = names.sort_values(["key", "is_synonym", "concept"], kind="mergesort")
+    names = names.drop_duplicates(subset=["key", "concept"], keep="first")
+
+    vocabulary_list = sorted(concepts["vocabulary_id"].unique().tolist())
+    vocabulary2id = {vocabulary: i for i, vocabulary in enumerate(vocabulary_list)}
+
+    arrays = {}
+    arrays["names"], arrays["name_offsets"] = _pack_strings(names["key"].tolist())
+    arrays["name_concepts"] = names["concept"].values.astype(np.int32)
+    arrays["name_is_synonym"] = names["is_synonym"].values.astype(np.uint8)
+    arrays["concept_vocabularies"] = (
+        concepts["vocabulary_id"].map(vocabulary2id).values.astype(np.uint8)
+    )
+    arrays["codes"], arrays["code_offsets"] = _pack_strings(
+        concepts["concept_code"].tolist()
+    )
+    arrays["descriptions"], arrays["description_offsets"] = _pack_strings(
+        concepts["concept_name"].tolist()
+    )
+
+    array_names = INDEX_ARRAYS
+    if fuzzy:
+        keys = [key.decode("utf-8") for key in names["key"]]
+        arrays.update(build_trigram_arrays(keys))
+        array_names = array_names + TRIGRAM_ARRAYS
+
+    os.makedirs(output_dir, exist_ok=True)
+    for name in array_names:
+        np.save(osp.join(output_dir, f"{name}.npy"), arrays[name])
+
+    meta = {
+        "fuzzy": fuzzy,
+        "vocabularies": vocabulary_list,
+        "n_concepts": int(concepts.shape[0]),
+        "n_names": int(names.shape[0]),
+    }
+    with open(osp.join(output_dir, META_FILE), "w") as fp:
+        json.dump(meta, fp)
+
+    return meta["n_names"]
+
+
+class OMOPVocabularyIndex(object):
+    def __init__(
+        self,
+        index_dir,
+        fuzzy_score_thr=DEFAULT_FUZZY_SCORE_THR,
+        fuzzy_max_edit_ratio=DEFAULT_FUZZY_MAX_EDIT_RATIO,
+        fuzzy_min_length_ratio=DEFAULT_FUZZY_MIN_LENGTH_RATIO,
+    ):
+        """Memory-map a vocabulary index built with `build_vocabulary_index`.
+
+        Args:
+            index_dir (str): Directory of the index.
+            fuzzy_score_thr (float): Value between [0,1]. Only approximate matches with a trigram similarity over this value are returned. None to disable approximate matching.
+            fuzzy_max_edit_ratio (float): Edits allowed per character of a name (at least 1) in its approximate matches.
+            fuzzy_min_length_ratio (float): Value between [0,1]. Minimum length ratio between a name and its approximate matches.
+
+        Returns:
+            None
+
+        """
+        with open(osp.join(index_dir, META_FILE), "r") as fp:
+            self.meta = json.load(fp)
+
+        for name in INDEX_ARRAYS:
+            array = np.load(osp.join(index_dir, f"{name}.npy"), mmap_mode="r")
+            setattr(self, f"_{name}", array)
+
+        self._vocabulary2id = {
+            vocabulary: i for i, vocabulary in enumerate(self.meta["vocabularies"])
+        }
+        self._n_names = len(self._name_concepts)
+
+        self.fuzzy_score_thr = fuzzy_score_thr
+        self.fuzzy_max_edit_ratio = fuzzy_max_edit_ratio
+        self.fuzzy_min_length_ratio = fuzzy_min_length_ratio
+        self.trigram_index = None
+        if self.meta.get("fuzzy", False):
+            self.trigram_index = TrigramIndex(
+                {
+                    name: np.load(osp.join(index_dir, f"{name}.npy"), mmap_mode="r")
+                    for name in TRIGRAM_ARRAYS
+                }
+            )
+
+    def __len__(self):
+        """Number of indexed names (concept names & synonyms)."""
+        return self._n_names
+
+    @staticmethod
+    def _get_string(buffer, offsets, i):
+        """Read the i-th string packed in `buffer`."""
+        return buffer[offsets[i] : offsets[i + 1]].tobytes()
+
+    def _bisect_left(self, key):
+        """Binary search of the first indexed name greater or equal than `key`.
+
+        Args:
+            key (bytes): utf-8 encoded normalized name.
+
+        Returns:
+            int: Position of the first name greater or equal than `key`.
+
+        """
+        low, high = 0, self._n_names
+        while low < high:
+            mid = (low + high) // 2
+            if self._get_string(self._names, self._name_offsets, mid) < key:
+                low = mid + 1
+            else:
+                high = mid
+        return low
+
+    def get_option(self, concept, score):
+        """Build the disambiguation option of a concept.
+
+        Args:
+            concept (int): Concept row in the index.
+            score (float): Score of the option.
+
+        Returns:
+            dict: Option with the same fields as Comprehend Medical concepts ("Code", "Description" & "Score").
+
+        """
+        return {
+            "Code": self._get_string(self._codes, self._code_offsets, concept).decode(
+                "utf-8"
+            ),
+            "Description": self._get_string(
+                self._descriptions, self._description_offsets, concept
+            ).decode("utf-8"),
+            "Score": score,
+        }
+
+    def get_vocabulary_id(self, vocabulary):
+        """Internal id of `vocabulary`. None if the vocabulary is not indexed."""
+        return self._vocabulary2id.get(vocabulary)
+
+    def lookup(self, name, vocabulary, max_options=5):
+        """Exact (case-insensitive) lookup of a name among concept names and synonyms.
+
+        Args:
+            name (str): Drug or condition name.
+            vocabulary (str): Vocabulary of the returned codes (e.g. "RxNorm" or "ICD10CM").
+            max_options (int): Maximum number of options returned.
+
+        Returns:
+            list: Options ranked by score (concept names before synonyms). Empty if the name isn't indexed.
+
+        """
+        vocabulary_id = self.get_vocabulary_id(vocabulary)
+        if vocabulary_id is None:
+            return []
+
+        key = normalize_concept_name(name).encode("utf-8")
+        options = []
+        i = self._bisect_left(key)
+        while (
+            i < self._n_names
+            and len(options) < max_options
+            and self._get_string(self._names, self._name_offsets, i) == key
+        ):
+            concept = int(self._name_concepts[i])
+            if self._concept_vocabularies[concept] == vocabulary_id:
+                score = (
+                    SYNONYM_MATCH_SCORE
+                    if self._name_is_synonym[i]
+                    else NAME_MATCH_SCORE
+                )
+                options.append(self.get_option(concept, score))
+            i += 1
+
+        return options
+
+    def fuzzy_lookup(self, name, vocabulary, min_score=None, max_options=5):
+        """Approximate lookup of a (possibly misspelled) name among concept names and synonyms.
+
+        Args:
+            name (str): Drug or condition name.
+            vocabulary (str): Vocabulary of the returned codes (e.g. "RxNorm" or "ICD10CM").
+            min_score (float): Minimum trigram similarity. Default to None for `self.fuzzy_score_thr`.
+            max_options (int): Maximum number of options returned.
+
+        Returns:
+            list: Options ranked by trigram similarity (used as score). Empty if nothing is similar enough.
+                Matches too far in length or edit distance from the name are rejected.
+
+        """
+        min_score = self.fuzzy_score_thr if min_score is None else min_score
+        vocabulary_id = self.get_vocabulary_id(vocabulary)
+        if self.trigram_index is None or min_score is None or vocabulary_id is None:
+            return []
+
+        name = normalize_concept_name(name)
+        name_ids, scores = self.trigram_index.query(name, min_score)
+        concepts = self._name_concepts[name_ids]
+        in_vocabulary = self._concept_vocabularies[concepts] == vocabulary_id
+
+        options = []
+        seen_concepts = set()
+        for name_id, concept, score in zip(
+            name_ids[in_vocabulary], concepts[in_vocabulary], scores[in_vocabulary]
+        ):
+            concept = int(concept)
+            if concept in seen_concepts:
+                continue
+            candidate = self._get_string(self._names, self._name_offsets, name_id)
+            if not is_close_match(
+                name,
+                candidate.decode("utf-8"),
+                self.fuzzy_max_edit_ratio,
+                self.fuzzy_min_length_ratio,
+            ):
+                continue
+            seen_concepts.add(concept)
+            options.append(self.get_option(concept, round(float(score), 4)))
+            if len(options) == max_options:
+                break
+
+        return options
+
+
+def load_vocabulary_index(
+    index_dir,
+    fuzzy_score_thr=DEFAULT_FUZZY_SCORE_THR,
+    fuzzy_max_edit_ratio=DEFAULT_FUZZY_MAX_EDIT_RATIO,
+    fuzzy_min_length_ratio=DEFAULT_FUZZY_MIN_LENGTH_RATIO,
+):
+    """Load the local vocabulary index if configured.
+
+    Args:
+        index_dir (str): Directory of the index. None for no local index.
+        fuzzy_score_thr (float): Minimum trigram similarity of approximate matches. None to disable them.
+        fuzzy_max_edit_ratio (float): Edits allowed per character of a name in its approximate matches.
+        fuzzy_min_length_ratio (float): Minimum length ratio of approximate matches.
+
+    Returns:
+        OMOPVocabularyIndex: Loaded index or None.
+
+    """
+    if not index_dir:
+        return None
+    return OMOPVocabularyIndex(
+        index_dir,
+        fuzzy_score_thr=fuzzy_score_thr,
+        fuzzy_max_edit_ratio=fuzzy_max_edit_ratio,
+        fuzzy_min_length_ratio=fuzzy_min_length_ratio,
+    )
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(
+        description="Build the local OMOP vocabulary index used to resolve drugs & conditions."
+    )
+    parser.add_argument("--concept", required=True, help="Path to CONCEPT.csv")
+    parser.add_argument(
+        "--concept-synonym", default=None, help="Path to CONCEPT_SYNONYM.csv"
+    )
+    parser.add_argument("--output-dir", required=True, help="Index output directory")
+    parser.add_argument("--vocabularies", nargs="+", default=list(DEFAULT_VOCABULARIES))
+    parser.add_argument("--sep", default="\t", help="Field separator of the exports")
+    parser.add_argument(
+        "--no-fuzzy",
+        action="store_true",
+        help="Don't build the trigram index used for approximate matching",
+    )
+    args = parser.parse_args()
+
+    n_names = build_vocabulary_index(
+        args.concept,
+        args.output_dir,
+        concept_synonym_path=args.concept_synonym,
+        vocabularies=tuple(args.vocabularies),
+        sep=args.sep,
+        fuzzy=not args.no_fuzzy,
+    )
+    print(f"Indexed {n_names} names in {args.output_dir}")
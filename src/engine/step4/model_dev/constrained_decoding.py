@@ -0,0 +1,152 @@
+"""
+Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+
+SPDX-License-Identifier: CC-BY-NC-4.0
+"""
+
+# Template-constrained decoding.
+# The model outputs one of a closed set of generic SQL templates. The token ids of the known templates
+# (tokenized like the training targets: "<" & ">" as "[" & "]") are stored in a prefix trie, and
+# `prefix_allowed_tokens_fn` of `generate` only allows the tokens continuing a known template: no step
+# explores the rest of the vocabulary and no malformed SQL is generated.
+# As soon as the generated prefix belongs to a single template, only the end token is allowed (the
+# decoding stops) and the output is completed with the rest of that template (`complete`).
+
+import pandas as pd
+
+
+def read_templates(path):
+    """Read known generic SQL templates.
+
+    Args:
+        path (str): CSV file with a "query" column (e.g. the training split), or a text file with a template per line.
+
+    Returns:
+        list: Unique templates, with "<" & ">" placeholders.
+
+    """
+    if path.endswith(".csv"):
+        templates = pd.read_csv(path)["query"].dropna().tolist()
+    else:
+        with open(path, "r") as fp:
+            templates = [line.strip() for line in fp if line.strip()]
+    return list(dict.fromkeys(templates))
+
+
+class _TrieNode(object):
+    __slots__ = ("children", "template", "n_templates", "allowed")
+
+    def __init__(self):
+        self.children = {}
+        # template of the node if it's the only one through it
+        self.template = None
+        self.n_templates = 0
+        self.allowed = None
+
+
+class TemplateTrie(object):
+    def __init__(self, model, templates):
+        """Prefix trie of the token ids of known templates.
+
+        Args:
+            model (T5FineTuner): Trained model (tokenizer, maximum output length and decoder start token).
+            templates (list): Known generic SQL templates, with "<" & ">" placeholders.
+
+        Returns:
+            None
+
+        """
+        tokenizer = model.tokenizer
+        self.eos_token_id = tokenizer.eos_token_id
+        self.pad_token_id = tokenizer.pad_token_id
+        self._eos_only = [self.eos_token_id]
+        self.root = _TrieNode()
+        self.templates = list(dict.fromkeys(templates))
+
+        # same preprocessing as the training targets
+        targets = [
+            template.replace("<", "[").replace(">", "]") for template in self.templates
+        ]
+        token_ids = tokenizer(
+            targets, max_length=model.hparams.max_output_length, truncation=True
+        )["input_ids"]
+        # templates identical after truncation are kept once (the first one), otherwise no
+        # leaf would determine a single template
+        inserted = set()
+        templates = []
+        for template, ids in zip(self.templates, token_ids):
+            if tuple(ids) in inserted:
+                continue
+            inserted.add(tuple(ids))
+            templates.append(template)
+            self._insert(template, ids)
+        self.templates = templates
+
+    def _insert(self, template, ids):
+        for node in self._path(ids):
+            node.n_templates += 1
+            node.template = template if node.n_templates == 1 else None
+
+    def _path(self, ids):
+        """Nodes of a token id sequence, created if missing (root included)."""
+        node = self.root
+        yield node
+        for token_id in ids:
+            node = node.children.setdefault(token_id, _TrieNode())
+            yield node
+
+    def _find(self, ids):
+        """Node reached by a token id sequence. None if it's not a prefix of a known template."""
+        node = self.root
+        for token_id in ids:
+            node = node.children.get(token_id)
+            if node is None:
+                return None
+        return node
+
+    def prefix_allowed_tokens_fn(self, batch_id, input_ids):
+        """Tokens allowed after a generated prefix (`prefix_allowed_tokens_fn` of `generate`).
+
+        Args:
+            batch_id (int): Index of the question in the batch.
+            input_ids (torch.Tensor): Generated token ids, starting with the decoder start token.
+
+        Returns:
+            list: Allowed token ids. Only the end token once the template is unique (or unknown).
+
+        """
+        # the first token is the decoder start token
+        node = self._find(input_ids[1:].tolist())
+        # no continuation at the end of a template (e.g. a truncated one)
+        if node is None or node.template is not None or not node.children:
+            return self._eos_only
+        if node.allowed is None:
+            node.allowed = list(node.children)
+        return node.allowed
+
+    def complete(self, ids):
+        """Template of generated token ids (without the decoder start token).
+
+        Args:
+            ids (list): Generated token ids. Padding tokens are ignored.
+
+        Returns:
+            str: Template with "<" & ">" placeholders. None if the ids don't determine a single known template.
+
+        """
+        node = self.root
+        for token_id in ids:
+            if token_id == self.pad_token_id:
+                break
+            child = node.children.get(token_id)
+            if child is None:
+                # the end token is forced once the template is unique
+                return node.template if token_id == self.eos_token_id else None
+            node = child
+            if token_id == self.eos_token_id:
+                break
+        return node.template
+
+    def __len__(self):
+        """Number of known templates."""
+        return self.root.n_templates
@@ -0,0 +1,240 @@
+"""
+Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+
+SPDX-License-Identifier: CC-BY-NC-4.0
+"""
+
+"""
+The module sweeps the decoding settings of a trained model on the validation split:
+    - Decode the questions under each configuration of a grid (beam width, maximum length, penalties).
+    - Report the exact-matching accuracy, mean & p99 latency (per batch) and tokens generated per configuration.
+    - With known templates (--templates), also decode each configuration constrained to them
+      (see constrained_decoding.py) and report the share of outputs that are known templates.
+    - Mark the configurations on the accuracy/latency Pareto front (no other configuration is both
+      as accurate and as fast, and better in one of them).
+The chosen configuration goes to `DECODING_PARAMS` in `config.py`.
+
+Usage:
+    python decoding_sweep.py --model-path model.ckpt --data validation.csv \
+        --num-beams 1 2 4 --max-lengths 128 256 0 --templates train.csv --output decoding_sweep.csv
+"""
+
+import sys
+import time
+import itertools
+import argparse
+from os import path as osp
+
+sys.path.append(osp.join(osp.dirname(osp.abspath(__file__)), "..", "..", "..", ".."))
+
+import src  # adds the tool folders to the path
+import numpy as np
+import pandas as pd
+import torch
+
+from utils.model import load_model
+from utils.metrics import correct_gt_query
+from constrained_decoding import TemplateTrie, read_templates
+from t5_inference import decode_queries, generate_query_ids
+
+
+def get_decoding_grid(num_beams, max_lengths, repetition_penalties, length_penalties):
+    """
+    List the decoding settings of a grid.
+
+    Args:
+        num_beams(list): Beam widths (1 for greedy decoding).
+        max_lengths(list): Maximum output lengths (tokens). 0 for the maximum output length of the model.
+        repetition_penalties(list): Repetition penalties (1.0 for none).
+        length_penalties(list): Length penalties of the beam search.
+
+    Returns:
+        The list of decoding settings (`config.DECODING_PARAMS` dictionaries).
+    """
+    return [
+        {
+            "num_beams": beams,
+            "repetition_penalty": repetition_penalty,
+            "length_penalty": length_penalty,
+            "max_length": max_length or None,
+        }
+        for beams, max_length, repetition_penalty, length_penalty in itertools.product(
+            num_beams, max_lengths, repetition_penalties, length_penalties
+        )
+    ]
+
+
+def decode_with_params(
+    model, questions, decoding_params, batch_size=1, template_trie=None
+):
+    """
+    Decode questions in length-sorted batches and measure each batch.
+
+    Args:
+        model(T5FineTuner): Loaded model.
+        questions(list): Input questions.
+        decoding_params(dict): Decoding settings.
+        batch_size(int): Number of questions per batch.
+        template_trie(TemplateTrie): Known templates the outputs are constrained to. Default to None.
+
+    Returns:
+        Tuple of the inferred query templates (in the order of the questions), batch latencies (seconds),
+        numbers of generated tokens and whether each output was cut at the maximum length.
+    """
+    lengths = [len(model.tokenizer.tokenize(question)) for question in questions]
+    order = sorted(range(len(questions)), key=lengths.__getitem__)
+
+    preds = [None] * len(questions)
+    latencies, n_tokens, truncated = [], [], []
+    for start in range(0, len(order), batch_size):
+        indices = order[start : start + batch_size]
+        batch_start = time.perf_counter()
+        output = generate_query_ids(
+            model,
+            [questions[i] for i in indices],
+            decoding_params=decoding_params,
+            template_trie=template_trie,
+        )
+        latencies.append(time.perf_counter() - batch_start)
+
+        # the first token is the decoder start token, shorter outputs are padded
+        batch_tokens = (output[:, 1:] != model.tokenizer.pad_token_id).sum(dim=1)
+        n_tokens.extend(batch_tokens.tolist())
+        # outputs without an end token were cut at the maximum length
+        ends = (output == model.tokenizer.eos_token_id).sum(dim=1)
+        truncated.extend((ends == 0).tolist())
+        for i, sql in zip(indices, decode_queries(model, output, template_trie)):
+            preds[i] = sql
+
+    return preds, latencies, n_tokens, truncated
+
+
+def sweep(model, df, grid, batch_size=1, template_trie=None):
+    """
+    Decode the questions of a dataframe under each decoding configuration.
+
+    Args:
+        model(T5FineTuner): Loaded model.
+        df(pd.DataFrame): Dataframe with the input questions ("unfolded_questions") and true templates ("query").
+        grid(list): Decoding settings (see `get_decoding_grid`).
+        batch_size(int): Number of questions per batch.
+        template_trie(TemplateTrie): Known templates. Each configuration is also decoded constrained to them. Default to None.
+
+    Returns:
+        Pandas dataframe with a row of metrics per configuration, sorted by mean latency.
+    """
+    questions = df["unfolded_questions"].tolist()
+    targets = df["query"].tolist()
+
+    # the first calls are slower
+    generate_query_ids(model, questions[:batch_size], decoding_params=grid[0])
+
+    tries = [None] if template_trie is None else [None, template_trie]
+    rows = []
+    for decoding_params, trie in itertools.product(grid, tries):
+        preds, latencies, n_tokens, truncated = decode_with_params(
+            model, questions, decoding_params, batch_size, trie
+        )
+        exact_matches = [pred == target for pred, target in zip(preds, targets)]
+        row = dict(decoding_params, constrained=trie is not None)
+        row.update(
+            {
+                "exact_match": np.mean(exact_matches),
+                "mean_latency_ms": np.mean(latencies) * 1000,
+                "p99_latency_ms": np.percentile(latencies, 99) * 1000,
+                "mean_tokens": np.mean(n_tokens),
+                "truncated_rate": np.mean(truncated),
+            }
+        )
+        if template_trie is not None:
+            known_templates = set(template_trie.templates)
+            row["known_template_rate"] = np.mean(
+                [pred in known_templates for pred in preds]
+            )
+        rows.append(row)
+        print(
+            f"{decoding_params} (constrained: {row['constrained']}): exact match {row['exact_match']:.4f}, "
+            f"mean latency {row['mean_latency_ms']:.1f}ms"
+        )
+
+    results = pd.DataFrame(rows)
+    results["pareto"] = get_pareto_front(results)
+    return results.sort_values("mean_latency_ms").reset_index(drop=True)
+
+
+def get_pareto_front(results):
+    """
+    Find the configurations on the accuracy/latency Pareto front.
+
+    Args:
+        results(pd.DataFrame): Metrics per configuration ("exact_match" & "mean_latency_ms").
+
+    Returns:
+        The list of booleans: whether each configuration is on the front.
+    """
+    accuracy = results["exact_match"].values
+    latency = results["mean_latency_ms"].values
+    on_front = []
+    for i in range(len(results)):
+        dominated = (accuracy >= accuracy[i]) & (latency <= latency[i])
+        dominated &= (accuracy > accuracy[i]) | (latency < latency[i])
+        on_front.append(not dominated.any())
+    return on_front
+
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Decoding settings sweep.")
+    parser.add_argument("--model-path", required=True, help="Trained model checkpoint")
+    parser.add_argument(
+        "--data", required=True, help="Validation CSV (unfolded_questions & query)"
+    )
+    parser.add_argument(
+        "--limit", type=int, default=None, help="Number of sampled rows"
+    )
+    parser.add_argument("--device", choices=["cuda", "cpu"], default=None)
+    parser.add_argument("--batch-size", type=int, default=1)
+    parser.add_argument("--num-beams", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument(
+        "--max-lengths",
+        type=int,
+        nargs="+",
+        default=[0],
+        help="Maximum output lengths. 0 for the model's one",
+    )
+    parser.add_argument(
+        "--repetition-penalties", type=float, nargs="+", default=[1.0, 2.5]
+    )
+    parser.add_argument("--length-penalties", type=float, nargs="+", default=[1.0])
+    parser.add_argument(
+        "--templates",
+        default=None,
+        help="Known templates (CSV with a 'query' column or one per line): also decode constrained to them",
+    )
+    parser.add_argument("--output", default=None, help="Pareto table CSV")
+    args = parser.parse_args()
+
+    device = args.device or ("cuda" if torch.cuda.is_available() else "cpu")
+
+    df = correct_gt_query(pd.read_csv(args.data))
+    if args.limit is not None and args.limit < df.shape[0]:
+        df = df.sample(n=args.limit, random_state=0)
+
+    model = load_model(args.model_path)
+    model.to(device)
+    model.eval()
+
+    grid = get_decoding_grid(
+        args.num_beams,
+        args.max_lengths,
+        args.repetition_penalties,
+        args.length_penalties,
+    )
+    template_trie = None
+    if args.templates:
+        template_trie = TemplateTrie(model, read_templates(args.templates))
+    results = sweep(model, df, grid, args.batch_size, template_trie)
+
+    print(results.to_string(index=False))
+    if args.output:
+        results.to_csv(args.output, index=False)
@@ -0,0 +1,155 @@
+"""
+Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+
+SPDX-License-Identifier: CC-BY-NC-4.0
+"""
+
+# Multi-process CPU inference pool.
+# The model is loaded once in the parent and its weights are moved to shared memory: every worker
+# process maps the same tensors read-only (inherited with fork, passed by handle with spawn), so the
+# memory stays near one model copy whatever the number of workers.
+# Each worker gets a slice of the cores: torch's intra-op threads are set to the slice size and, on
+# Linux, the worker is pinned to its slice so the workers don't compete for the same cores.
+
+import os
+
+import torch
+import torch.multiprocessing as mp
+
+from utils.model import load_model
+from t5_inference import generate_queries
+
+# Model and decoding settings of the worker process, set by `_init_worker`.
+_worker_model = None
+_worker_decoding_params = None
+
+
+def get_available_cores():
+    """Cores the current process can run on."""
+    if hasattr(os, "sched_getaffinity"):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count() or 1))
+
+
+def _init_worker(model, threads_per_process, worker_counter, decoding_params=None):
+    """Set the model, decoding settings, threads and cores of a worker process."""
+    global _worker_model, _worker_decoding_params
+
+    with worker_counter.get_lock():
+        worker_index = worker_counter.value
+        worker_counter.value += 1
+
+    torch.set_num_threads(threads_per_process)
+    if hasattr(os, "sched_setaffinity"):
+        cores = get_available_cores()
+        first = (worker_index * threads_per_process) % len(cores)
+        os.sched_setaffinity(0, cores[first : first + threads_per_process])
+
+    _worker_model = model
+    _worker_decoding_params = decoding_params
+
+
+def _generate_batch(questions):
+    """Decode a batch of questions with the model of the worker process."""
+    return generate_queries(
+        _worker_model, questions, decoding_params=_worker_decoding_params
+    )
+
+
+class InferencePool(object):
+    def __init__(
+        self,
+        model_path=None,
+        model=None,
+        num_processes=None,
+        threads_per_process=None,
+        start_method=None,
+        decoding_params=None,
+    ):
+        """Start worker processes sharing a single copy of the model weights.
+
+        Args:
+            model_path (str): Path to the stored model. Not used if `model` is given.
+            model (T5FineTuner): Loaded model. Its weights are moved to shared memory.
+            num_processes (int): Number of worker processes. Default to None for one per `threads_per_process` cores.
+            threads_per_process (int): Intra-op threads (and cores) of each worker. Default to None to split the cores evenly.
+            start_method (str): "fork", "spawn" or "forkserver". Default to None for the current start method.
+            decoding_params (dict): Decoding settings (see `config.DECODING_PARAMS`). Default to None for `t5_inference.DEFAULT_DECODING_PARAMS`.
+
+        Returns:
+            None
+
+        """
+        n_cores = len(get_available_cores())
+        if num_processes is None:
+            num_processes = max(1, n_cores // (threads_per_process or 1))
+        if threads_per_process is None:
+            threads_per_process = max(1, n_cores // num_processes)
+
+        if model is None:
+            model = load_model(model_path)
+        model.to("cpu")
+        model.eval()
+        model.share_memory()
+
+        self.num_processes = num_processes
+        self.threads_per_process = threads_per_process
+
+        context = mp.get_context(start_method)
+        self._pool = context.Pool(
+            processes=num_processes,
+            initializer=_init_worker,
+            initargs=(
+                model,
+                threads_per_process,
+                context.Value("i", 0),
+                decoding_params,
+            ),
+        )
+
+    def imap(self, batches):
+        """Decode batches of questions in the worker processes.
+
+        Args:
+            batches (iterable): Lists of general NLQs.
+
+        Returns:
+            iterator: List of generic SQL queries of each batch, in the order of the batches.
+
+        """
+        return self._pool.imap(_generate_batch, batches)
+
+    def map(self, questions, batch_size=16):
+        """Decode questions in the worker processes.
+
+        Args:
+            questions (list): General NLQs.
+            batch_size (int): Number of questions decoded together.
+
+        Returns:
+            list: Generic SQL queries, in the order of the questions.
+
+        """
+        batches = [
+            questions[i : i + batch_size] for i in range(0, len(questions), batch_size)
+        ]
+        return [query for queries in self.imap(batches) for query in queries]
+
+    def close(self):
+        """Wait for the pending batches and stop the worker processes."""
+        self._pool.close()
+        self._pool.join()
+
+    def terminate(self):
+        """Stop the worker processes without waiting for the pending batches."""
+        self._pool.terminate()
+        self._pool.join()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.close()
+        else:
+            self.terminate()
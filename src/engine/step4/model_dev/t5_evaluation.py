@@ -6,7 +6,7 @@ SPDX-License-Identifier: CC-BY-NC-4.0
 
 """
 The module performs the following tasks:
-    - Get model inference for validation and test sets.
+    - Get model inference for validation and test sets (on GPUs or CPU cores).
     - Compute the model's exact-matching and execution accuracies
 """
 
@@ -14,6 +14,7 @@ import os
 from os import path as osp
 import sys
 import json
+from contextlib import nullcontext
 
 sys.path.append("../../../")
 
@@ -26,6 +27,10 @@ from utils.model import T5FineTuner
 # from t5_config import model_params
 import config
 from engine.pipeline import nlq2SqlTool
+from step6.connection_pool import ConnectionPool
+from step6.local_database import LocalDatabase
+from step6.query_execution import connect_to_db
+from step6.result_cache import ResultCache
 import argparse
 import getpass
 
@@ -33,6 +38,8 @@ import torch.multiprocessing as mp
 from torch.multiprocessing import Pool, Process, set_start_method
 from utils.metrics import *
 from utils.model import load_model
+from inference_pool import InferencePool
+from t5_inference import get_decoding_kwargs
 
 import warnings
 
@@ -51,6 +58,8 @@ def do_inference(args):
 
     model_test, df, device = args
     try:
+        # the shared weights stay on CPU, each process makes its own copy on its GPU
+        model_test.to(f"cuda:{device}")
         proc_input = [
             "translate English to SQL: %s" % input_text
             for input_text in df["unfolded_questions"]
@@ -74,10 +83,7 @@ def do_inference(args):
                 output = model_test.model.generate(
                     inputs["input_ids"],
                     attention_mask=inputs["attention_mask"],
-                    max_length=model_test.hparams.max_output_length,
-                    num_beams=2,
-                    repetition_penalty=2.5,
-                    length_penalty=1.0,
+                    **get_decoding_kwargs(model_test, config.DECODING_PARAMS),
                 )
                 queries.extend(output.cpu().numpy().tolist())
 
@@ -97,24 +103,154 @@ def do_inference(args):
     return queries
 
 
-def multi_proc_inference(model_path, df):
-    """Multi-GPU Model Inference.
+def read_predictions(predictions_path):
+    """
+    Read the predictions of a (possibly partially written) predictions file.
+    A truncated last line (e.g. from an interrupted run) is removed from the file.
 
     Args:
-        model_path(str): Model path.
+        predictions_path(str): Path of the JSONL predictions file.
+
+    Returns:
+        Dictionary of the row index to the (question, inferred query) of the predicted rows.
+    """
+    predictions = {}
+    if not osp.exists(predictions_path):
+        return predictions
+
+    valid_size = 0
+    with open(predictions_path, "rb") as fp:
+        for line in fp:
+            if not line.endswith(b"\n"):
+                break
+            try:
+                record = json.loads(line)
+                predictions[record["index"]] = (
+                    record["question"],
+                    record["preds_wiki"],
+                )
+            except (ValueError, KeyError):
+                break
+            valid_size += len(line)
+
+    if valid_size < osp.getsize(predictions_path):
+        with open(predictions_path, "r+b") as fp:
+            fp.truncate(valid_size)
+
+    return predictions
+
+
+def get_length_buckets(model, questions, indices, batch_size):
+    """
+    Group questions of similar token lengths in the same batches (less padding to decode).
+
+    Args:
+        model(T5FineTuner): Model with the tokenizer.
+        questions(list): Input questions.
+        indices(list): Indices of the questions to batch.
+        batch_size(int): Number of questions per batch.
+
+    Returns:
+        The list of batches (lists of question indices).
+    """
+    lengths = {i: len(model.tokenizer.tokenize(questions[i])) for i in indices}
+    indices = sorted(indices, key=lengths.get)
+    return [indices[i : i + batch_size] for i in range(0, len(indices), batch_size)]
+
+
+def cpu_inference(model, df, predictions_path=None, num_processes=None, batch_size=16):
+    """Multi-process CPU Model Inference, resumable.
+
+    The rows are decoded in length-bucketed batches by worker processes sharing the model weights.
+    The predictions are appended to `predictions_path` as the batches complete, and the rows
+    already predicted in it (for the same question) are not decoded again. Without
+    `predictions_path`, every row is decoded and nothing is persisted.
+
+    Args:
+        model(T5FineTuner): Loaded model.
         df(pd.DataFrame): Dataframe with the input questions.
+        predictions_path(str): Path of the JSONL predictions file. Default to None for no persisting or resuming.
+        num_processes(int): Number of worker processes. Default to None for one per core.
+        batch_size(int): Number of questions per batch.
 
     Returns:
         The list of inferred queries templates.
     """
-    # Get total gpus
+    questions = df["unfolded_questions"].tolist()
+    n_rows = len(questions)
+
+    predictions = read_predictions(predictions_path) if predictions_path else {}
+    pending = [
+        i
+        for i in range(n_rows)
+        if i not in predictions or predictions[i][0] != questions[i]
+    ]
+    print(f"{n_rows - len(pending)}/{n_rows} rows already predicted")
+
+    if pending:
+        batches = get_length_buckets(model, questions, pending, batch_size)
+        batch_questions = ([questions[i] for i in batch] for batch in batches)
+        n_done = n_rows - len(pending)
+
+        with InferencePool(
+            model=model,
+            num_processes=num_processes,
+            decoding_params=config.DECODING_PARAMS,
+        ) as pool, (
+            open(predictions_path, "a") if predictions_path else nullcontext()
+        ) as fp:
+            print(f"Decoding with {pool.num_processes} processes...")
+            for batch, queries in zip(batches, pool.imap(batch_questions)):
+                for i, sql in zip(batch, queries):
+                    predictions[i] = (questions[i], sql)
+                    if fp is not None:
+                        record = {
+                            "index": i,
+                            "question": questions[i],
+                            "preds_wiki": sql,
+                        }
+                        fp.write(json.dumps(record) + "\n")
+                if fp is not None:
+                    fp.flush()
+                n_done += len(batch)
+                print(f"{n_done}/{n_rows} done")
+
+    return [predictions[i][1] for i in range(n_rows)]
+
+
+def multi_proc_inference(
+    model, df, device=None, predictions_path=None, num_processes=None, batch_size=16
+):
+    """Multi-GPU or multi-process CPU Model Inference.
+
+    Args:
+        model(T5FineTuner): Loaded model. Its weights are moved to shared memory and read by every process.
+        df(pd.DataFrame): Dataframe with the input questions.
+        device(str): "cuda" or "cpu". Default to None for "cuda" if GPUs are available.
+        predictions_path(str): Path of the JSONL predictions file (CPU only, see `cpu_inference`). Default to None for no persisting or resuming.
+        num_processes(int): Number of worker processes (CPU only). Default to None for one per core.
+        batch_size(int): Number of questions per batch (CPU only).
+
+    Returns:
+        The list of inferred queries templates.
+    """
+    if device is None:
+        device = "cuda" if torch.cuda.is_available() else "cpu"
+    if device == "cpu":
+        return cpu_inference(model, df, predictions_path, num_processes, batch_size)
+
+    # GPU 0 is left free when there are several GPUs
     num_gpus = torch.cuda.device_count()
-    devices = range(1, num_gpus)
+    devices = range(1, num_gpus) if num_gpus > 1 else range(num_gpus)
     n_devices = len(devices)
     n_rows = df.shape[0]
 
     step = math.ceil(n_rows / n_devices)
 
+    # a single copy of the weights is loaded, the processes get a handle to the shared tensors
+    model.to("cpu")
+    model.share_memory()
+
     my_pool = mp.Pool(processes=n_devices)
 
     args = []
@@ -122,10 +258,8 @@ def multi_proc_inference(model_path, df):
     for i in range(0, n_rows, step):
         df0 = df.iloc[i : i + step]
 
-        model_test = load_model(model_path)
-
         device = devices[j]
-        args.append((model_test.to(f"cuda:{device}"), df0, device))
+        args.append((model, df0, device))
         print(f"Device: {device}, rows: {df0.shape}")
         j += 1
 
@@ -133,40 +267,101 @@ def multi_proc_inference(model_path, df):
 
     my_pool.close()
     my_pool.join()
-    return results
-
-
-def inference_wrapper(df, model_path, tool, query2args_dict):
-    """Multi-GPU Model Inference Wrapper with computing accuracies.
+    return [query for queries in results for query in queries]
+
+
+def inference_wrapper(
+    df,
+    model_path,
+    tool,
+    query2args_dict,
+    device=None,
+    predictions_path=None,
+    num_processes=None,
+    gt_cache=None,
+    execution_workers=8,
+    execution_timeout_seconds=None,
+):
+    """Multi-GPU or multi-process CPU Model Inference Wrapper with computing accuracies.
 
     Args:
         df(pd.DataFrame): Dataframe with the input questions.
         model_path(str): Model path.
+        tool(nlq2SqlTool): Tool with the functions for the query is be rendered and executed.
+        query2args_dict(dict): Dictionary of default arguments for the queries.
+        device(str): "cuda" or "cpu". Default to None for "cuda" if GPUs are available.
+        predictions_path(str): Path of the JSONL predictions file (CPU only). Default to None for no persisting or resuming.
+        num_processes(int): Number of worker processes (CPU only). Default to None for one per core.
+        gt_cache(ResultCache): Cache of the ground-truth query outputs. Default to None for no caching.
+        execution_workers(int): Number of rows executed concurrently for the execution accuracy.
+        execution_timeout_seconds(float): Timeout of each predicted query execution. Default to None for the tool's time budget.
 
     Returns:
         Dataframe with the output queries and model accuracies for each output query.
     """
 
     print("Processing the WikiSQL pretrained model inference...")
-    queries = multi_proc_inference(model_path, df)
-    queries = [item for sublist in queries for item in sublist]
-    df["preds_wiki"] = queries
+    model = load_model(model_path)
+    df["preds_wiki"] = multi_proc_inference(
+        model,
+        df,
+        device=device,
+        predictions_path=predictions_path,
+        num_processes=num_processes,
+    )
 
     # compute query length
     print("Computing the output query lengths....")
-    model = load_model(model_path)
-    model.to("cuda:1")
     df["query_length"] = get_query_length(model, df)
 
     # Compute exact matching accuracy
     print("Computing the exact-matching and execution accuracies...")
-    df = get_metrics(tool, df, query2args_dict)
+    df = get_metrics(
+        tool,
+        df,
+        query2args_dict,
+        gt_cache=gt_cache,
+        max_workers=execution_workers,
+        timeout_seconds=execution_timeout_seconds,
+    )
 
     return df
 
 
 if __name__ == "__main__":
 
+    parser = argparse.ArgumentParser(description="T5 model evaluation.")
+    parser.add_argument(
+        "--device",
+        choices=["cuda", "cpu"],
+        default=None,
+        help="Default to cuda if GPUs are available",
+    )
+    parser.add_argument(
+        "--num-processes",
+        type=int,
+        default=None,
+        help="CPU worker processes (default to one per core)",
+    )
+    parser.add_argument(
+        "--execution-workers",
+        type=int,
+        default=8,
+        help="Rows executed concurrently for the execution accuracy",
+    )
+    parser.add_argument(
+        "--execution-timeout",
+        type=float,
+        default=120.0,
+        help="Seconds after which a predicted query execution counts as failed",
+    )
+    parser.add_argument(
+        "--local-db",
+        default=None,
+        help="Execute against a local SQLite OMOP database instead of Redshift",
+    )
+    args = parser.parse_args()
+
     # Data Dir
     DATA_DIR = "/home/ec2-user/SageMaker/efs/data/pilot_nl2sql_dev/0607_final_data/splits/In-Scope/sample_sizes/sampling_number_1/150/"
 
@@ -203,14 +398,47 @@ if __name__ == "__main__":
     print(f"Reading {DATA_PATH}...")
     val_df = pd.read_csv(DATA_PATH)
 
-    tool = nlq2SqlTool(config)
+    # the execution workers share the tool and reuse the DB connections
+    if args.local_db:
+        local_db = LocalDatabase(args.local_db, schema=config.SCHEMA)
+        connect, data_version = local_db.connect, local_db.data_version
+    else:
+        connect, data_version = connect_to_db, config.RESULT_CACHE_DATA_VERSION
+    connection_pool = ConnectionPool(
+        connect, max_idle_connections=args.execution_workers
+    )
+    tool = nlq2SqlTool(config, connect=connection_pool.connect)
+    if tool.result_cache is not None:
+        tool.result_cache.set_data_version(data_version)
+
+    # Outputs of the ground-truth queries, reused across evaluation runs of the same data version
+    gt_cache = ResultCache(
+        data_version=data_version,
+        ttl_seconds=None,
+        cache_dir=osp.join(DATA_DIR, "ground_truth_cache"),
+    )
 
-    user = input("Enter Redshift Database Username: ")
-    password = getpass.getpass(prompt="Enter Redshift Datbase Password: ")
+    if args.local_db:
+        user, password = "local", ""
+    else:
+        user = input("Enter Redshift Database Username: ")
+        password = getpass.getpass(prompt="Enter Redshift Datbase Password: ")
 
     tool.set_db_credentials(user, password)
 
-    val_df = inference_wrapper(val_df, MODEL_PATH, tool, query2args)
+    val_df = inference_wrapper(
+        val_df,
+        MODEL_PATH,
+        tool,
+        query2args,
+        device=args.device,
+        # CPU predictions are saved as they are decoded, an interrupted run resumes from them
+        predictions_path=osp.join(inference_folder, "validation_predictions.jsonl"),
+        num_processes=args.num_processes,
+        gt_cache=gt_cache,
+        execution_workers=args.execution_workers,
+        execution_timeout_seconds=args.execution_timeout,
+    )
 
     # Save the results
     print(f"Saving the results to {inference_validation_out}...")
@@ -226,7 +454,18 @@ if __name__ == "__main__":
     print(f"Reading {DATA_PATH}...")
     test_df = pd.read_csv(DATA_PATH)
 
-    test_df = inference_wrapper(test_df, MODEL_PATH, tool, query2args)
+    test_df = inference_wrapper(
+        test_df,
+        MODEL_PATH,
+        tool,
+        query2args,
+        device=args.device,
+        predictions_path=osp.join(inference_folder, "test_predictions.jsonl"),
+        num_processes=args.num_processes,
+        gt_cache=gt_cache,
+        execution_workers=args.execution_workers,
+        execution_timeout_seconds=args.execution_timeout,
+    )
 
     # Save the results
     print(f"Saving the results to {inference_test_out}...")
@@ -248,3 +487,5 @@ if __name__ == "__main__":
     ]
     metrics_df = pd.DataFrame(metrics_df_info)
     metrics_df.to_csv(metric_path, index=False)
+
+    connection_pool.close()
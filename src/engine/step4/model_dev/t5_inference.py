@@ -14,15 +14,132 @@ import argparse
 from utils.model import T5FineTuner, load_model
 import torch
 
+from constrained_decoding import TemplateTrie
+
 PAD_P = re.compile("<pad> |</s>")
 
+# Decoding settings used when none are given (the tool gives `config.DECODING_PARAMS`).
+DEFAULT_DECODING_PARAMS = {
+    "num_beams": 2,
+    "repetition_penalty": 2.5,
+    "length_penalty": 1.0,
+    "max_length": None,
+}
+
+
+def get_decoding_kwargs(model, decoding_params=None):
+    """Arguments of `model.generate` for decoding settings.
+
+    Args:
+        model (T5FineTuner): Trained model.
+        decoding_params (dict): Decoding settings (see `config.DECODING_PARAMS`). Default to None for `DEFAULT_DECODING_PARAMS`.
+
+    Returns:
+        dict: Decoding arguments. A "max_length" of None is replaced by the maximum output length of the model.
+    """
+    kwargs = dict(
+        DEFAULT_DECODING_PARAMS if decoding_params is None else decoding_params
+    )
+    if kwargs.get("max_length") is None:
+        kwargs["max_length"] = model.hparams.max_output_length
+    return kwargs
+
+
+def generate_query_ids(
+    model, questions, max_time=None, decoding_params=None, template_trie=None
+):
+    """Generates the token ids of the general SQL queries of a batch of general NLQs.
+
+    The batch is only padded to its longest question, so batches of questions of similar lengths are faster.
+
+    Args:
+        model (T5FineTuner): Trained model.
+        questions (list): General Natural Language question texts.
+        max_time (float): Seconds after which the generation is stopped. Default to None for no limit.
+        decoding_params (dict): Decoding settings. Default to None for `DEFAULT_DECODING_PARAMS`.
+        template_trie (TemplateTrie): Known templates the outputs are constrained to. Default to None for unconstrained decoding.
+
+    Returns:
+        torch.Tensor: Generated token ids (one row per question, padded to the longest), on CPU.
+    """
+    input_texts = ["translate English to SQL: %s" % question for question in questions]
+
+    features = model.tokenizer.batch_encode_plus(
+        input_texts,
+        max_length=model.hparams.max_input_length,
+        padding="longest",
+        truncation=True,
+        return_tensors="pt",
+    ).to(model.device)
+
+    kwargs = get_decoding_kwargs(model, decoding_params)
+    if template_trie is not None:
+        kwargs["prefix_allowed_tokens_fn"] = template_trie.prefix_allowed_tokens_fn
+
+    with torch.no_grad():
+        output = model.model.generate(
+            input_ids=features["input_ids"],
+            attention_mask=features["attention_mask"],
+            max_time=max_time,
+            **kwargs,
+        )
+    return output.cpu()
+
+
+def decode_queries(model, output, template_trie=None):
+    """Decodes generated token ids to general SQL queries.
+
+    Args:
+        model (T5FineTuner): Trained model.
+        output (torch.Tensor): Generated token ids (see `generate_query_ids`).
+        template_trie (TemplateTrie): Known templates the outputs were constrained to. Default to None.
+
+    Returns:
+        list: Generic SQL Queries.
+    """
+    queries = []
+    for ids, sql in zip(output.tolist(), model.tokenizer.batch_decode(output)):
+        # constrained outputs stop once the template is unique: it's completed from the trie
+        template = None if template_trie is None else template_trie.complete(ids[1:])
+        if template is not None:
+            queries.append(template)
+            continue
+
+        # generic sql post-processing (shorter outputs are padded up to the longest)
+        sql = re.sub(PAD_P, "", sql).replace("<pad>", "")
+        queries.append(sql.replace("[", "<").replace("]", ">").strip())
+    return queries
+
+
+def generate_queries(
+    model, questions, max_time=None, decoding_params=None, template_trie=None
+):
+    """Maps a batch of general NLQs to general SQL queries.
+
+    Args:
+        model (T5FineTuner): Trained model.
+        questions (list): General Natural Language question texts.
+        max_time (float): Seconds after which the generation is stopped. Default to None for no limit.
+        decoding_params (dict): Decoding settings. Default to None for `DEFAULT_DECODING_PARAMS`.
+        template_trie (TemplateTrie): Known templates the outputs are constrained to. Default to None for unconstrained decoding.
+
+    Returns:
+        list: Generic SQL Queries, in the order of the questions.
+    """
+    output = generate_query_ids(
+        model, questions, max_time, decoding_params, template_trie
+    )
+    return decode_queries(model, output, template_trie)
+
 
 class Inferencer(object):
-    def __init__(self, model_path):
+    def __init__(self, model_path, decoding_params=None, templates=None):
         """Initialize model and tokenizer base on a pkl filepath.
 
         Args:
             model_path (str): Absolute path to the stored model.
+            decoding_params (dict): Decoding settings. Default to None for `DEFAULT_DECODING_PARAMS`.
+            templates (list): Known generic SQL templates the outputs are constrained to. Default to None for unconstrained decoding.
 
         Returns:
             str: None
@@ -30,12 +147,17 @@ class Inferencer(object):
         """
         self.model = load_model(model_path)
         self.tokenizer = self.model.tokenizer
+        self.decoding_params = decoding_params
+        self.template_trie = None
+        if templates:
+            self.template_trie = TemplateTrie(self.model, templates)
 
-    def __call__(self, input_text):
+    def __call__(self, input_text, max_time=None):
         """Maps a general NLQ (with placeholders) to a general SQL query (with placeholders)
 
         Args:
             input_text (str): General Natural Language question text.
+            max_time (float): Seconds after which the generation is stopped (the output is then incomplete). Default to None for no limit.
 
         Returns:
             str: Generic SQL Query.
@@ -50,15 +172,24 @@ class Inferencer(object):
             return_tensors="pt",
         )
 
+        kwargs = get_decoding_kwargs(self.model, self.decoding_params)
+        if self.template_trie is not None:
+            allowed_tokens_fn = self.template_trie.prefix_allowed_tokens_fn
+            kwargs["prefix_allowed_tokens_fn"] = allowed_tokens_fn
+
         output = self.model.model.generate(
             input_ids=features["input_ids"],
             attention_mask=features["attention_mask"],
-            max_length=self.model.hparams.max_output_length,
-            num_beams=2,
-            repetition_penalty=2.5,
-            length_penalty=1.0,
+            max_time=max_time,
+            **kwargs,
         )
 
+        if self.template_trie is not None:
+            # the decoding stops once the template is unique
+            template = self.template_trie.complete(output[0, 1:].tolist())
+            if template is not None:
+                return template
+
         output = self.tokenizer.decode(output[0])
 
         # generic sql post-processing
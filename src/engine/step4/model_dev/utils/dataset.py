@@ -5,9 +5,6 @@ The module implements a custom dataset class to prepare it for model training.
 import os
 import json
 import pandas as pd
-from sklearn.model_selection import train_test_split
-from nlp import load_dataset
-from transformers import T5Tokenizer
 from torch.utils.data import Dataset
 
 
@@ -23,7 +20,7 @@ class NL2SQLDataset(Dataset):
         input_length: int,
         output_length: int,
         num_samples: int = None,
-        tokenizer=T5Tokenizer.from_pretrained("t5-small"),
+        tokenizer=None,
     ) -> None:
         """
         It initialize the class object.
@@ -34,8 +31,14 @@ class NL2SQLDataset(Dataset):
             input_length(int): Input sequence length of the model to be fine-tuned.
             output_length(int): Output sequence length of the model.
             num_samples(int): Number of samples used to create the dataset or all. Defaults to None for all.
-            tokenizer(T5Tokenizer): Pretrained Tokenizer to be loaded.
+            tokenizer(T5Tokenizer): Pretrained Tokenizer to be loaded. Defaults to None for the "t5-small" tokenizer.
         """
+        from nlp import load_dataset
+
+        if tokenizer is None:
+            from transformers import T5Tokenizer
+
+            tokenizer = T5Tokenizer.from_pretrained("t5-small")
 
         data_path = os.path.join(data_dir, f"{data_split}.csv")
         self.dataset = load_dataset("csv", data_files={data_split: data_path})
@@ -181,6 +184,8 @@ def split_data(csv_path, output_dir, val_size=0.1, test_size=0.1):
         Tuple of train, validation and test dataframes.
     """
 
+    from sklearn.model_selection import train_test_split
+
     # Load data
     df = pd.read_csv(csv_path)
 
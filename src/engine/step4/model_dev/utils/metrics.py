@@ -8,11 +8,42 @@ The module contains util functions to compute the metrics of a trained model.
 """
 
 import json
+import time
+import logging
 import numpy as np
 import pandas as pd
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 
+from deadline import Deadline
+from step6.result_fingerprint import results_match
 
-def execute_matching(tool, row, entities):
+logger = logging.getLogger(__name__)
+
+
+def execute_ground_truth(tool, sql_query, gt_cache=None):
+    """
+    Execute a rendered ground-truth query, unless its output is cached. It runs without the tool's execution time budget.
+
+    Args:
+        tool(nlq2SqlTool): Tool with the function for the query to be executed.
+        sql_query(str): Rendered ground-truth query.
+        gt_cache(ResultCache): Cache of the ground-truth outputs, keyed by the rendered query and the data version. Default to None for no caching.
+
+    Returns:
+        Pandas dataframe with the query output. None if the query failed.
+    """
+    if gt_cache is not None:
+        output = gt_cache.get(sql_query)
+        if output is not None:
+            return output
+
+    output = tool.execute_sql_query(sql_query, step_budget=False)
+    if gt_cache is not None and output is not None:
+        gt_cache.put(sql_query, output)
+    return output
+
+
+def execute_matching(tool, row, entities, gt_cache=None, timeout_seconds=None):
     """
     Execute the true and predicted query of a give row.
 
@@ -20,6 +51,8 @@ def execute_matching(tool, row, entities):
         tool(nlq2SqlTool):  Tool with the functions for the query is be rendered and executed.
         row: Row for a single query.
         entities(dict): Dictionary of specific values for the query arguments.
+        gt_cache(ResultCache): Cache of the ground-truth outputs. Default to None for no caching.
+        timeout_seconds(float): Timeout of the predicted query execution (it then counts as failed). Default to None for the tool's execution time budget.
 
     Returns:
         True if the inferred query can be executed and returns the same as the true query. Otherwise, returns False.
@@ -31,36 +64,43 @@ def execute_matching(tool, row, entities):
     pred_query = row["preds_wiki"]
     indx = int(row.name) + 1
 
+    # Same template: same output, nothing to execute
+    if true_query == pred_query:
+        return 1.0
+
     # Render & execute targets
     true_sql_query = tool.render_template_query(true_query, entities)
-    true_output = tool.execute_sql_query(true_sql_query)
-    #     print(true_output.iloc[:5])
 
     # Render & execute predictions
     try:
         pred_sql_query = tool.render_template_query(pred_query, entities)
-        pred_output = tool.execute_sql_query(pred_sql_query)
+        if pred_sql_query == true_sql_query:
+            return 1.0
+        pred_output = tool.execute_sql_query(
+            pred_sql_query, deadline=Deadline(timeout_seconds)
+        )
     except:
         pred_output = None
 
-    if pred_output is not None:
-        # Fix the reordering of the output columns
-        true_columns = true_output.columns.tolist()
-        pred_columns = pred_output.columns.tolist()
-
-        if set(true_columns) == set(pred_columns):
-            pred_output = pred_output[true_columns]
-
     if pred_output is None:
         return 0
 
-    true_first_c = true_output.columns[0]
-    pred_first_c = pred_output.columns[0]
+    true_output = execute_ground_truth(tool, true_sql_query, gt_cache)
+    if true_output is None:
+        logger.warning(
+            "Ground-truth query of row %d failed to execute: counted as failed.", indx
+        )
+        return 0.0
+
+    # Fix the reordering of the output columns
+    true_columns = true_output.columns.tolist()
+    pred_columns = pred_output.columns.tolist()
 
-    true_output0 = true_output.sort_values(by=true_first_c).values
-    pred_output0 = pred_output.sort_values(by=pred_first_c).values
+    if set(true_columns) == set(pred_columns):
+        pred_output = pred_output[true_columns]
 
-    if true_query == pred_query or np.array_equal(true_output0, pred_output0):
+    # Same rows in any order
+    if results_match(true_output, pred_output):
         return 1.0
     else:
         return 0.0
@@ -85,6 +125,12 @@ def exact_matching(row, column):
 
 
 ## Correct GT Query
+# Corrected ground-truth query templates (value) by wrong template (key).
+GT_QUERY_CORRECTIONS = {
+    "SELECT race, ethnicity, COUNT( DISTINCT pe1.person_id) FROM ((<SCHEMA>.person pe1 JOIN <RACE-TEMPLATE> ON pe1.race_concept_id=concept_id) JOIN <ETHNICITY-TEMPLATE> eth_temp1 ON pe1.gender_concept_id=eth_temp1.concept_id ) GROUP BY race, ethnicity ;": "SELECT race, ethnicity, COUNT( DISTINCT pe1.person_id) FROM ((<SCHEMA>.person pe1 JOIN <RACE-TEMPLATE> ON pe1.race_concept_id=concept_id) JOIN <ETHNICITY-TEMPLATE> eth_temp1 ON pe1.ethnicity_concept_id=eth_temp1.concept_id ) GROUP BY race, ethnicity ;",
+}
+
+
 def correct_gt_query(df):
     """
     Correct ground-truth query template.
@@ -96,15 +142,100 @@ def correct_gt_query(df):
         Pandas DataFrame with the corrected queries.
     """
 
-    old_query = "SELECT race, ethnicity, COUNT( DISTINCT pe1.person_id) FROM ((<SCHEMA>.person pe1 JOIN <RACE-TEMPLATE> ON pe1.race_concept_id=concept_id) JOIN <ETHNICITY-TEMPLATE> eth_temp1 ON pe1.gender_concept_id=eth_temp1.concept_id ) GROUP BY race, ethnicity ;"
-    corrected_query = "SELECT race, ethnicity, COUNT( DISTINCT pe1.person_id) FROM ((<SCHEMA>.person pe1 JOIN <RACE-TEMPLATE> ON pe1.race_concept_id=concept_id) JOIN <ETHNICITY-TEMPLATE> eth_temp1 ON pe1.ethnicity_concept_id=eth_temp1.concept_id ) GROUP BY race, ethnicity ;"
     queries = df["query"].values.tolist()
-    queries = [corrected_query if qry == old_query else qry for qry in queries]
+    queries = [GT_QUERY_CORRECTIONS.get(qry, qry) for qry in queries]
     df["query"] = queries
     return df
 
 
-def get_metrics(tool, df, query2args_dict):
+def format_progress(n_done, total, elapsed):
+    """
+    Progress message with the throughput and the estimated time left.
+
+    Args:
+        n_done(int): Number of rows done.
+        total(int): Total number of rows.
+        elapsed(float): Seconds since the start.
+
+    Returns:
+        Progress message.
+    """
+    rate = n_done / elapsed if elapsed > 0 else 0.0
+    eta = (total - n_done) / rate if rate > 0 else float("nan")
+    return f"Executed {n_done}/{total} ({rate:.2f} rows/s, ETA {eta:.0f}s)"
+
+
+def get_execution_matches(
+    tool,
+    df,
+    query2args_dict,
+    gt_cache=None,
+    max_workers=8,
+    timeout_seconds=None,
+    report_every_seconds=10.0,
+):
+    """
+    Computes the execution accuracy of each row concurrently (`max_workers` rows at a time).
+
+    Args:
+        tool(nlq2SqlTool): Tool with the functions for the query is be rendered and executed. Shared by the workers.
+        df(pd.DataFrame): Pandas dataframe where the input and inferred queries are stored.
+        query2args_dict(dict): Dictionary of default arguments for the queries.
+        gt_cache(ResultCache): Cache of the ground-truth outputs. Default to None for no caching.
+        max_workers(int): Number of rows executed concurrently.
+        timeout_seconds(float): Timeout of each predicted query execution. Default to None for the tool's execution time budget.
+        report_every_seconds(float): Seconds between progress messages.
+
+    Returns:
+        List of the execution accuracies, in the order of the rows.
+    """
+    total = df.shape[0]
+    exec_matches = [None] * total
+    n_done = 0
+    in_flight = {}
+    start = last_report = time.perf_counter()
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+
+        def collect(futures):
+            nonlocal n_done, last_report
+            for future in futures:
+                i = in_flight.pop(future)
+                try:
+                    exec_matches[i] = future.result()
+                except Exception:
+                    logger.exception(
+                        "Execution matching of row %d failed: counted as failed.", i + 1
+                    )
+                    exec_matches[i] = 0.0
+                n_done += 1
+
+            now = time.perf_counter()
+            if now - last_report >= report_every_seconds or n_done == total:
+                print(format_progress(n_done, total, now - start))
+                last_report = now
+
+        for i, (_, row) in enumerate(df.iterrows()):
+            if len(in_flight) >= 2 * max_workers:
+                completed, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                collect(completed)
+
+            entities = query2args_dict.get(row["query"], query2args_dict["default"])
+            future = executor.submit(
+                execute_matching, tool, row, entities, gt_cache, timeout_seconds
+            )
+            in_flight[future] = i
+
+        while in_flight:
+            completed, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            collect(completed)
+
+    return exec_matches
+
+
+def get_metrics(
+    tool, df, query2args_dict, gt_cache=None, max_workers=8, timeout_seconds=None
+):
     """
     Computes the exact matching and execution accuracies for each inferred query.
 
@@ -112,6 +243,9 @@ def get_metrics(tool, df, query2args_dict):
         tool(nlq2SqlTool): Tool with the functions for the query is be rendered and executed.
         df(pd.DataFrame): Pandas dataframe where the input and inferred queries are stored.
         query2args_dict(dict): Dictionary of default arguments for the queries.
+        gt_cache(ResultCache): Cache of the ground-truth outputs, reused across rows (and runs if on disk). Default to None for no caching.
+        max_workers(int): Number of rows executed concurrently.
+        timeout_seconds(float): Timeout of each predicted query execution. Default to None for the tool's execution time budget.
 
     Returns:
         Pandas dataframe with the calculated accuracies.
@@ -122,17 +256,15 @@ def get_metrics(tool, df, query2args_dict):
     df0 = df.drop_duplicates(
         subset=["base_question", "query", "preds_wiki"], inplace=False
     ).reset_index(drop=True)
-    exec_match_wiki = []
-    for i, (_, row) in enumerate(df0.iterrows()):
-        if i % 10 == 0:
-            print(f"Executing {i}/{df0.shape[0]}...")
-        exec_match_wiki.append(
-            execute_matching(
-                tool, row, query2args_dict.get(row["query"], query2args_dict["default"])
-            )
-        )
 
-    df0["exec_match_wiki"] = exec_match_wiki
+    df0["exec_match_wiki"] = get_execution_matches(
+        tool,
+        df0,
+        query2args_dict,
+        gt_cache=gt_cache,
+        max_workers=max_workers,
+        timeout_seconds=timeout_seconds,
+    )
 
     columns = ["base_question", "query", "preds_wiki", "exec_match_wiki"]
     df1 = df0[columns]
@@ -9,7 +9,6 @@ import argparse
 import time
 import torch
 import numpy as np
-from nlp import load_metric
 import pytorch_lightning as pl
 from torch.utils.data import DataLoader
 from typing import Callable, Dict, Iterable, List, Tuple, Union
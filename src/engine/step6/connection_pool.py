@@ -0,0 +1,135 @@
+"""
+Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+
+SPDX-License-Identifier: CC-BY-NC-4.0
+"""
+
+# This module contains a pool of database connections, keyed by the connection parameters & credentials.
+# `ConnectionPool(connect_to_db).connect` has the signature of `connect_to_db`, so it can be given to the
+# tool (`nlq2SqlTool(config, connect=pool.connect)`): closing a pooled connection rolls back its
+# transaction (and the statement timeout set in it) and keeps it for the next call instead of closing it.
+
+import logging
+import threading
+from collections import defaultdict
+
+logger = logging.getLogger(__name__)
+
+
+class PooledConnection(object):
+    def __init__(self, pool, key, conn):
+        """Connection borrowed from a pool. Returned to the pool when closed.
+
+        Args:
+            pool (ConnectionPool): Pool of the connection.
+            key (tuple): Key of the connection in the pool.
+            conn (Connection): Database connection.
+
+        Returns:
+            None
+
+        """
+        self._pool = pool
+        self._key = key
+        self._conn = conn
+
+    def cursor(self):
+        return self._conn.cursor()
+
+    def cancel(self):
+        self._conn.cancel()
+
+    def close(self):
+        if self._conn is not None:
+            conn, self._conn = self._conn, None
+            self._pool._release(self._key, conn)
+
+
+class ConnectionPool(object):
+    def __init__(self, connect, max_idle_connections=8):
+        """Initialize an empty connection pool.
+
+        Args:
+            connect (callable): Opens a connection, with the signature of `connect_to_db`.
+            max_idle_connections (int): Maximum number of connections kept open per key. Connections returned over it are closed.
+
+        Returns:
+            None
+
+        """
+        self._connect = connect
+        self.max_idle_connections = max_idle_connections
+        self._lock = threading.Lock()
+        self._idle = defaultdict(list)
+
+    def connect(self, redshift_parameters, user, password, connect_timeout=None):
+        """Borrow an idle connection, or open a new one.
+
+        Args:
+            redshift_parameters (dict): Redshift connection parameters.
+            user (str): Redshift user required to connect.
+            password (str): Password associated to the user
+            connect_timeout (int): Seconds to wait for a new connection. Default to None for no timeout.
+
+        Returns:
+            PooledConnection: Connection to close after use. None if it can't be opened.
+
+        """
+        key = (tuple(sorted(redshift_parameters.items())), user, password)
+        with self._lock:
+            conn = self._idle[key].pop() if self._idle[key] else None
+
+        if conn is None:
+            conn = self._connect(
+                redshift_parameters, user, password, connect_timeout=connect_timeout
+            )
+            if conn is None:
+                return None
+        return PooledConnection(self, key, conn)
+
+    def _release(self, key, conn):
+        """Keep a returned connection if it's still usable and the pool isn't full."""
+        try:
+            # ends the transaction of the call, aborted or not
+            if getattr(conn, "closed", False):
+                return
+            if hasattr(conn, "rollback"):
+                conn.rollback()
+        except Exception:
+            logger.warning("Discarding a pooled connection that can't be rolled back.")
+            self._close(conn)
+            return
+
+        with self._lock:
+            if len(self._idle[key]) < self.max_idle_connections:
+                self._idle[key].append(conn)
+                return
+        self._close(conn)
+
+    @staticmethod
+    def _close(conn):
+        try:
+            conn.close()
+        except Exception:
+            pass
+
+    def close(self):
+        """Close all the idle connections.
+
+        Args:
+            None
+
+        Returns:
+            None
+
+        """
+        with self._lock:
+            connections = [conn for idle in self._idle.values() for conn in idle]
+            self._idle.clear()
+        for conn in connections:
+            self._close(conn)
+
+    def __len__(self):
+        """Number of idle connections."""
+        with self._lock:
+            return sum(len(idle) for idle in self._idle.values())
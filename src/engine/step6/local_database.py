@@ -0,0 +1,743 @@
+"""
+Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+
+SPDX-License-Identifier: CC-BY-NC-4.0
+"""
+
+# This module contains a local (embedded SQLite) execution backend to run the rendered SQL queries offline,
+# e.g. for latency & accuracy runs without Amazon Redshift. `LocalDatabase(path).connect` has the signature of
+# `connect_to_db` and can be given to the tool (`nlq2SqlTool(config, connect=db.connect)`).
+# The database file is attached under the schema name (`config.SCHEMA`), so `<schema>.person` resolves, and the
+# Redshift functions used by the queries (DATEDIFF, GREATEST, LEAST) are registered on each connection.
+# `create_fixture_database` writes a small synthetic OMOP CDM database whose drugs & conditions are the ones
+# known by the stand-in Comprehend Medical client (engine/stand_ins.py).
+# `--check-gt-templates` renders the corrected ground-truth templates (utils/metrics.py) and checks that they
+# execute on the database.
+#
+# Usage:
+#     python src/engine/step6/local_database.py --output omop_fixture.sqlite --persons 10000
+#     python src/engine/step6/local_database.py --output omop_fixture.sqlite --check-gt-templates
+
+import re
+import sys
+import json
+import time
+import random
+import sqlite3
+import itertools
+import argparse
+import datetime
+from os import path as osp
+from urllib.request import pathname2url
+
+# Tables of the fixture (subset of the OMOP CDM v5.3 columns).
+OMOP_TABLES = {
+    "person": (
+        "person_id INTEGER PRIMARY KEY, gender_concept_id INTEGER, year_of_birth INTEGER, "
+        "month_of_birth INTEGER, day_of_birth INTEGER, birth_datetime TEXT, race_concept_id INTEGER, "
+        "ethnicity_concept_id INTEGER, location_id INTEGER, gender_source_value TEXT, "
+        "race_source_value TEXT, ethnicity_source_value TEXT"
+    ),
+    "concept": (
+        "concept_id INTEGER PRIMARY KEY, concept_name TEXT, domain_id TEXT, vocabulary_id TEXT, "
+        "concept_class_id TEXT, standard_concept TEXT, concept_code TEXT, valid_start_date TEXT, "
+        "valid_end_date TEXT, invalid_reason TEXT"
+    ),
+    "concept_relationship": (
+        "concept_id_1 INTEGER, concept_id_2 INTEGER, relationship_id TEXT, valid_start_date TEXT, "
+        "valid_end_date TEXT, invalid_reason TEXT"
+    ),
+    "concept_ancestor": (
+        "ancestor_concept_id INTEGER, descendant_concept_id INTEGER, "
+        "min_levels_of_separation INTEGER, max_levels_of_separation INTEGER"
+    ),
+    "location": (
+        "location_id INTEGER PRIMARY KEY, address_1 TEXT, city TEXT, state TEXT, zip TEXT, county TEXT"
+    ),
+    "visit_occurrence": (
+        "visit_occurrence_id INTEGER PRIMARY KEY, person_id INTEGER, visit_concept_id INTEGER, "
+        "visit_start_date TEXT, visit_end_date TEXT, visit_type_concept_id INTEGER"
+    ),
+    "condition_occurrence": (
+        "condition_occurrence_id INTEGER PRIMARY KEY, person_id INTEGER, condition_concept_id INTEGER, "
+        "condition_start_date TEXT, condition_end_date TEXT, condition_type_concept_id INTEGER, "
+        "visit_occurrence_id INTEGER"
+    ),
+    "drug_exposure": (
+        "drug_exposure_id INTEGER PRIMARY KEY, person_id INTEGER, drug_concept_id INTEGER, "
+        "drug_exposure_start_date TEXT, drug_exposure_end_date TEXT, days_supply INTEGER, "
+        "quantity REAL, drug_type_concept_id INTEGER, visit_occurrence_id INTEGER"
+    ),
+    "observation_period": (
+        "observation_period_id INTEGER PRIMARY KEY, person_id INTEGER, "
+        "observation_period_start_date TEXT, observation_period_end_date TEXT"
+    ),
+    "death": "person_id INTEGER PRIMARY KEY, death_date TEXT, cause_concept_id INTEGER",
+}
+
+INDEXES = (
+    ("concept", "concept_code"),
+    ("concept", "concept_name"),
+    ("concept_relationship", "concept_id_1"),
+    ("concept_ancestor", "ancestor_concept_id"),
+    ("condition_occurrence", "person_id"),
+    ("condition_occurrence", "condition_concept_id"),
+    ("drug_exposure", "person_id"),
+    ("drug_exposure", "drug_concept_id"),
+    ("visit_occurrence", "person_id"),
+)
+
+# Demographic & visit concepts: (concept_id, concept_name, domain_id).
+DEMOGRAPHIC_CONCEPTS = (
+    (8507, "MALE", "Gender"),
+    (8532, "FEMALE", "Gender"),
+    (8516, "Black or African American", "Race"),
+    (8527, "White", "Race"),
+    (8515, "Asian", "Race"),
+    (38003563, "Hispanic or Latino", "Ethnicity"),
+    (38003564, "Not Hispanic or Latino", "Ethnicity"),
+    (9201, "Inpatient Visit", "Visit"),
+    (9202, "Outpatient Visit", "Visit"),
+)
+
+STATE_PATTERNS_PATH = osp.join(
+    osp.dirname(osp.abspath(__file__)), "..", "step2", "state2pattern.json"
+)
+
+FIXTURE_START_DATE = datetime.date(2008, 1, 1)
+FIXTURE_DAYS = 3 * 365
+
+DATE_PARTS = {
+    "day": "day",
+    "days": "day",
+    "d": "day",
+    "week": "week",
+    "weeks": "week",
+    "w": "week",
+    "month": "month",
+    "months": "month",
+    "mon": "month",
+    "year": "year",
+    "years": "year",
+    "y": "year",
+    "yr": "year",
+}
+
+# Redshift's DATEDIFF takes the date part as a keyword (e.g. DATEDIFF(day, start, end)): quoted for SQLite.
+DATEDIFF_P = re.compile(r"(?i)\bDATEDIFF\s*\(\s*([a-z]+)\s*,")
+
+# Joined subqueries & the end of their join condition (clause keyword or closing parenthesis at the same level).
+JOIN_SUBQUERY_P = re.compile(r"(?i)\bJOIN\s*\(")
+JOIN_CONDITION_P = re.compile(r"(?i)\s*ON\b")
+CLAUSE_KEYWORD_P = re.compile(
+    r"(?i)\b(?:JOIN|INNER|LEFT|RIGHT|FULL|CROSS|WHERE|GROUP|HAVING|ORDER|LIMIT|UNION)\b"
+)
+SELECT_LIST_P = re.compile(r"(?i)\s*SELECT\s+(?:DISTINCT\s+)?")
+FROM_P = re.compile(r"(?i)\bFROM\b")
+COLUMN_NAME_P = re.compile(r"(?i)(?:\bAS\s+)?\"?(\w+)\"?\s*$")
+IDENTIFIER_P = re.compile(r"(?<![\w.])([A-Za-z_]\w*)(?![\w.(])")
+STRING_LITERAL_P = re.compile(r"('(?:[^']|'')*')")
+
+
+def _to_date(value):
+    if isinstance(value, datetime.date):
+        return value
+    return datetime.date.fromisoformat(str(value)[:10])
+
+
+def datediff(part, start, end):
+    """Redshift's DATEDIFF: number of `part` boundaries crossed from `start` to `end`."""
+    if part is None or start is None or end is None:
+        return None
+    part = DATE_PARTS.get(part.lower())
+    if part is None:
+        raise ValueError("Unsupported DATEDIFF date part.")
+    start, end = _to_date(start), _to_date(end)
+    if part == "day":
+        return (end - start).days
+    if part == "week":
+        # weeks start on Monday
+        return (
+            (end - datetime.timedelta(days=end.weekday()))
+            - (start - datetime.timedelta(days=start.weekday()))
+        ).days // 7
+    if part == "month":
+        return (end.year - start.year) * 12 + end.month - start.month
+    return end.year - start.year
+
+
+def greatest(*values):
+    """Redshift's GREATEST: largest value, ignoring NULLs."""
+    values = [value for value in values if value is not None]
+    return max(values) if values else None
+
+
+def least(*values):
+    """Redshift's LEAST: smallest value, ignoring NULLs."""
+    values = [value for value in values if value is not None]
+    return min(values) if values else None
+
+
+def _iter_top_level(query, start):
+    """Positions of the characters of `query` from `start` outside string literals, with their parenthesis depth."""
+    depth, in_string = 0, False
+    for i in range(start, len(query)):
+        char = query[i]
+        if char == "'":
+            in_string = not in_string
+        elif in_string:
+            continue
+        elif char == "(":
+            depth += 1
+        elif char == ")":
+            depth -= 1
+        yield i, depth
+
+
+def _find_closing_parenthesis(query, start):
+    """Position of the parenthesis closing the one at `start`. None if it isn't closed."""
+    for i, depth in _iter_top_level(query, start):
+        if depth == 0:
+            return i
+    return None
+
+
+def _find_condition_end(query, start):
+    """End of a join condition starting at `start`."""
+    for i, depth in _iter_top_level(query, start):
+        if depth < 0 or (depth == 0 and CLAUSE_KEYWORD_P.match(query, i)):
+            return i
+    return len(query)
+
+
+def _split_top_level(text):
+    """Split `text` on the commas outside parentheses & string literals."""
+    items, start = [], 0
+    for i, depth in _iter_top_level(text, 0):
+        if depth == 0 and text[i] == ",":
+            items.append(text[start:i])
+            start = i + 1
+    items.append(text[start:])
+    return items
+
+
+def _get_output_columns(subquery):
+    """Lower-case names of the columns selected by a subquery (empty if they can't be listed)."""
+    match = SELECT_LIST_P.match(subquery)
+    if match is None:
+        return set()
+    end = len(subquery)
+    for i, depth in _iter_top_level(subquery, match.end()):
+        if depth == 0 and FROM_P.match(subquery, i):
+            end = i
+            break
+    columns = set()
+    for item in _split_top_level(subquery[match.end() : end]):
+        name = COLUMN_NAME_P.search(item.strip())
+        if name is not None:
+            columns.add(name.group(1).lower())
+    return columns
+
+
+def _qualify_columns(condition, columns, alias):
+    """Prefix the unqualified references to `columns` in a join condition with `alias`."""
+    parts = STRING_LITERAL_P.split(condition)
+    for i in range(0, len(parts), 2):
+        parts[i] = IDENTIFIER_P.sub(
+            lambda match: (
+                f"{alias}.{match.group(1)}"
+                if match.group(1).lower() in columns
+                else match.group(1)
+            ),
+            parts[i],
+        )
+    return "".join(parts)
+
+
+def _alias_joined_subqueries(query, aliases):
+    """Alias the unaliased joined subqueries and qualify the references to their columns in their join condition.
+
+    Redshift resolves the unqualified columns of a join condition among the tables joined so far, and SQLite
+    among all the tables of the FROM clause: a column of an unaliased subquery is then ambiguous if a table
+    joined later has the same column (e.g. `concept_id` in the race & ethnicity templates).
+
+    Args:
+        query (str): SQL query.
+        aliases (iterator): Numbers of the generated aliases (shared by the nested subqueries).
+
+    Returns:
+        str: SQL query.
+
+    """
+    out, pos = [], 0
+    for match in JOIN_SUBQUERY_P.finditer(query):
+        # already rewritten, or in a string literal
+        if match.start() < pos or query.count("'", 0, match.start()) % 2:
+            continue
+        open_at = match.end() - 1
+        close_at = _find_closing_parenthesis(query, open_at)
+        if close_at is None:
+            break
+        condition = JOIN_CONDITION_P.match(query, close_at + 1)
+        if condition is None:
+            continue
+
+        alias = f"_subquery{next(aliases)}"
+        subquery = query[open_at + 1 : close_at]
+        condition_end = _find_condition_end(query, condition.end())
+        out.append(query[pos : open_at + 1])
+        out.append(_alias_joined_subqueries(subquery, aliases))
+        out.append(f") {alias}{query[close_at + 1 : condition.end()]}")
+        out.append(
+            _qualify_columns(
+                query[condition.end() : condition_end],
+                _get_output_columns(subquery),
+                alias,
+            )
+        )
+        pos = condition_end
+    out.append(query[pos:])
+    return "".join(out)
+
+
+def translate_query(query):
+    """Rewrite the Redshift syntax & name resolution not supported by SQLite.
+
+    Args:
+        query (str): Redshift SQL query.
+
+    Returns:
+        str: SQLite SQL query.
+
+    """
+    query = _alias_joined_subqueries(query, itertools.count(1))
+    return DATEDIFF_P.sub(lambda match: f"DATEDIFF('{match.group(1)}',", query)
+
+
+class LocalCursor(object):
+    def __init__(self, connection):
+        self._connection = connection
+        self._cursor = connection._conn.cursor()
+
+    @property
+    def description(self):
+        return self._cursor.description
+
+    def execute(self, query):
+        match = re.match(r"(?i)\s*SET\s+statement_timeout\s+TO\s+(\d+)", query)
+        if match:
+            self._connection._timeout_seconds = int(match.group(1)) / 1000
+            return
+        if re.match(r"(?i)\s*SET\s", query):
+            return
+
+        self._connection._start_query()
+        try:
+            self._cursor.execute(translate_query(query))
+        except sqlite3.OperationalError as e:
+            if str(e) == "interrupted":
+                # same error as for the cancelled queries of other backends without their own
+                from step6.query_execution import QueryCanceledError
+
+                raise QueryCanceledError(
+                    "canceling statement due to user request"
+                ) from e
+            raise
+        finally:
+            self._connection._end_query()
+
+    def fetchall(self):
+        return self._cursor.fetchall()
+
+
+class LocalConnection(object):
+    def __init__(self, database_path, schema):
+        """Connection to the local database, attached as `schema`.
+
+        Args:
+            database_path (str): Path to the SQLite database file (opened read-only).
+            schema (str): Schema name of the tables in the queries.
+
+        Returns:
+            None
+
+        """
+        # cancel() is called from another thread & pooled connections move between threads
+        self._conn = sqlite3.connect("file::memory:", uri=True, check_same_thread=False)
+        self._conn.execute(
+            "ATTACH DATABASE ? AS %s" % schema,
+            (f"file:{pathname2url(osp.abspath(database_path))}?mode=ro",),
+        )
+        self._conn.create_function("DATEDIFF", 3, datediff)
+        self._conn.create_function("GREATEST", -1, greatest)
+        self._conn.create_function("LEAST", -1, least)
+
+        self._timeout_seconds = None
+        self._expires_at = None
+        self._conn.set_progress_handler(self._is_expired, 1000)
+
+    def _is_expired(self):
+        # a non-zero return interrupts the query
+        return self._expires_at is not None and time.monotonic() > self._expires_at
+
+    def _start_query(self):
+        if self._timeout_seconds is not None:
+            self._expires_at = time.monotonic() + self._timeout_seconds
+
+    def _end_query(self):
+        self._expires_at = None
+
+    def cursor(self):
+        return LocalCursor(self)
+
+    def cancel(self):
+        self._conn.interrupt()
+
+    def rollback(self):
+        # as in Redshift, a SET in the transaction is undone by its rollback
+        self._timeout_seconds = None
+        self._conn.rollback()
+
+    def close(self):
+        self._conn.close()
+
+
+class LocalDatabase(object):
+    def __init__(self, database_path, schema="cmsdesynpuf23m", **fixture_kwargs):
+        """Local execution backend. The fixture database is created if `database_path` doesn't exist.
+
+        Args:
+            database_path (str): Path to the SQLite database file.
+            schema (str): Schema name of the tables in the queries (`config.SCHEMA`).
+            fixture_kwargs: Arguments of `create_fixture_database` (e.g. n_persons), used if the database is created.
+
+        Returns:
+            None
+
+        """
+        if not osp.exists(database_path):
+            create_fixture_database(database_path, **fixture_kwargs)
+        self.database_path = database_path
+        self.schema = schema
+
+    @property
+    def data_version(self):
+        """Data version tag of the local database (for the result caches): changes when the file is rewritten."""
+        return f"local:{osp.abspath(self.database_path)}:{osp.getmtime(self.database_path)}"
+
+    def connect(self, redshift_parameters, user, password, connect_timeout=None):
+        """Connect to the local database (the Redshift parameters & credentials are ignored).
+
+        Args:
+            redshift_parameters (dict): Redshift connection parameters (not used).
+            user (str): Redshift user (not used).
+            password (str): Password associated to the user (not used).
+            connect_timeout (int): Not used.
+
+        Returns:
+            LocalConnection: Connection to the local database.
+
+        """
+        return LocalConnection(self.database_path, self.schema)
+
+
+def _get_vocabulary(stand_in_names):
+    """Concepts, 'Maps to' relationships and ancestors of the fixture drugs & conditions."""
+    concepts, relationships, ancestors = [], [], []
+    drug_ids, condition_ids = [], []
+
+    def add_standard(concept_id, name, domain, vocabulary, concept_class, code):
+        concepts.append(
+            (concept_id, name, domain, vocabulary, concept_class, "S", code)
+        )
+        relationships.append((concept_id, concept_id, "Maps to"))
+        ancestors.append((concept_id, concept_id, 0, 0))
+
+    for i, (category, _, code, description) in enumerate(stand_in_names.values()):
+        if category == "MEDICATION":
+            ingredient_id = 1100000 + 10 * i
+            add_standard(
+                ingredient_id, description, "Drug", "RxNorm", "Ingredient", code
+            )
+            drug_ids.append(ingredient_id)
+            for j, dose in enumerate((81, 325, 500), 1):
+                drug_id = ingredient_id + j
+                name = f"{description} {dose} MG Oral Tablet"
+                add_standard(
+                    drug_id, name, "Drug", "RxNorm", "Clinical Drug", f"{code}{j}"
+                )
+                ancestors.append((ingredient_id, drug_id, 1, 1))
+                drug_ids.append(drug_id)
+        else:
+            source_id = 45500000 + 10 * i
+            standard_id = 200000 + 10 * i
+            concepts.append(
+                (
+                    source_id,
+                    description,
+                    "Condition",
+                    "ICD10CM",
+                    "ICD10 code",
+                    None,
+                    code,
+                )
+            )
+            add_standard(
+                standard_id,
+                description,
+                "Condition",
+                "SNOMED",
+                "Clinical Finding",
+                f"S{i}",
+            )
+            relationships.append((source_id, standard_id, "Maps to"))
+            condition_ids.append(standard_id)
+            for j in (1, 2):
+                child_id = standard_id + j
+                name = f"{description}, subtype {j}"
+                add_standard(
+                    child_id,
+                    name,
+                    "Condition",
+                    "SNOMED",
+                    "Clinical Finding",
+                    f"S{i}.{j}",
+                )
+                ancestors.append((standard_id, child_id, 1, 1))
+                condition_ids.append(child_id)
+
+    for concept_id, name, domain in DEMOGRAPHIC_CONCEPTS:
+        concepts.append((concept_id, name, domain, domain, domain, "S", name))
+
+    return concepts, relationships, ancestors, drug_ids, condition_ids
+
+
+def create_fixture_database(database_path, n_persons=1000, events_per_person=3, seed=0):
+    """Write a synthetic OMOP CDM database (deterministic for a given seed).
+
+    Args:
+        database_path (str): Path of the SQLite database file to create.
+        n_persons (int): Number of persons.
+        events_per_person (int): Average number of visits, conditions & drug exposures per person.
+        seed (int): Random seed.
+
+    Returns:
+        None
+
+    """
+    from stand_ins import STAND_IN_CM_NAMES
+
+    rng = random.Random(seed)
+    with open(STATE_PATTERNS_PATH, "r") as fp:
+        states = list(json.load(fp))
+
+    concepts, relationships, ancestors, drug_ids, condition_ids = _get_vocabulary(
+        STAND_IN_CM_NAMES
+    )
+    genders = [8507, 8532]
+    races = [8516, 8527, 8515]
+    ethnicities = [38003563, 38003564]
+
+    def random_date():
+        return FIXTURE_START_DATE + datetime.timedelta(days=rng.randrange(FIXTURE_DAYS))
+
+    locations = [
+        (i, f"{i} Main Street", f"City {i}", state, f"{10000 + i}", None)
+        for i, state in enumerate(states, 1)
+    ]
+    persons, visits, conditions, drugs, periods, deaths = [], [], [], [], [], []
+    for person_id in range(1, n_persons + 1):
+        birth = datetime.date(
+            rng.randint(1920, 2005), rng.randint(1, 12), rng.randint(1, 28)
+        )
+        gender, race, ethnicity = (
+            rng.choice(genders),
+            rng.choice(races),
+            rng.choice(ethnicities),
+        )
+        persons.append(
+            (
+                person_id,
+                gender,
+                birth.year,
+                birth.month,
+                birth.day,
+                birth.isoformat(),
+                race,
+                ethnicity,
+                rng.randrange(1, len(locations) + 1),
+                None,
+                None,
+                None,
+            )
+        )
+        periods.append(
+            (
+                person_id,
+                person_id,
+                FIXTURE_START_DATE.isoformat(),
+                (
+                    FIXTURE_START_DATE + datetime.timedelta(days=FIXTURE_DAYS)
+                ).isoformat(),
+            )
+        )
+        for _ in range(rng.randint(0, 2 * events_per_person)):
+            start = random_date()
+            end = start + datetime.timedelta(days=rng.randint(0, 10))
+            visit_id = len(visits) + 1
+            visits.append(
+                (
+                    visit_id,
+                    person_id,
+                    rng.choice((9201, 9202)),
+                    start.isoformat(),
+                    end.isoformat(),
+                    44818517,
+                )
+            )
+        for _ in range(rng.randint(0, 2 * events_per_person)):
+            start = random_date()
+            end = start + datetime.timedelta(days=rng.randint(0, 90))
+            conditions.append(
+                (
+                    len(conditions) + 1,
+                    person_id,
+                    rng.choice(condition_ids),
+                    start.isoformat(),
+                    end.isoformat(),
+                    32020,
+                    None,
+                )
+            )
+        for _ in range(rng.randint(0, 2 * events_per_person)):
+            start = random_date()
+            days_supply = rng.choice((7, 30, 90))
+            end = start + datetime.timedelta(days=days_supply)
+            drugs.append(
+                (
+                    len(drugs) + 1,
+                    person_id,
+                    rng.choice(drug_ids),
+                    start.isoformat(),
+                    end.isoformat(),
+                    days_supply,
+                    float(days_supply),
+                    38000177,
+                    None,
+                )
+            )
+        if rng.random() < 0.05:
+            deaths.append(
+                (person_id, random_date().isoformat(), rng.choice(condition_ids))
+            )
+
+    rows = {
+        "person": persons,
+        "concept": [
+            concept + ("1970-01-01", "2099-12-31", None) for concept in concepts
+        ],
+        "concept_relationship": [
+            relationship + ("1970-01-01", "2099-12-31", None)
+            for relationship in relationships
+        ],
+        "concept_ancestor": ancestors,
+        "location": locations,
+        "visit_occurrence": visits,
+        "condition_occurrence": conditions,
+        "drug_exposure": drugs,
+        "observation_period": periods,
+        "death": deaths,
+    }
+
+    conn = sqlite3.connect(database_path)
+    try:
+        for table, columns in OMOP_TABLES.items():
+            conn.execute(f"CREATE TABLE {table} ({columns})")
+            if rows[table]:
+                placeholders = ", ".join("?" * len(rows[table][0]))
+                conn.executemany(
+                    f"INSERT INTO {table} VALUES ({placeholders})", rows[table]
+                )
+        for table, column in INDEXES:
+            conn.execute(f"CREATE INDEX {table}_{column} ON {table} ({column})")
+        conn.commit()
+    finally:
+        conn.close()
+
+
+def check_queries(database, queries):
+    """Execute queries on a local database.
+
+    Args:
+        database (LocalDatabase): Local database.
+        queries (list): Ready-to-execute Redshift SQL queries.
+
+    Returns:
+        list: Queries that failed, with their error message.
+
+    """
+    from step6.query_execution import QueryCanceledError
+
+    failures = []
+    conn = database.connect(None, None, None)
+    try:
+        for query in queries:
+            try:
+                cursor = conn.cursor()
+                cursor.execute(query)
+                cursor.fetchall()
+            except (sqlite3.Error, QueryCanceledError) as e:
+                failures.append((query, str(e)))
+    finally:
+        conn.close()
+    return failures
+
+
+if __name__ == "__main__":
+
+    sys.path.append(osp.join(osp.dirname(osp.abspath(__file__)), "..", "..", ".."))
+    import src  # adds the tool folders to the path
+
+    parser = argparse.ArgumentParser(
+        description="Create a synthetic OMOP CDM SQLite database."
+    )
+    parser.add_argument(
+        "--output", required=True, help="SQLite database file to create"
+    )
+    parser.add_argument("--persons", type=int, default=1000)
+    parser.add_argument("--events-per-person", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument(
+        "--check-gt-templates",
+        action="store_true",
+        help="Check that the corrected ground-truth templates execute on the database (created if missing)",
+    )
+    args = parser.parse_args()
+
+    if not args.check_gt_templates:
+        create_fixture_database(
+            args.output, args.persons, args.events_per_person, args.seed
+        )
+        print(f"Created {args.output}")
+        sys.exit(0)
+
+    from src import config
+    from step5.sql_processing import render_template_query
+    from utils.metrics import GT_QUERY_CORRECTIONS
+
+    database = LocalDatabase(
+        args.output,
+        schema=config.SCHEMA,
+        n_persons=args.persons,
+        events_per_person=args.events_per_person,
+        seed=args.seed,
+    )
+    templates = sorted(set(GT_QUERY_CORRECTIONS.values()))
+    failures = check_queries(
+        database,
+        [render_template_query(config, template, {}) for template in templates],
+    )
+    for query, error in failures:
+        print(f"FAILED: {error}\n    {query}")
+    print(f"{len(templates) - len(failures)}/{len(templates)} templates executed")
+    sys.exit(1 if failures else 0)
@@ -5,7 +5,7 @@ SPDX-License-Identifier: CC-BY-NC-4.0
 """
 
 import logging
-import psycopg2
+import functools
 
 # import boto3
 import pandas as pd
@@ -15,18 +15,38 @@ import logging
 logger = logging.getLogger(__name__)
 
 
-def connect_to_db(redshift_parameters, user, password):
+class QueryCanceledError(Exception):
+    """Query cancelled by a backend without its own error for it (statement timeout or `cancel()`), e.g. the local database."""
+
+
+@functools.lru_cache(maxsize=None)
+def _get_query_canceled_errors():
+    """Exception types raised by cancelled queries (psycopg2's one only if it is installed)."""
+    try:
+        from psycopg2.extensions import QueryCanceledError as PgQueryCanceledError
+    except ImportError:
+        return (QueryCanceledError,)
+    return (PgQueryCanceledError, QueryCanceledError)
+
+
+def connect_to_db(redshift_parameters, user, password, connect_timeout=None):
     """Connect to database and returns connection
 
     Args:
         redshift_parameters (dict): Redshift connection parameters.
         user (str): Redshift user required to connect.
         password (str): Password associated to the user
+        connect_timeout (int): Seconds to wait for the connection. Default to None for no timeout.
 
     Returns:
         Connection: boto3 redshift connection
 
     """
+    import psycopg2
+
+    kwargs = {}
+    if connect_timeout is not None:
+        kwargs["connect_timeout"] = max(int(connect_timeout), 1)
 
     try:
         conn = psycopg2.connect(
@@ -35,6 +55,7 @@ def connect_to_db(redshift_parameters, user, password):
             user=user,
             password=password,
             database=redshift_parameters["database"],
+            **kwargs,
         )
 
         return conn
@@ -44,24 +65,36 @@ def connect_to_db(redshift_parameters, user, password):
         print("Failed")
 
 
-def execute_query(cursor, query, limit=None):
+def execute_query(cursor, query, limit=None, timeout_seconds=None):
     """Execute query
 
     Args:
         cursor (boto3 cursor): boto3 object pointing and with established connection to Redshift.
         query (str): SQL query.
         limit (int): Limit of rows returned by the data frame. Default to "None" for no limit
+        timeout_seconds (float): Statement timeout: the query is cancelled by the server after it. Default to None for the session default.
 
     Returns:
         pd.DataFrame: Data Frame with the query results.
 
+    Raises:
+        psycopg2.extensions.QueryCanceledError: The query exceeded `timeout_seconds` or was cancelled (`QueryCanceledError` for local connections).
+
     """
+    if timeout_seconds is not None:
+        cursor.execute(
+            "SET statement_timeout TO %d" % max(int(timeout_seconds * 1000), 1)
+        )
+
     try:
         cursor.execute(query)
+    except _get_query_canceled_errors():
+        raise
     except:
         return None
 
-    columns = [c.name for c in cursor.description]
+    # first item of the column description: psycopg2 & sqlite3 cursors
+    columns = [c[0] for c in cursor.description]
     results = cursor.fetchall()
     if limit:
         results = results[:limit]
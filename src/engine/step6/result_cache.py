@@ -0,0 +1,246 @@
+"""
+Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+
+SPDX-License-Identifier: CC-BY-NC-4.0
+"""
+
+# This module contains the cache of executed query results.
+# Results are keyed by the ready-to-execute SQL query and a data version tag (e.g. the OMOP CDM snapshot date),
+# so bumping the data version invalidates all the previous results. Results are kept in a memory tier
+# bounded in bytes (least recently used results are evicted first) and, optionally, in an on-disk Parquet tier.
+
+import os
+import time
+import hashlib
+import logging
+import threading
+from os import path as osp
+from collections import OrderedDict
+
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+
+def get_dataframe_size(df):
+    """Memory used by a data frame in bytes (including object values).
+
+    Args:
+        df (pd.DataFrame): Data frame.
+
+    Returns:
+        int: Size in bytes.
+
+    """
+    return int(df.memory_usage(index=True, deep=True).sum())
+
+
+class ResultCache(object):
+    def __init__(
+        self,
+        data_version="",
+        ttl_seconds=None,
+        max_memory_bytes=256 * 2 ** 20,
+        cache_dir=None,
+    ):
+        """Initialize an empty result cache.
+
+        Args:
+            data_version (str): Version tag of the data queried. Part of the key of every result.
+            ttl_seconds (float): Time to live of the results. Default to None for no expiration.
+            max_memory_bytes (int): Maximum size of the results kept in memory. Default to 256MB.
+            cache_dir (str): Directory of the on-disk Parquet tier. Default to None for memory only.
+
+        Returns:
+            None
+
+        """
+        self.data_version = data_version
+        self.ttl_seconds = ttl_seconds
+        self.max_memory_bytes = max_memory_bytes
+        self.cache_dir = cache_dir
+        if cache_dir:
+            os.makedirs(cache_dir, exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._memory = OrderedDict()
+        self._memory_bytes = 0
+
+    def _get_key(self, sql_query, scope):
+        """Key of a result.
+
+        Args:
+            sql_query (str): Ready-to-execute SQL query.
+            scope (str): Optional scope of the result (e.g. DB user).
+
+        Returns:
+            str: Hexadecimal key.
+
+        """
+        key = "\x00".join((self.data_version, scope or "", sql_query))
+        return hashlib.sha256(key.encode("utf-8")).hexdigest()
+
+    def _get_path(self, key):
+        return osp.join(self.cache_dir, f"{key}.parquet")
+
+    def _is_expired(self, created_at):
+        return (
+            self.ttl_seconds is not None and time.time() - created_at > self.ttl_seconds
+        )
+
+    def _memory_put(self, key, df, created_at):
+        """Add a result to the memory tier, evicting the least recently used results if needed."""
+        size = get_dataframe_size(df)
+        if size > self.max_memory_bytes:
+            return
+
+        with self._lock:
+            self._memory_pop(key)
+            self._memory[key] = (created_at, df, size)
+            self._memory_bytes += size
+            while self._memory_bytes > self.max_memory_bytes:
+                self._memory_pop(next(iter(self._memory)))
+
+    def _memory_pop(self, key):
+        """Remove a result from the memory tier. Lock must be held."""
+        item = self._memory.pop(key, None)
+        if item is not None:
+            self._memory_bytes -= item[2]
+
+    def _memory_get(self, key):
+        with self._lock:
+            item = self._memory.get(key)
+            if item is None:
+                return None
+            if self._is_expired(item[0]):
+                self._memory_pop(key)
+                return None
+            self._memory.move_to_end(key)
+            return item[1]
+
+    def _disk_get(self, key):
+        if not self.cache_dir:
+            return None, None
+
+        filepath = self._get_path(key)
+        try:
+            created_at = osp.getmtime(filepath)
+            if self._is_expired(created_at):
+                os.remove(filepath)
+                return None, None
+            return pd.read_parquet(filepath), created_at
+        except FileNotFoundError:
+            return None, None
+        except Exception:
+            logger.exception(f"Failed to read cached result {filepath}.")
+            return None, None
+
+    def _disk_put(self, key, df):
+        if not self.cache_dir:
+            return
+
+        filepath = self._get_path(key)
+        temp_filepath = f"{filepath}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            df.to_parquet(temp_filepath, index=False)
+            os.replace(temp_filepath, filepath)
+        except ImportError:
+            logger.warning(
+                "Parquet engine not available: on-disk result cache disabled."
+            )
+            self.cache_dir = None
+        except Exception as e:
+            # e.g. duplicated or non-string column names
+            logger.warning(f"Result can't be cached on disk as Parquet: {e}")
+            if osp.exists(temp_filepath):
+                os.remove(temp_filepath)
+
+    def get(self, sql_query, scope=None):
+        """Get the cached result of a query.
+
+        Args:
+            sql_query (str): Ready-to-execute SQL query.
+            scope (str): Optional scope of the result (e.g. DB user). Default to None.
+
+        Returns:
+            pd.DataFrame: Copy of the cached result. None if not cached or expired.
+
+        """
+        key = self._get_key(sql_query, scope)
+        df = self._memory_get(key)
+        if df is None:
+            df, created_at = self._disk_get(key)
+            if df is None:
+                return None
+            self._memory_put(key, df, created_at)
+        return df.copy()
+
+    def put(self, sql_query, df, scope=None):
+        """Cache the result of a query.
+
+        Args:
+            sql_query (str): Ready-to-execute SQL query.
+            df (pd.DataFrame): Result of the query. Not cached if None.
+            scope (str): Optional scope of the result (e.g. DB user). Default to None.
+
+        Returns:
+            None
+
+        """
+        if df is None:
+            return
+        key = self._get_key(sql_query, scope)
+        df = df.copy()
+        self._memory_put(key, df, time.time())
+        self._disk_put(key, df)
+
+    def invalidate(self, sql_query=None, scope=None):
+        """Remove the cached result of a query, or all the cached results.
+
+        Args:
+            sql_query (str): Ready-to-execute SQL query. Default to None for all the results.
+            scope (str): Optional scope of the result (e.g. DB user). Default to None.
+
+        Returns:
+            None
+
+        """
+        if sql_query is None:
+            with self._lock:
+                self._memory.clear()
+                self._memory_bytes = 0
+            if self.cache_dir:
+                for fn in os.listdir(self.cache_dir):
+                    if fn.endswith(".parquet"):
+                        os.remove(osp.join(self.cache_dir, fn))
+            return
+
+        key = self._get_key(sql_query, scope)
+        with self._lock:
+            self._memory_pop(key)
+        if self.cache_dir and osp.exists(self._get_path(key)):
+            os.remove(self._get_path(key))
+
+    def set_data_version(self, data_version):
+        """Change the data version. Results of previous versions are no longer returned.
+
+        Args:
+            data_version (str): New version tag of the data queried.
+
+        Returns:
+            None
+
+        """
+        with self._lock:
+            self.data_version = data_version
+            self._memory.clear()
+            self._memory_bytes = 0
+
+    @property
+    def memory_bytes(self):
+        """Size of the results kept in memory in bytes."""
+        return self._memory_bytes
+
+    def __len__(self):
+        """Number of results kept in memory."""
+        return len(self._memory)
@@ -0,0 +1,91 @@
+"""
+Copyright Amazon.com, Inc. or its affiliates. All Rights Reserved.
+
+SPDX-License-Identifier: CC-BY-NC-4.0
+"""
+
+# This module contains the order-insensitive fingerprint of query results.
+# Each row is hashed (vectorized, with two independent hash keys) and the row hashes are summed
+# modulo 2^64: the sums don't depend on the row order, so two results with the same rows (as a
+# multiset) have the same fingerprint. Results are compared in linear time, chunk by chunk, and the
+# fingerprints are short strings that can be stored to compare results later without keeping them.
+
+import numpy as np
+import pandas as pd
+
+# Two independent row hashes make accidental collisions negligible (16 characters each).
+HASH_KEYS = ("0123456789123456", "nl2sql-result-fp")
+
+CHUNK_SIZE = 100000
+
+# Inferred types of object columns holding numbers (e.g. DECIMAL columns are fetched as Decimal objects).
+NUMERIC_OBJECT_TYPES = (
+    "decimal",
+    "integer",
+    "floating",
+    "mixed-integer-float",
+    "mixed",
+)
+
+
+def _normalize(df):
+    """Use the same representation for equal values of different types (e.g. 1, 1.0 & Decimal("1"))."""
+    columns = {}
+    for i, (_, values) in enumerate(df.items()):
+        if pd.api.types.is_numeric_dtype(values):
+            # numbers & booleans as floats, + 0.0 turns -0.0 into 0.0
+            values = values.astype("float64") + 0.0
+        elif pd.api.types.infer_dtype(values, skipna=True) in NUMERIC_OBJECT_TYPES:
+            try:
+                values = pd.to_numeric(values) + 0.0
+            except (ValueError, TypeError):
+                # not only numbers
+                pass
+        columns[i] = values
+    return pd.DataFrame(columns, index=df.index)
+
+
+def get_result_fingerprint(df):
+    """Order-insensitive fingerprint of a result table (column names are not part of it).
+
+    Args:
+        df (pd.DataFrame): Query result.
+
+    Returns:
+        str: Fingerprint. None if `df` is None.
+
+    """
+    if df is None:
+        return None
+
+    sums = [np.uint64(0) for _ in HASH_KEYS]
+    with np.errstate(over="ignore"):
+        for start in range(0, df.shape[0], CHUNK_SIZE):
+            chunk = _normalize(df.iloc[start : start + CHUNK_SIZE])
+            for i, hash_key in enumerate(HASH_KEYS):
+                row_hashes = pd.util.hash_pandas_object(
+                    chunk, index=False, hash_key=hash_key
+                ).values
+                # uint64 sums wrap around: sum modulo 2^64
+                sums[i] += row_hashes.sum(dtype=np.uint64)
+
+    digest = "".join(f"{int(value):016x}" for value in sums)
+    return f"{df.shape[0]}x{df.shape[1]}:{digest}"
+
+
+def results_match(df1, df2):
+    """Whether two results have the same rows, in any order.
+
+    Args:
+        df1 (pd.DataFrame): Query result (or its fingerprint).
+        df2 (pd.DataFrame): Query result (or its fingerprint).
+
+    Returns:
+        bool: True if the results have the same rows. False if any of them is None.
+
+    """
+    fingerprints = [
+        df if isinstance(df, str) or df is None else get_result_fingerprint(df)
+        for df in (df1, df2)
+    ]
+    return fingerprints[0] is not None and fingerprints[0] == fingerprints[1]
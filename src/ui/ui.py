@@ -14,11 +14,11 @@ sys.path.append(current_folder)
 import ipywidgets as widgets
 from IPython.core.display import display, HTML
 import re
-from copy import deepcopy
 import pandas as pd
 import json
 import datetime
 import layouts
+from entity_records import EntityRecord, copy_entities, entities_to_dicts
 from detection_visualizer import (
     renderer,
     prepare_visualization_input_for_raw_entities,
@@ -453,8 +453,8 @@ class UI(object):
         record = {
             "time": now,
             "input": self.nlq,
-            "args original": self.original_proc_entities,
-            "args corrected": self.proc_entities,
+            "args original": entities_to_dicts(self.original_proc_entities),
+            "args corrected": entities_to_dicts(self.proc_entities),
             "correct": True if self.feedback_options.value == "Successful" else False,
         }
 
@@ -513,7 +513,7 @@ class UI(object):
         self.nlq = self.input_box.value
         self.entities = self.tool.detect_entities(self.nlq)
         self.proc_entities = self.tool.process_entities(self.entities)
-        self.original_proc_entities = deepcopy(self.proc_entities)
+        self.original_proc_entities = copy_entities(self.proc_entities)
 
         self._display_main()
         self._update_options()
@@ -577,19 +577,15 @@ class UI(object):
         current_names = set([d["Text"] for d in self.entities[category]])
         if name not in current_names:
             for match in re.finditer(p, self.nlq):
-                detected_entity = {
-                    "BeginOffset": match.start(),
-                    "EndOffset": match.end(),
-                    "Text": name,
-                }
+                detected_entity = EntityRecord(match.start(), match.end(), name)
 
                 # add to raw entities
-                self.entities[category].append(deepcopy(detected_entity))
+                self.entities[category].append(detected_entity)
 
                 # process & add to proc entities
                 placeholder_idx_strat = {category: len(self.proc_entities[category])}
                 proc_detected_entity = self.tool.process_entities(
-                    {category: [deepcopy(detected_entity)]},
+                    {category: [detected_entity]},
                     start_indices=placeholder_idx_strat,
                 )
                 self.proc_entities[category].append(proc_detected_entity[category][0])
@@ -667,9 +663,12 @@ class UI(object):
 
         """
         if hasattr(self, "nlq"):
-            for d in self.proc_entities["DRUG"]:
+            proc_entities = self.proc_entities["DRUG"]
+            for i, d in enumerate(proc_entities):
                 if d["Text"] == self.mapped_drug_category.value:
-                    d["Query-arg"] = self.mapped_update_drug_text.value
+                    proc_entities[i] = d.replace(
+                        query_arg=self.mapped_update_drug_text.value
+                    )
                     break
 
             self._visualize_drug_info()
@@ -688,9 +687,12 @@ class UI(object):
 
         """
         if hasattr(self, "nlq"):
-            for d in self.proc_entities["CONDITION"]:
+            proc_entities = self.proc_entities["CONDITION"]
+            for i, d in enumerate(proc_entities):
                 if d["Text"] == self.mapped_condition_category.value:
-                    d["Query-arg"] = self.mapped_update_condition_text.value
+                    proc_entities[i] = d.replace(
+                        query_arg=self.mapped_update_condition_text.value
+                    )
                     break
 
             self._visualize_condition_info()